@@ -0,0 +1,181 @@
+# auth.py
+
+"""
+ws 连接认证: 多 token 与权限范围
+
+token 只以 SHA-256 摘要保存在 TOKEN_FILE (默认 config/tokens.json) 中，明文只在签发时输出一次:
+    {"tokens": {"phone": {"sha256": "<摘要>", "scopes": ["SystemMonitor", "StrMsg.get_latest_messages"]}}}
+
+权限范围 (scopes):
+    "*"                 全部插件与方法 (包括 pluginManager)
+    "插件名"             该插件的全部方法
+    "插件名.方法名"       该插件的指定方法
+
+握手时验证一次 token，得到的 Grant 缓存在连接上，之后每条消息的授权检查只是集合查找。
+配置项 TOKEN 仍然有效，视为拥有全部权限、名为 "default" 的 token。
+
+签发、吊销与列出 token:
+    python auth.py issue phone SystemMonitor StrMsg.get_latest_messages
+    python auth.py revoke phone
+    python auth.py list
+"""
+
+import os
+import sys
+import hmac
+import json
+import hashlib
+import secrets
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN_FILE = "config/tokens.json"
+
+
+def digest(token):
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class Grant:
+    """一个 token 的权限范围"""
+    __slots__ = ("name", "all", "plugins", "methods")
+
+    def __init__(self, name, scopes):
+        self.name = name
+        self.set_scopes(scopes)
+
+    def set_scopes(self, scopes):
+        """就地更新权限范围，已建立的连接持有同一个对象，立即生效"""
+        self.all = "*" in scopes
+        self.plugins = frozenset(scope for scope in scopes if scope != "*" and "." not in scope)
+        self.methods = frozenset(tuple(scope.split(".", 1)) for scope in scopes if "." in scope)
+
+    def allows(self, plugin, method):
+        return self.all or plugin in self.plugins or (plugin, method) in self.methods
+
+    def scopes(self):
+        if self.all:
+            return ["*"]
+        return sorted(self.plugins) + sorted(f"{plugin}.{method}" for plugin, method in self.methods)
+
+
+class TokenStore:
+    """
+    按摘要查找 token
+
+    查找以 SHA-256 摘要为键: 查找耗时只与摘要有关，不会泄露明文 token 与已有 token 有几个字符相同，
+    命中后再用 hmac.compare_digest 做一次定长比较。
+
+    token 文件修改后由 refresh() 重新读取: 仍存在的 token 就地更新权限，被吊销或替换的 token 权限清空，
+    已用它建立的连接之后的消息都会被拒绝。
+    """
+    def __init__(self, path=TOKEN_FILE, default_token=None):
+        self.path = path
+        self.default = None
+        if default_token:
+            self.default = (digest(default_token), Grant("default", ["*"]))
+        self.by_digest = {}     # 摘要 -> (摘要, Grant)
+        self.stamp = None
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """token 文件的 mtime 或大小变化时重新读取，返回是否发生了变化"""
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self.stamp and not force:
+            return False
+        self.stamp = stamp
+
+        previous = self.by_digest
+        by_digest = {}
+        if self.default is not None:
+            by_digest[self.default[0]] = self.default
+        for name, entry in read_tokens(self.path).items():
+            try:
+                key = bytes.fromhex(entry["sha256"])
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"[ ws 认证 ] token {name} 缺少有效的 sha256 摘要，已忽略")
+                continue
+            scopes = entry.get("scopes") or []
+            found = previous.get(key)
+            if found is not None:
+                grant = found[1]
+                grant.name = name
+                grant.set_scopes(scopes)
+            else:
+                grant = Grant(name, scopes)
+            by_digest[key] = (key, grant)
+        for key, (_, grant) in previous.items():
+            if key not in by_digest:
+                grant.set_scopes([])  # 已吊销
+        self.by_digest = by_digest
+        logger.info(f"[ ws 认证 ] 已载入 {len(by_digest)} 个 token")
+        return True
+
+    def verify(self, token):
+        """验证 token，有效时返回其 Grant，否则返回 None"""
+        key = digest(token)
+        found = self.by_digest.get(key)
+        if found is None or not hmac.compare_digest(found[0], key):
+            return None
+        return found[1]
+
+
+def read_tokens(path=TOKEN_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("tokens") or {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError) as e:
+        logger.error(f"[ ws 认证 ] 读取 {path} 失败: {e}")
+        return {}
+
+
+def write_tokens(tokens, path=TOKEN_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"tokens": tokens}, f, ensure_ascii=False, indent=4)
+    os.replace(temp_path, path)
+
+
+def issue(name, scopes, path=TOKEN_FILE):
+    """签发 token，返回明文 (只有此时可以得到)；同名 token 会被替换"""
+    token = secrets.token_urlsafe(32)  # 只含 A-Z a-z 0-9 - _，可直接作为子协议
+    tokens = read_tokens(path)
+    tokens[name] = {"sha256": digest(token).hex(), "scopes": list(scopes)}
+    write_tokens(tokens, path)
+    return token
+
+
+def revoke(name, path=TOKEN_FILE):
+    tokens = read_tokens(path)
+    if tokens.pop(name, None) is None:
+        return False
+    write_tokens(tokens, path)
+    return True
+
+
+def main(argv):
+    if len(argv) >= 3 and argv[0] == "issue":
+        token = issue(argv[1], argv[2:])
+        print(f"token {argv[1]} 已签发，请妥善保存 (不会再次显示):\n{token}")
+    elif len(argv) == 2 and argv[0] == "revoke":
+        print(f"token {argv[1]} 已吊销" if revoke(argv[1]) else f"token {argv[1]} 不存在")
+    elif len(argv) == 1 and argv[0] == "list":
+        for name, entry in read_tokens().items():
+            print(f"{name}: {', '.join(entry.get('scopes') or [])}")
+    else:
+        print("用法: python auth.py issue <名称> <权限范围> [权限范围 ...] | revoke <名称> | list")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main(sys.argv[1:]))
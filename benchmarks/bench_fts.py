@@ -0,0 +1,145 @@
+# benchmarks/bench_fts.py
+"""
+消息全文搜索基准测试
+
+在临时数据库中生成一百万条模拟通知 (10 个按天分区的 id 范围，中英文混合，词频近似 Zipf 分布)，
+按 DBservice 的方式 (search.py 的分词预处理与索引表结构) 逐条写入 FTS5 索引，报告:
+  - 建立索引的速率与索引占用的空间
+  - 各类查询 (稀有词、常见词、前缀、中文词、多词、深翻页) 取前 20 条的耗时，并与 LIKE 全表扫描对比
+  - 清理时按 id 范围删除一天的索引的耗时
+
+用法: python benchmarks/bench_fts.py [消息数]
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plugins.p_StrMsg.services.search import FTS_TABLE, FTS_COLUMNS, create_index, document, match_expression
+
+DAYS = 10
+ID_SPAN = 10 ** 7
+FIRST_DAY = 20260101
+RARE = "zebracorn"      # 每 10 万条出现一次
+
+CHINESE = ("今晚", "开会", "报表", "快递", "已签收", "验证码", "红包", "群聊", "消息", "提醒", "会议", "取消",
+           "明天", "下午", "项目", "进度", "审批", "通过", "付款", "成功", "账单", "还款", "航班", "延误",
+           "电影", "票", "外卖", "送达", "天气", "降温", "更新", "版本", "下载", "完成", "直播", "开始",
+           "评论", "回复", "点赞", "关注", "视频", "投稿", "歌单", "推荐", "邮件", "附件", "合同", "签字")
+ENGLISH = ("meeting", "report", "deploy", "build", "failed", "passed", "review", "merge", "release", "update",
+           "invoice", "payment", "order", "shipped", "delivered", "reminder", "calendar", "invite", "password",
+           "reset", "login", "alert", "server", "cpu", "memory", "disk", "backup", "weekly", "summary", "digest")
+APPS = ("微信", "QQ", "邮件", "哔哩哔哩", "网易云音乐", "GitHub", "Outlook", None)
+SOURCES = ("手机", "5600G的Chrome", "平板", "NAS")
+
+
+def zipf_weights(n):
+    return [1 / (rank + 1) for rank in range(n)]
+
+
+def corpus(count, seed=1):
+    """生成 (id, source, data)"""
+    rng = random.Random(seed)
+    words = CHINESE + ENGLISH
+    weights = zipf_weights(len(words))
+    per_day = count // DAYS
+    for i in range(count):
+        day, index = divmod(i, per_day)
+        title = "".join(rng.choices(CHINESE, k=2)) + " " + rng.choice(ENGLISH)
+        message = " ".join(rng.choices(words, weights, k=rng.randint(5, 20)))
+        if i % 100000 == 7:
+            message += " " + RARE
+        data = {"title": title, "content": {"message": message, "appname": rng.choice(APPS)}}
+        yield (FIRST_DAY + min(day, DAYS - 1)) * ID_SPAN + index + 1, rng.choice(SOURCES), data
+
+
+def timed_ms(func, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    path = os.path.join(tempfile.mkdtemp(), "bench_fts.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, title TEXT, message TEXT, source TEXT, appname TEXT)")
+    create_index(db)
+    insert = f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) VALUES (?, ?, ?, ?, ?)"
+
+    # 与 store_message 一样每条消息单独写入索引，每 1000 条提交一次
+    start = time.perf_counter()
+    index_seconds = 0
+    for n, (row_id, source, data) in enumerate(corpus(count), 1):
+        content = data["content"]
+        db.execute("INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+                   (row_id, data["title"], content["message"], source, content["appname"]))
+        t = time.perf_counter()
+        db.execute(insert, (row_id, *document(source, data)))
+        index_seconds += time.perf_counter() - t
+        if n % 1000 == 0:
+            db.commit()
+    db.commit()
+    total = time.perf_counter() - start
+    print(f"写入 {count} 条消息: 共 {total:.1f} 秒，其中索引 {index_seconds:.1f} 秒 "
+          f"({count / index_seconds:.0f} 条/秒，平均 {index_seconds / count * 1e6:.1f} µs/条)")
+
+    sizes = dict(db.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall()) \
+        if db.execute("SELECT 1 FROM pragma_module_list WHERE name = 'dbstat'").fetchone() else {}
+    if sizes:
+        fts = sum(size for name, size in sizes.items() if name.startswith(FTS_TABLE))
+        print(f"原文 {sizes.get('messages', 0) / 2 ** 20:.1f} MB，全文索引 {fts / 2 ** 20:.1f} MB")
+    db.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    db.commit()
+
+    search = f"SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? ORDER BY rank, rowid DESC LIMIT ? OFFSET ?"
+    matches = f"SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?"
+    print(f"\n{'查询':<22}{'命中数':>10}{'前 20 条 (ms)':>16}")
+    for label, query, offset in (
+        ("稀有词", RARE, 0),
+        ("常见词", "meeting", 0),
+        ("前缀", "dep*", 0),
+        ("中文词", "验证码", 0),
+        ("多词", "快递 已签收 delivered", 0),
+        ("应用名", "哔哩哔哩 投稿", 0),
+        ("深翻页 (offset 1000)", "meeting", 1000),
+    ):
+        expression = match_expression(query)
+        hits = db.execute(matches, (expression,)).fetchone()[0]
+        ms, _ = timed_ms(lambda: db.execute(search, (expression, 20, offset)).fetchall())
+        print(f"{label:<22}{hits:>10}{ms:>16.2f}")
+
+    ms, _ = timed_ms(lambda: db.execute("SELECT id FROM messages WHERE message LIKE ? ORDER BY id DESC LIMIT 20",
+                                        (f"%{RARE}%",)).fetchall(), repeat=3)
+    print(f"{'LIKE 全表扫描 (稀有词)':<22}{'':>10}{ms:>16.2f}")
+
+    # 清理: 删除最早一天的索引 (按 id 范围分批，与 drop_partition 相同)
+    low, high = FIRST_DAY * ID_SPAN, (FIRST_DAY + 1) * ID_SPAN
+    start = time.perf_counter()
+    deleted = 0
+    while True:
+        cursor = db.execute(f'''DELETE FROM {FTS_TABLE} WHERE rowid IN (
+                                   SELECT rowid FROM {FTS_TABLE} WHERE rowid >= ? AND rowid < ? LIMIT 500
+                               )''', (low, high))
+        db.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < 500:
+            break
+    elapsed = time.perf_counter() - start
+    print(f"\n删除一天的索引 ({deleted} 条): {elapsed:.1f} 秒 ({deleted / elapsed:.0f} 条/秒)")
+
+    db.close()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# benchmarks/bench_hot_logging.py
+"""
+热路径日志基准测试
+
+模拟 setup_logging 的配置 (root logger 为 DEBUG，handler 为 INFO)，
+对比一次 webhook 请求 + 一次 ws 握手中，旧的 f-string 日志与 HotLogger 惰性日志的耗时。
+
+用法: python benchmarks/bench_hot_logging.py [次数]
+"""
+
+import io
+import os
+import sys
+import timeit
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from colorama import Fore, Style
+from log import get_hot_logger, invalidate_level_cache, color_tag
+
+logger = logging.getLogger("bench.hot_logging")
+hot = get_hot_logger("bench.hot_logging")
+
+POST_TAG = f"[ StrMsg / Routes > webhook | {color_tag('POST', Fore.CYAN)} ]"
+
+body = {
+    "title": "喵喵喵",
+    "source": "5600G的Chrome",
+    "message": "喵" * 2000,
+    "appname": "QQ",
+    "tags": ["urgent", "important"] * 20,
+}
+token = "EntranceToken"
+ua = "Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Mobile Safari/537.36"
+
+
+def request_before():
+    logger.info("[ ws 服务器 ] Upgrade | http://localhost > ws://127.0.0.1:8765 ")
+    logger.debug(f"[ ws 服务器 ] 用户 UA | \n {ua} ")
+    logger.debug(f"[ ws 服务器 ] 接收到的 Token 为：{token}")
+    logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 来自 IP : 127.0.0.1 的访问")
+    logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 收到来自 {body['source']} 的 POST 消息")
+    logger.debug(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 消息内容: {str(body)}")
+
+
+def request_after():
+    hot.info("[ ws 服务器 ] %s | %s > ws://%s ", "Upgrade", "http://localhost", "127.0.0.1:8765")
+    hot.debug("[ ws 服务器 ] 用户 UA | \n %s ", ua)
+    hot.debug("[ ws 服务器 ] 接收到的 Token 为：%s", token)
+    hot.info("%s 来自 IP : %s 的访问", POST_TAG, "127.0.0.1")
+    hot.info("%s 收到来自 %s 的 POST 消息", POST_TAG, body["source"])
+    hot.debug("%s 消息内容: %s", POST_TAG, body)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    # 与 setup_logging 相同的结构: root 为 DEBUG，过滤交给 handler
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    invalidate_level_cache()
+
+    for name, func in (("f-string (旧)", request_before), ("HotLogger (新)", request_after)):
+        handler.stream = io.StringIO()
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name:<16} {seconds / number * 1e6:8.2f} µs/请求")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# benchmarks/bench_isolation.py
+"""
+插件隔离基准测试
+
+用同一个回显插件，对比进程内调用 on_message 与经 IsolatedPlugin 转发到子进程的开销:
+逐条串行发送的单条延迟，以及 64 条并发在途时的吞吐。
+
+用法: python benchmarks/bench_isolation.py [次数]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import importlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loopmon import percentile
+from plugins.isolation import IsolatedPlugin
+
+ECHO_PLUGIN = '''
+import json
+
+class EchoPlugin:
+    def __init__(self, server):
+        self.server = server
+
+    async def on_message(self, websocket, message):
+        await websocket.send(json.dumps({"id": message["id"], "echo": message["data"]}))
+'''
+
+CONCURRENCY = 64
+
+
+class FakeConnections:
+    def get_by_socket(self, websocket):
+        return None
+
+
+class FakeServer:
+    worker_id = 0
+    workers = 1
+    connections = FakeConnections()
+
+    async def broadcast(self, payload, selector=None, timeout=None):
+        pass
+
+    def exitServer(self, reason):
+        pass
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def send(self, data, text=None):
+        self.received += 1
+
+
+def message(i):
+    return {"plugin": "Echo", "method": "echo", "id": i, "data": "喵" * 64}
+
+
+async def sequential(plugin, count):
+    websocket = FakeWebSocket()
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        await plugin.on_message(websocket, message(i))
+        latencies.append(time.perf_counter() - start)
+    assert websocket.received == count
+    latencies.sort()
+    return percentile(latencies, 50), percentile(latencies, 99)
+
+
+async def concurrent(plugin, count):
+    websocket = FakeWebSocket()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i):
+        async with semaphore:
+            await plugin.on_message(websocket, message(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    assert websocket.received == count
+    return count / elapsed
+
+
+async def bench(name, plugin, count):
+    await sequential(plugin, min(count, 200))  # 预热
+    p50, p99 = await sequential(plugin, count)
+    throughput = await concurrent(plugin, count * 5)
+    print(f"{name:<8} p50 {p50 * 1e6:8.1f} µs   p99 {p99 * 1e6:8.1f} µs   并发 {CONCURRENCY}: {throughput:9.0f} 条/秒")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "bench_echo_plugin.py"), "w", encoding="utf-8") as f:
+            f.write(ECHO_PLUGIN)
+        sys.path.insert(0, directory)  # spawn 启动的子进程会继承 sys.path
+
+        module = importlib.import_module("bench_echo_plugin")
+        await bench("进程内", module.EchoPlugin(FakeServer()), count)
+
+        isolated = IsolatedPlugin.create(FakeServer(), "bench_echo_plugin", "Echo")
+        await isolated.start()
+        try:
+            await bench("子进程", isolated, count)
+        finally:
+            await isolated.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+# benchmarks/bench_schema.py
+"""
+消息结构校验基准测试
+
+以 StrMsg 的 webhook 请求体为例，对比三种处理原始请求体 (bytes) 的方式:
+  - 手写: json.loads 后逐字段 body.get() 并做类型检查 (引入 schema 之前的写法)
+  - stdlib: schema.py 的标准库校验器
+  - pydantic: schema.py 的 pydantic-core 校验器 (JSON 解析与校验一次完成)
+
+用法: python benchmarks/bench_schema.py [次数]
+"""
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import schema
+from schema import Schema, SchemaError
+from plugins.p_StrMsg.models.models import WebhookBody
+
+BODY = json.dumps({
+    "title": "新消息",
+    "source": "QQ",
+    "message": "今晚八点开会，记得带上周的报表" * 4,
+    "appname": "QQ",
+    "priority": "2",
+    "tags": ["work", "meeting"],
+    "user_id": 10086,
+}, ensure_ascii=False).encode()
+
+INVALID = b'{"title": "t", "source": "", "priority": "high"}'
+
+
+def manual(data):
+    body = json.loads(data)
+    if not isinstance(body, dict):
+        raise ValueError("应为 JSON 对象")
+    title, source, message = body.get("title"), body.get("source"), body.get("message")
+    if not isinstance(title, str) or not isinstance(source, str) or not isinstance(message, str) or not source or not message:
+        raise ValueError("缺少必要字段")
+    appname = body.get("appname")
+    if appname is not None and not isinstance(appname, str):
+        raise ValueError("appname")
+    fields = {}
+    for name, default in (("fixed", 0), ("priority", 1), ("is_active", 0)):
+        value = body.get(name, default)
+        fields[name] = int(value)
+    user_id = body.get("user_id")
+    fields["user_id"] = int(user_id) if user_id is not None else None
+    fields["status"] = body.get("status", "pending")
+    fields["message_type"] = body.get("message_type", "message")
+    fields["tags"] = body.get("tags", [])
+    return title, source, message, appname, fields
+
+
+def variant(backend):
+    """以指定实现重新编译 WebhookBody"""
+    if backend == "pydantic" and schema.pydantic is None:
+        return None
+    return type(f"WebhookBody_{backend}", (Schema,), {"__backend__": backend, **WebhookBody.__fields__}).decode
+
+
+def timeit(decode, data, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        try:
+            decode(data)
+        except (SchemaError, ValueError):
+            pass
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    candidates = [("手写", manual), ("stdlib", variant("stdlib")), ("pydantic", variant("pydantic"))]
+    for name, decode in candidates:
+        if decode is None:
+            print(f"{name:<10} 未安装，跳过")
+            continue
+        timeit(decode, BODY, 1000)  # 预热
+        valid = timeit(decode, BODY, count)
+        invalid = timeit(decode, INVALID, count)
+        print(f"{name:<10} 合法 {valid * 1e6:7.2f} µs/条 ({1 / valid:9.0f} 条/秒)   非法 {invalid * 1e6:7.2f} µs/条")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# cluster.py
+
+"""
+多进程 worker 模式
+
+主进程作为 supervisor，启动 N 个 worker 进程，各自运行 WebSocketServer 与插件管理器，
+并通过 SO_REUSEPORT 绑定同一端口，由内核在 worker 之间分配连接。
+
+supervisor 同时运行一个本地 Unix socket 消息总线 (ClusterHub)，
+worker 通过 ClusterBus 连接到总线，用于把广播与插件管理命令同步到其他 worker。
+总线协议为逐行 JSON: {"type": ..., "from": worker_id, ...}，hub 将每一行转发给其他所有 worker。
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import traceback
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# 总线 socket 路径
+BUS_PATH = os.path.join("cache", "cluster.sock")
+
+def cluster_supported():
+    """当前平台是否支持多 worker 模式 (需要 SO_REUSEPORT 与 Unix socket)"""
+    return hasattr(socket, "SO_REUSEPORT") and hasattr(socket, "AF_UNIX") and os.name != "nt"
+
+
+class ClusterHub:
+    """supervisor 端的消息总线，将每个 worker 发来的消息转发给其他 worker"""
+    def __init__(self, path=BUS_PATH):
+        self.path = path
+        self.writers = set()
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._handle_worker, path=self.path)
+        logger.info(f"[ 集群总线 ] 总线已启动: {self.path}")
+
+    async def _handle_worker(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for other in list(self.writers):
+                    if other is not writer:
+                        other.write(line)
+                # 不等待各 worker 的 drain，避免一个卡住的 worker 拖慢整个总线
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.writers):
+            writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ClusterBus:
+    """worker 端的消息总线客户端"""
+    def __init__(self, worker_id, path=BUS_PATH):
+        self.worker_id = worker_id
+        self.path = path
+        self.handlers = {}  # type -> async handler(frame)
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+
+    def on(self, frame_type, handler):
+        """注册某类消息的处理函数"""
+        self.handlers[frame_type] = handler
+
+    async def connect(self, retries=50):
+        """连接到 supervisor 的总线 (supervisor 启动总线与 worker 几乎同时，故短暂重试)"""
+        for _ in range(retries):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        else:
+            logger.error(f"[ 集群总线 / worker {self.worker_id} ] 无法连接到总线 {self.path}")
+            return False
+        self.reader_task = asyncio.create_task(self._read_loop())
+        logger.info(f"[ 集群总线 / worker {self.worker_id} ] 已连接到总线")
+        return True
+
+    def publish(self, frame_type, **fields):
+        """向其他 worker 发布一条消息"""
+        if self.writer is None or self.writer.is_closing():
+            return
+        frame = {"type": frame_type, "from": self.worker_id, **fields}
+        self.writer.write(json.dumps(frame, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    async def _read_loop(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                logger.warning(f"[ 集群总线 / worker {self.worker_id} ] 与总线的连接已断开")
+                return
+            try:
+                frame = json.loads(line)
+                handler = self.handlers.get(frame.get("type"))
+                if handler is not None:
+                    await handler(frame)
+            except Exception as e:
+                logger.error(f"[ 集群总线 / worker {self.worker_id} ] 处理总线消息时出错: {e}")
+
+    async def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+
+class DiscardSocket:
+    """执行来自其他 worker 的插件管理命令时使用，回复直接丢弃 (回复已由发起命令的 worker 发送)"""
+    async def send(self, data, text=None):
+        pass
+
+
+def run_worker(worker_id, workers, log_level):
+    """worker 进程入口"""
+    from log import setup_logging, flush_logs
+    from server import WebSocketServer
+    from loopmon import install_event_loop_policy
+    from config import config
+
+    # spawn 启动的 worker 不继承 supervisor 的事件循环策略，需要重新安装
+    loop_name = install_event_loop_policy(getattr(config, 'USE_UVLOOP', False))
+
+    async def _run():
+        await setup_logging(log_level, log_name=f"worker{worker_id}")
+        logger.info(f"[ 集群 / worker {worker_id} ] worker 进程 {os.getpid()} 正在启动，事件循环: {loop_name}")
+        return await WebSocketServer.create(worker_id=worker_id, workers=workers)
+
+    try:
+        server = asyncio.run(_run())
+        exit_code = server.exit_code
+    except Exception:
+        logger.error(traceback.format_exc())
+        exit_code = 1
+    finally:
+        flush_logs()
+    sys.exit(exit_code)
+
+
+class Supervisor:
+    """启动并看护 worker 进程，运行集群总线"""
+    def __init__(self, workers, log_level, shutdown_timeout=10):
+        self.workers = workers
+        self.log_level = log_level
+        self.shutdown_timeout = shutdown_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}  # worker_id -> Process
+        self.restarts = {}   # worker_id -> 最近的重启时间列表，用于发现崩溃循环
+        self.hub = ClusterHub()
+        self.stopping = asyncio.Event()
+        self.exit_code = 0
+
+    def _spawn(self, worker_id):
+        process = self.context.Process(
+            target=run_worker,
+            args=(worker_id, self.workers, self.log_level),
+            name=f"SenSus-worker{worker_id}",
+        )
+        process.start()
+        self.processes[worker_id] = process
+        logger.info(f"[ 集群 ] worker {worker_id} 已启动，PID {process.pid}")
+
+    def _request_stop(self, reason):
+        if not self.stopping.is_set():
+            logger.info(f"[ 集群 ] 收到 {reason}，正在停止所有 worker...")
+            self.stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._request_stop, sig.name)
+
+        await self.hub.start()
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+        # 看护: worker 意外退出时重新拉起
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            for worker_id, process in list(self.processes.items()):
+                if not process.is_alive() and not self.stopping.is_set():
+                    self._restart(worker_id, process.exitcode)
+
+        # worker 忽略 SIGINT，统一由 supervisor 发送 SIGTERM 触发各自的优雅退出
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        await loop.run_in_executor(None, self._join_all)
+        await self.hub.close()
+
+        if any(process.exitcode != 0 for process in self.processes.values()):
+            self.exit_code = 1
+        return self.exit_code
+
+    def _restart(self, worker_id, exitcode, limit=5, window=60):
+        """重启意外退出的 worker，window 秒内重启超过 limit 次时视为无法恢复，停止整个集群"""
+        now = time.monotonic()
+        history = [t for t in self.restarts.get(worker_id, []) if now - t < window]
+        if len(history) >= limit:
+            logger.error(f"[ 集群 ] worker {worker_id} 在 {window} 秒内连续崩溃 {limit} 次，停止集群")
+            self.exit_code = 1
+            self._request_stop("worker 崩溃循环")
+            return
+        history.append(now)
+        self.restarts[worker_id] = history
+        logger.warning(f"[ 集群 ] worker {worker_id} 意外退出 (exitcode={exitcode})，正在重启...")
+        self._spawn(worker_id)
+
+    def _join_all(self):
+        for worker_id, process in self.processes.items():
+            process.join(self.shutdown_timeout)
+            if process.is_alive():
+                logger.warning(f"[ 集群 ] worker {worker_id} 未能在 {self.shutdown_timeout} 秒内退出，强制终止")
+                process.kill()
+                process.join()
@@ -1,6 +1,6 @@
 import logging
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 import random
 import string
@@ -17,49 +17,6 @@ log_file_handler = None
 
 logs = None
 
-# 用于记录过去2小时内WARNING和ERROR日志计数的类
-class LogLevelCounter:
-    def __init__(self):
-        # 分别为 warning 和 error 设置记录列表，每条记录包含 (timestamp, count)
-        self.warning_records = []  # [(timestamp, count), ...]
-        self.error_records = []  # [(timestamp, count), ...]
-        self.window_duration = timedelta(hours=2)  # 两小时的时间窗口
-
-    def _clean_old_records(self, records):
-        """清理超出时间窗口的记录"""
-        current_time = datetime.now()
-        while records and current_time - records[0][0] > self.window_duration:
-            records.pop(0)  # 删除最早的记录，直到没有超过2小时的记录为止
-
-    def increment_warning(self):
-        """增加 warning 计数，同时附加当前时间戳"""
-        current_time = datetime.now()
-        self._clean_old_records(self.warning_records)
-        self.warning_records.append((current_time, 1))  # 记录当前时间和增加的计数
-        logger.debug("add a warning.")
-
-    def increment_error(self):
-        """增加 error 计数，同时附加当前时间戳"""
-        current_time = datetime.now()
-        self._clean_old_records(self.error_records)
-        self.error_records.append((current_time, 1))  # 记录当前时间和增加的计数
-        logger.debug("add a error.")
-
-    def get_counts(self):
-        """获取当前 warning 和 error 计数"""
-        self._clean_old_records(self.warning_records)
-        self._clean_old_records(self.error_records)
-        
-        # 计算总计数
-        warning_count = len(self.warning_records)
-        error_count = len(self.error_records)
-
-        logger.debug(f"warning_count: {warning_count} , error_count: {error_count} ")
-        
-        return warning_count, error_count
-
-loglevelcounter = LogLevelCounter()
-
 class InterceptHandler(logging.Handler):
     """日志转发器"""
     def __init__(self, max_logs=200):
@@ -72,13 +29,6 @@ class InterceptHandler(logging.Handler):
             msg = self.format(record)
             logs.append(msg)  # 将新日志加入到队列中
 
-            """ 
-            levelname = record.levelname
-            if levelname == "WARNING":
-                loglevelcounter.increment_warning()
-            if levelname == "ERROR":
-                loglevelcounter.increment_error() 
-            """
             # msg = self.format(record)
             # 截取日志内容，这里你可以将日志保存到日志列表，或者进行其他处理
             # self.logs.append(msg)  # 将日志内容添加到列表中
@@ -104,6 +54,90 @@ class ColoredFormatter(logging.Formatter):
         level_color = self.COLOR_MAPPING.get(record.levelname, Fore.WHITE)
         record.levelname = f"{level_color}{record.levelname}{Style.RESET_ALL}"
         return super().format(record)
+
+
+# 热路径日志 ###########################################################################
+
+# 日志级别配置的代数，每次重新配置 logger / handler 后递增，使 HotLogger 的缓存失效
+_level_generation = 0
+
+def invalidate_level_cache():
+    """在修改 logger 或 handler 的级别后调用，使所有 HotLogger 的级别缓存失效"""
+    global _level_generation
+    _level_generation += 1
+
+def _effective_threshold(target):
+    """
+    计算一条日志真正会被某个 handler 输出所需的最低级别
+
+    root logger 固定为 DEBUG，实际过滤发生在 handler 上，
+    所以仅靠 logger.isEnabledFor() 无法跳过注定会被丢弃的 DEBUG 日志。
+    """
+    handler_level = None
+    current = target
+    while current:
+        for handler in current.handlers:
+            if handler_level is None or handler.level < handler_level:
+                handler_level = handler.level
+        if not current.propagate:
+            break
+        current = current.parent
+
+    if handler_level is None:
+        # 没有任何 handler 时 logging 会退回到 lastResort
+        handler_level = logging.lastResort.level if logging.lastResort else logging.WARNING
+
+    return max(target.getEffectiveLevel(), handler_level, target.manager.disable + 1)
+
+class HotLogger:
+    """
+    带级别缓存的 logger 包装器，供每个请求都会经过的热路径使用
+
+    级别判断只是一次整数比较，被过滤掉的日志不会创建 LogRecord；
+    消息请使用 %s 占位符传参，而不是 f-string，这样参数只会在真正输出时才被格式化。
+    """
+    __slots__ = ("logger", "_generation", "_threshold")
+
+    def __init__(self, target):
+        self.logger = target
+        self._generation = -1
+        self._threshold = logging.NOTSET
+
+    def enabled(self, level):
+        """判断该级别的日志是否会被输出"""
+        if self._generation != _level_generation:
+            self._threshold = _effective_threshold(self.logger)
+            self._generation = _level_generation
+        return level >= self._threshold
+
+    def debug(self, msg, *args):
+        if self.enabled(logging.DEBUG):
+            self.logger.debug(msg, *args, stacklevel=2)
+
+    def info(self, msg, *args):
+        if self.enabled(logging.INFO):
+            self.logger.info(msg, *args, stacklevel=2)
+
+    def warning(self, msg, *args):
+        if self.enabled(logging.WARNING):
+            self.logger.warning(msg, *args, stacklevel=2)
+
+    def error(self, msg, *args):
+        if self.enabled(logging.ERROR):
+            self.logger.error(msg, *args, stacklevel=2)
+
+_hot_loggers = {}
+
+def get_hot_logger(name):
+    """获取 (并缓存) 指定名称的 HotLogger"""
+    hot = _hot_loggers.get(name)
+    if hot is None:
+        hot = _hot_loggers[name] = HotLogger(logging.getLogger(name))
+    return hot
+
+def color_tag(text, color):
+    """预先拼接带 colorama 颜色的标签，避免每次请求都重复拼接转义序列"""
+    return f"{color}{text}{Style.RESET_ALL}"
     
 def renameLog(latest_log_path, old_log_filename):
     # 检查文件是否被占用并等待
@@ -117,9 +151,9 @@ def renameLog(latest_log_path, old_log_filename):
             logger.warning("日志文件被占用，正在等待解除占用...")
             time.sleep(1)
 
-async def setup_logging(log_level_str="INFO"):
-    """设置日志记录"""
-    
+async def setup_logging(log_level_str="INFO", log_name="latest"):
+    """设置日志记录，log_name 为当前日志文件名 (多 worker 模式下每个 worker 写入各自的文件)"""
+
     # 确保启用ANSI转义码（仅在Windows上）
     if os.name == 'nt':
         import msvcrt
@@ -142,7 +176,7 @@ async def setup_logging(log_level_str="INFO"):
     suffix = ".log"
 
     # 重命名已有的 latest.log 文件 ###########################################################################
-    latest_log_path = os.path.join(log_dir, f"latest{suffix}")
+    latest_log_path = os.path.join(log_dir, f"{log_name}{suffix}")
     if os.path.exists(latest_log_path):
         # 获取文件修改日期并格式化
         modification_time = os.path.getmtime(latest_log_path)
@@ -159,7 +193,7 @@ async def setup_logging(log_level_str="INFO"):
         renameLog(latest_log_path, old_log_filename)
 
     # 重命名已有的 debug/latest.log 文件 ###########################################################################
-    latest_debug_log_path = os.path.join(debug_dir, f"latest{suffix}")
+    latest_debug_log_path = os.path.join(debug_dir, f"{log_name}{suffix}")
     if os.path.exists(latest_debug_log_path):
         # 获取文件修改日期并格式化
         modification_time = os.path.getmtime(latest_debug_log_path)
@@ -207,11 +241,15 @@ async def setup_logging(log_level_str="INFO"):
 
     # 转发
     intercept_handler = InterceptHandler()
+    intercept_handler.setLevel(log_level)  # 与其他 handler 保持一致，避免 DEBUG 日志全部进入转发器
     logging.getLogger().addHandler(intercept_handler)
 
+    # handler 已重新配置，刷新热路径日志的级别缓存
+    invalidate_level_cache()
+
     """  暂时禁用该功能
     # 同步创建 debug 级别的日志
-    debug_log_filename = os.path.join(debug_dir, f"latest{suffix}")
+    debug_log_filename = os.path.join(debug_dir, f"{log_name}{suffix}")
 
     # 创建 debug 级别日志的 FileHandler
     debug_file_handler = logging.FileHandler(debug_log_filename, encoding='utf-8')
@@ -235,6 +273,14 @@ def manage_log_files(directory, suffix, keep_count=30):
         os.remove(os.path.join(directory, log_file))
 
         
+def flush_logs():
+    """将所有 handler 中缓冲的日志写出 (退出前调用)"""
+    for handler in logging.getLogger().handlers:
+        try:
+            handler.flush()
+        except Exception:
+            pass
+
 def close_log_file():
     """手动关闭日志文件句柄"""
     global log_file_handler
@@ -0,0 +1,202 @@
+# loopmon.py
+
+"""
+事件循环相关: 可选的 uvloop、事件循环延迟 (loop lag) 监控与阻塞检测
+"""
+
+import os
+import sys
+import math
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque, defaultdict
+
+logger = logging.getLogger(__name__)
+
+def install_event_loop_policy(use_uvloop=False):
+    """
+    按配置安装 uvloop 事件循环策略，需在 asyncio.run 之前调用
+
+    uvloop 未安装或当前平台不支持 (Windows) 时退回标准库事件循环，返回实际使用的事件循环名称
+    (此时日志尚未初始化，由调用方在日志初始化后输出结果)
+    """
+    if not use_uvloop:
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+def percentile(sorted_values, p):
+    """已排序序列的第 p 百分位 (最近秩)"""
+    if not sorted_values:
+        return 0.0
+    index = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控
+
+    每隔 interval 秒调度一次 sleep，实际唤醒时间与预期之差即为调度延迟；
+    任何阻塞事件循环的同步代码 (如插件中同步访问 SQLite) 都会直接体现为延迟升高。
+    每隔 report_interval 秒汇报一次最近窗口内的 p50 / p99 / 最大延迟，p99 超过 warn_threshold 时以警告级别输出
+    """
+    def __init__(self, interval=0.5, report_interval=60, warn_threshold=0.1):
+        self.interval = interval
+        self.report_interval = report_interval
+        self.warn_threshold = warn_threshold
+        # 只保留最近一个汇报周期的采样
+        self.samples = deque(maxlen=max(int(report_interval / interval), 1))
+        self.last_lag = 0.0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run(), name="LoopLagMonitor")
+        return self.task
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + self.report_interval
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self.last_lag = max(now - scheduled - self.interval, 0.0)
+            self.samples.append(self.last_lag)
+            if now >= next_report:
+                next_report = now + self.report_interval
+                self.report()
+
+    def stats(self):
+        """最近窗口内的延迟统计 (秒)"""
+        values = sorted(self.samples)
+        return {
+            "samples": len(values),
+            "p50": percentile(values, 50),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else 0.0,
+            "last": self.last_lag,
+        }
+
+    def report(self):
+        stats = self.stats()
+        level = logging.WARNING if stats["p99"] >= self.warn_threshold else logging.DEBUG
+        logger.log(
+            level,
+            "[ 事件循环 ] 调度延迟 p50 %.1fms / p99 %.1fms / 最大 %.1fms (%s 个采样)",
+            stats["p50"] * 1000, stats["p99"] * 1000, stats["max"] * 1000, stats["samples"],
+        )
+
+
+class LoopWatchdog:
+    """
+    事件循环阻塞检测
+
+    事件循环中的心跳任务每隔 tick_interval 秒更新一次时间戳，独立的看门狗线程发现时间戳超过 threshold 秒未更新时，
+    认为事件循环被同步代码阻塞: 抓取事件循环线程的调用栈，并归因到具体插件:
+      1. 调用栈中最内层位于 plugins/ 目录下的帧 (插件构造函数、同步调用等)
+      2. 当前正在运行的任务名称 (dispatch_message 以插件类名命名任务)
+    每个插件分别记录阻塞次数与累计阻塞时长
+    """
+    def __init__(self, threshold=0.5, tick_interval=0.1):
+        self.threshold = threshold
+        self.tick_interval = tick_interval
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_tick = time.monotonic()
+        self.stalls = defaultdict(int)        # 插件名 -> 阻塞次数
+        self.stall_time = defaultdict(float)  # 插件名 -> 累计阻塞时长 (秒)
+        self.task = None
+        self.thread = None
+        self._stop_event = threading.Event()
+        self.plugins_dir = os.path.abspath("plugins") + os.sep
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.task = asyncio.create_task(self._heartbeat(), name="LoopWatchdog")
+        self.thread = threading.Thread(target=self._watch, name="LoopWatchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self.last_tick = time.monotonic()
+            await asyncio.sleep(self.tick_interval)
+
+    def _watch(self):
+        stalled_since = None  # 当前阻塞的心跳时间戳，用于同一次阻塞只报告一次
+        culprit = None
+        while not self._stop_event.wait(self.tick_interval):
+            last_tick = self.last_tick
+            blocked = time.monotonic() - last_tick
+            if blocked > self.threshold:
+                if stalled_since != last_tick:
+                    stalled_since = last_tick
+                    culprit, stack = self._capture()
+                    self.stalls[culprit] += 1
+                    logger.warning(
+                        "[ 事件循环 / 看门狗 ] 事件循环已阻塞 %.0fms，归因于 %s，调用栈:\n%s",
+                        blocked * 1000, culprit, stack,
+                    )
+            elif stalled_since is not None:
+                # 事件循环恢复，记录本次阻塞的总时长 (心跳间隔内的误差可忽略)
+                duration = self.last_tick - stalled_since - self.tick_interval
+                self.stall_time[culprit] += max(duration, 0.0)
+                logger.warning("[ 事件循环 / 看门狗 ] 事件循环已恢复，%s 共阻塞约 %.0fms", culprit, duration * 1000)
+                stalled_since = None
+                culprit = None
+
+    def _capture(self):
+        """抓取事件循环线程当前的调用栈，返回 (归因的插件名, 格式化的调用栈)"""
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return "unknown", ""
+        stack = traceback.extract_stack(frame)
+        return self._attribute(stack), "".join(traceback.format_list(stack))
+
+    def _attribute(self, stack):
+        # 1. 调用栈中最内层的插件帧
+        for entry in reversed(stack):
+            plugin_name = self._plugin_from_path(entry.filename)
+            if plugin_name:
+                return plugin_name
+        # 2. 当前任务名称 (dispatch_message 中设置为插件类名)
+        task = asyncio.current_task(self.loop)
+        if task is not None and task.get_name().endswith("Plugin"):
+            return task.get_name()[:-len("Plugin")]
+        return "core"
+
+    def _plugin_from_path(self, filename):
+        """根据源文件路径判断所属插件: plugins/p_X/... 或 plugins/example/p_X.py"""
+        path = os.path.abspath(filename)
+        if not path.startswith(self.plugins_dir):
+            return None
+        parts = path[len(self.plugins_dir):].split(os.sep)
+        if parts[0] == "example" and len(parts) > 1:
+            name = parts[1][:-3] if parts[1].endswith(".py") else parts[1]
+        else:
+            name = parts[0]
+        if name.startswith(("p_", "u_")):
+            return name[2:]
+        return None
+
+    def stats(self):
+        """各插件的阻塞次数与累计阻塞时长"""
+        return {
+            plugin_name: {"stalls": count, "stall_seconds": round(self.stall_time.get(plugin_name, 0.0), 3)}
+            for plugin_name, count in self.stalls.items()
+        }
@@ -2,40 +2,62 @@
 
 import sys
 import os
-import signal
 import asyncio
 import traceback
-from log import setup_logging, logger
+from log import setup_logging, flush_logs, logger
 from server import WebSocketServer
+from cluster import Supervisor, cluster_supported
+from loopmon import install_event_loop_policy
 from config import config
 
+async def run(loop_name):
+    """在同一个事件循环中完成日志初始化与服务器运行，返回退出码"""
+    # 设置日志记录
+    await setup_logging(config.LOG_LEVEL)
+
+    logger.info(f"[ SenSus ] SenSus {config.VER} 正在启动...\n")
+    if getattr(config, 'USE_UVLOOP', False) and loop_name != "uvloop":
+        logger.warning("[ SenSus ] 已启用 USE_UVLOOP，但 uvloop 不可用，使用标准库事件循环")
+    logger.info(f"[ SenSus ] 事件循环: {loop_name}")
+
+    # 多 worker 模式: 主进程只作为 supervisor，ws 服务器运行在各 worker 进程中
+    workers = getattr(config, 'WORKERS', 1)
+    if workers > 1 and not cluster_supported():
+        logger.warning("[ SenSus ] 当前平台不支持 SO_REUSEPORT，多 worker 模式不可用，退回单进程运行")
+        workers = 1
+
+    if workers > 1:
+        logger.info(f"[ SenSus ] 以 {workers} 个 worker 进程运行")
+        supervisor = Supervisor(workers, config.LOG_LEVEL, getattr(config, 'SHUTDOWN_TIMEOUT', 10) + 5)
+        return await supervisor.run()
+
+    # 创建并启动 WebSocket 服务器，退出信号由服务器在事件循环中处理并优雅关闭
+    server = await WebSocketServer.create()
+    return server.exit_code
+
 def main():
     # 获取项目根目录的绝对路径
     project_root = os.path.dirname(os.path.abspath(__file__))
     # 将当前工作目录切换到项目根目录
     os.chdir(project_root)
-    
-    # 设置日志记录
-    asyncio.run(setup_logging(config.LOG_LEVEL))
 
-    logger.info(f"[ SenSus ] SenSus {config.VER} 正在启动...\n")
+    # 按配置选择事件循环实现，必须在创建事件循环之前安装
+    loop_name = install_event_loop_policy(getattr(config, 'USE_UVLOOP', False))
 
-
-    # 创建并启动 WebSocket 服务器
+    exit_code = 0
     try:
-        server = WebSocketServer()
-        asyncio.run(server.create())
+        exit_code = asyncio.run(run(loop_name))
     except KeyboardInterrupt:
-        logger.info("[ SenSus ] 收到退出信号，正在优雅地关闭程序...")
+        logger.info("[ SenSus ] 收到退出信号，正在关闭程序...")
     except Exception as e:
         logger.error(traceback.format_exc())  # 打印完整的错误堆栈
         logger.error(f"[ SenSus ] SenSus 框架严重错误：\n{e}")
+        exit_code = 1
     finally:
         logger.info("[ SenSus ] 终止 SenSus 框架...")
-        sys.exit(1)
-        logger.warning("[ SenSus ] 框架终止流程异常，尝试强制关闭...")
-        pid = os.getpid()
-        os.kill(pid, signal.SIGTERM)
+        flush_logs()
+
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
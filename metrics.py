@@ -0,0 +1,498 @@
+# metrics.py
+
+"""
+指标统计与 Prometheus 文本格式导出
+
+- LogHistogram: HDR 风格的对数分桶直方图，内存占用固定
+- MetricsRegistry: 框架级指标注册表，核心模块与插件通过 server.metrics 发布计数器、仪表与直方图
+- DispatchMetrics: 按 (插件, 方法) 统计消息处理的耗时分布、调用数、错误数与在途数
+- MetricsExporter: 在本地端口上提供 GET /metrics (Prometheus 文本格式)，不依赖任何 web 框架
+"""
+
+import time
+import threading
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LogHistogram:
+    """
+    对数分桶直方图 (单位: 秒，内部按微秒分桶)
+
+    每个 2 的幂区间 (octave) 再等分为 SUB_BUCKETS 个子桶，相对误差不超过 1 / SUB_BUCKETS；
+    覆盖 1µs ~ 2^OCTAVES µs (约 134 秒)，更大的值计入最后一个桶
+    """
+    __slots__ = ("counts", "count", "sum", "max")
+
+    SUB_BUCKETS = 4
+    OCTAVES = 27
+
+    def __init__(self):
+        self.counts = [0] * (self.OCTAVES * self.SUB_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_index(cls, seconds):
+        micros = int(seconds * 1e6)
+        if micros < 1:
+            return 0
+        octave = micros.bit_length() - 1
+        if octave >= cls.OCTAVES:
+            return cls.OCTAVES * cls.SUB_BUCKETS - 1
+        sub = ((micros - (1 << octave)) * cls.SUB_BUCKETS) >> octave
+        return octave * cls.SUB_BUCKETS + sub
+
+    @classmethod
+    def bucket_upper(cls, index):
+        """桶的上界 (秒)"""
+        octave, sub = divmod(index, cls.SUB_BUCKETS)
+        return (1 << octave) * (1 + (sub + 1) / cls.SUB_BUCKETS) / 1e6
+
+    def record(self, seconds):
+        self.counts[self.bucket_index(seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """第 p 百分位的近似值 (所在桶的上界，不超过观测到的最大值)"""
+        if not self.count:
+            return 0.0
+        target = p / 100 * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if bucket_count and cumulative >= target:
+                return min(self.bucket_upper(index), self.max)
+        return self.max
+
+    def cumulative_octaves(self, first_octave=4):
+        """按 octave 边界输出累计计数 [(上界秒数, 累计数)]，用于 Prometheus 的 le 分桶"""
+        result = []
+        cumulative = sum(self.counts[:first_octave * self.SUB_BUCKETS])
+        for octave in range(first_octave, self.OCTAVES):
+            start = octave * self.SUB_BUCKETS
+            cumulative += sum(self.counts[start:start + self.SUB_BUCKETS])
+            result.append(((1 << (octave + 1)) / 1e6, cumulative))
+        return result
+
+
+def escape_label(value):
+    """转义 Prometheus 标签值"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labelnames, labelvalues):
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, labelvalues))
+
+
+def series(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def histogram_lines(name, labels, histogram):
+    """将一个 LogHistogram 输出为 Prometheus histogram 的 _bucket / _sum / _count 行"""
+    prefix = labels + "," if labels else ""
+    lines = [
+        f'{name}_bucket{{{prefix}le="{upper:g}"}} {cumulative}'
+        for upper, cumulative in histogram.cumulative_octaves()
+    ]
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    lines.append(f"{series(name + '_sum', labels)} {histogram.sum:.6f}")
+    lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+    return lines
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class HistogramChild:
+    __slots__ = ("histogram",)
+
+    def __init__(self):
+        self.histogram = LogHistogram()
+
+    def observe(self, seconds):
+        self.histogram.record(seconds)
+
+    def time(self):
+        """with child.time(): ... 记录代码块耗时"""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    """
+    带标签的指标，labels(...) 返回对应标签组合的子指标并缓存
+
+    热路径中应持有 labels() 返回的子指标，之后每次更新只是一次属性加法；
+    为了保持廉价，更新不加锁，多个线程同时更新同一子指标时极少数情况下可能丢失计数
+    """
+    TYPE = None
+    CHILD = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self._lock = threading.Lock()  # 只在创建子指标时使用
+        self._default = None if self.labelnames else self.labels()
+
+    def labels(self, *labelvalues):
+        child = self.children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}")
+            with self._lock:
+                child = self.children.setdefault(labelvalues, self.CHILD())
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+
+    def lines(self):
+        lines = self.header()
+        for labelvalues, child in list(self.children.items()):
+            lines.append(f"{series(self.name, format_labels(self.labelnames, labelvalues))} {child.value}")
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+    CHILD = CounterChild
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+    CHILD = GaugeChild
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+    CHILD = HistogramChild
+
+    def observe(self, seconds):
+        self._default.observe(seconds)
+
+    def time(self):
+        return self._default.time()
+
+    def lines(self):
+        lines = self.header()
+        for labelvalues, child in list(self.children.items()):
+            lines.extend(histogram_lines(self.name, format_labels(self.labelnames, labelvalues), child.histogram))
+        return lines
+
+
+class GaugeFunc:
+    """
+    采集时才求值的仪表，func 返回数值，或 [(标签值元组, 数值), ...]
+    适合连接数、队列深度这类本来就存在于某个对象上的状态，平时没有任何开销
+    """
+    TYPE = "gauge"
+
+    def __init__(self, name, help_text, func, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def lines(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        value = self.func()
+        if not self.labelnames:
+            lines.append(f"{self.name} {value}")
+        else:
+            for labelvalues, item in value:
+                lines.append(f"{self.name}{{{format_labels(self.labelnames, labelvalues)}}} {item}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    框架级指标注册表
+
+    counter / gauge / histogram 按名称获取或创建指标，插件重载后再次注册会拿到同一个指标，计数不会清零；
+    gauge_func 再次注册时替换求值函数；register_collector 可接入直接输出 Prometheus 文本行的采集函数
+    """
+    def __init__(self):
+        self.metrics = {}      # 名称 -> 指标
+        self.collectors = []   # 返回 Prometheus 文本行列表的函数
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, labelnames):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, labelnames)
+            elif type(metric) is not cls:
+                raise ValueError(f"指标 {name} 已注册为 {metric.TYPE}")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=()):
+        return self._get_or_create(Histogram, name, help_text, labelnames)
+
+    def gauge_func(self, name, help_text, func, labelnames=()):
+        with self._lock:
+            self.metrics[name] = GaugeFunc(name, help_text, func, labelnames)
+        return self.metrics[name]
+
+    def unregister(self, name):
+        """移除指标 (插件停止时移除引用了插件实例的 gauge_func)"""
+        with self._lock:
+            self.metrics.pop(name, None)
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def collect(self):
+        """所有指标的 Prometheus 文本行"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.lines())
+            except Exception as e:
+                logger.error(f"[ 指标 ] 采集指标 {metric.name} 时出错: {e}")
+        for collector in list(self.collectors):
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.error(f"[ 指标 ] 采集指标时出错: {e}")
+        return lines
+
+
+class MethodStats:
+    """单个 (插件, 方法) 的统计"""
+    __slots__ = ("calls", "errors", "inflight", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.inflight = 0
+        self.histogram = LogHistogram()
+
+    def to_dict(self):
+        histogram = self.histogram
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "inflight": self.inflight,
+            "mean_ms": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+            "p50_ms": round(histogram.percentile(50) * 1000, 3),
+            "p90_ms": round(histogram.percentile(90) * 1000, 3),
+            "p99_ms": round(histogram.percentile(99) * 1000, 3),
+            "max_ms": round(histogram.max * 1000, 3),
+        }
+
+
+class DispatchMetrics:
+    """
+    插件消息分发指标，按 (插件, 方法) 统计
+
+    method 来自客户端，为避免无界增长，每个插件最多记录 max_methods 个不同的方法，其余归入 "other"
+    """
+    def __init__(self, max_methods=64):
+        self.max_methods = max_methods
+        self.stats = {}      # (插件名, 方法) -> MethodStats
+        self._methods = {}   # 插件名 -> 已记录的方法数
+        self._inflight = {}  # 插件名 -> 在途消息数
+        self._idle = {}      # 插件名 -> 在途数归零时触发的 asyncio.Event (有人等待时才创建)
+
+    def get(self, plugin_name, method):
+        method = method if isinstance(method, str) else "-"
+        key = (plugin_name, method)
+        stats = self.stats.get(key)
+        if stats is None:
+            count = self._methods.get(plugin_name, 0)
+            if count >= self.max_methods:
+                key = (plugin_name, "other")
+                stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = MethodStats()
+                self._methods[plugin_name] = count + 1
+        return stats
+
+    async def timed(self, plugin_name, method, coroutine):
+        """执行 coroutine 并记录耗时、调用数、错误数与在途数"""
+        stats = self.get(plugin_name, method)
+        stats.calls += 1
+        stats.inflight += 1
+        self._inflight[plugin_name] = self._inflight.get(plugin_name, 0) + 1
+        start = time.perf_counter()
+        try:
+            return await coroutine
+        except BaseException:
+            stats.errors += 1
+            raise
+        finally:
+            stats.inflight -= 1
+            stats.histogram.record(time.perf_counter() - start)
+            remaining = self._inflight[plugin_name] = self._inflight[plugin_name] - 1
+            if not remaining:
+                idle = self._idle.pop(plugin_name, None)
+                if idle is not None:
+                    idle.set()
+
+    def inflight(self, plugin_name):
+        """插件正在处理中的消息数"""
+        return self._inflight.get(plugin_name, 0)
+
+    async def wait_idle(self, plugin_name):
+        """等待插件的在途消息全部处理完成"""
+        while self._inflight.get(plugin_name):
+            idle = self._idle.get(plugin_name)
+            if idle is None:
+                idle = self._idle[plugin_name] = asyncio.Event()
+            await idle.wait()
+
+    def snapshot(self, plugin_name=None):
+        """{插件名: {方法: 统计}}，可只取某个插件"""
+        result = {}
+        for (name, method), stats in self.stats.items():
+            if plugin_name is None or name == plugin_name:
+                result.setdefault(name, {})[method] = stats.to_dict()
+        return result
+
+    def prometheus(self):
+        """Prometheus 文本格式"""
+        lines = [
+            "# HELP sensus_dispatch_seconds 插件处理单条消息的耗时",
+            "# TYPE sensus_dispatch_seconds histogram",
+        ]
+        items = sorted(self.stats.items())
+        for (plugin_name, method), stats in items:
+            labels = format_labels(("plugin", "method"), (plugin_name, method))
+            lines.extend(histogram_lines("sensus_dispatch_seconds", labels, stats.histogram))
+        for name, kind, help_text, attr in (
+            ("sensus_dispatch_calls_total", "counter", "插件消息处理次数", "calls"),
+            ("sensus_dispatch_errors_total", "counter", "插件处理消息时抛出异常的次数", "errors"),
+            ("sensus_dispatch_inflight", "gauge", "正在处理中的消息数", "inflight"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (plugin_name, method), stats in items:
+                labels = format_labels(("plugin", "method"), (plugin_name, method))
+                lines.append(f"{name}{{{labels}}} {getattr(stats, attr)}")
+        return lines
+
+
+class MetricsExporter:
+    """
+    极简的 HTTP 指标服务，只响应 GET /metrics，每次请求时从注册表采集
+    """
+    def __init__(self, host, port, registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"[ 指标 ] Prometheus 指标服务启动在 http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def render(self):
+        lines = self.registry.collect()
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # 读完请求头，忽略内容
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                body = self.render()
+                status = b"200 OK"
+                content_type = b"text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body = b"not found\n"
+                status = b"404 Not Found"
+                content_type = b"text/plain; charset=utf-8"
+            writer.write(
+                b"HTTP/1.1 " + status + b"\r\nContent-Type: " + content_type +
+                b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class LogLevelMetricsHandler(logging.Handler):
+    """按级别统计日志条数的 handler，只处理 WARNING 及以上级别，不输出任何内容"""
+    def __init__(self, counter, level=logging.WARNING):
+        super().__init__(level)
+        self.counter = counter
+
+    def emit(self, record):
+        # record.levelname 可能已被彩色格式化器改写，使用 levelno 取原始名称
+        self.counter.labels(logging.getLevelName(record.levelno)).inc()
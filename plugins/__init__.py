@@ -1,23 +1,133 @@
 # plugins/__init__.py
 
 import os
+import sys
+import inspect
 import importlib
 import logging
 import json
 import asyncio
 import traceback
+import contextlib
+from websockets.exceptions import ConnectionClosed
+from log import get_hot_logger
+from metrics import DispatchMetrics
+from plugins.isolation import IsolatedPlugin
+from plugins.manifest import PluginManifest
+from plugins.graph import plan_load_levels
+from plugins.routing import get_routes, unsupported
+from schema import SchemaError
 
 logger = logging.getLogger(__name__)
+# 消息分发的热路径使用带级别缓存的 logger
+hot = get_hot_logger(__name__)
+
+class BatchCollector:
+    """
+    batch 子请求使用的代理 websocket
+
+    插件对它的回复不会立即发送，而是被收集起来，由服务器合并成一帧统一返回；
+    其余属性 (request、remote_address 等) 均转发给真实的 websocket
+    """
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.responses = []
+
+    def __getattr__(self, name):
+        return getattr(self.websocket, name)
+
+    def collect(self, response):
+        """直接收集回复字典，省去一次序列化与反序列化"""
+        self.responses.append(response)
+
+    async def send(self, data, text=None):
+        # 插件直接调用 websocket.send 时，解析回字典后再收集
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        try:
+            self.responses.append(json.loads(data))
+        except (TypeError, ValueError):
+            self.responses.append(data)
+
+    def result(self):
+        """子请求的结果：无回复为 None，单条回复为该回复，多条回复为列表"""
+        if not self.responses:
+            return None
+        if len(self.responses) == 1:
+            return self.responses[0]
+        return self.responses
+
+async def reply(websocket, message, response):
+    """
+    回复一条请求
+
+    若请求中带有客户端提供的 id，则原样写入回复，
+    客户端可以同时发出多个请求，并按 id 匹配乱序返回的响应
+    """
+    request_id = message.get("id") if isinstance(message, dict) else None
+    if request_id is not None:
+        response = {**response, "id": request_id}
+    if type(websocket) is BatchCollector:
+        websocket.collect(response)
+        return
+    try:
+        await websocket.send(json.dumps(response, ensure_ascii=False))
+    except ConnectionClosed:
+        # 客户端在处理期间断开，回复已无人接收
+        hot.debug("[ 插件消息分发 ] 连接已关闭，丢弃回复")
+
+async def route_message(plugin, routes, websocket, message):
+    """按插件的路由表调用处理函数，参数不符合声明或方法未注册时直接答复错误"""
+    plugin_name = type(plugin).__name__[:-len("Plugin")]
+    route = routes.get(message.get("method"))
+    if route is None:
+        await reply(websocket, message, unsupported(plugin_name, message.get("method")))
+        return
+    try:
+        coroutine = route.bind(plugin, websocket, message)
+    except SchemaError as e:
+        await reply(websocket, message, {"plugin": plugin_name, "error": f"参数错误: {e}", "details": e.errors})
+        return
+    await coroutine
 
 class Plugin:
     def __init__(self, WebSocketServer):
         self.server = WebSocketServer
 
-    async def on_message(self, message):
-        raise NotImplementedError("[ 插件管理器 ] 插件主类必须实现 on_message 方法")
+    async def on_message(self, websocket, message):
+        """默认按 @method 声明的路由处理消息；没有声明路由的插件必须实现 on_message"""
+        routes = get_routes(type(self))
+        if not routes:
+            raise NotImplementedError("[ 插件管理器 ] 插件主类必须实现 on_message 方法或用 @method 声明消息方法")
+        await route_message(self, routes, websocket, message)
+
+    async def reply(self, websocket, message, response):
+        """回复请求，自动带上请求 id (见模块级 reply)"""
+        await reply(websocket, message, response)
     
+    async def start(self):
+        """
+        启动钩子，构造之后、开始接收消息之前调用
+
+        构造函数在事件循环线程中执行，只做轻量的准备；耗时的初始化放在这里 (阻塞调用交给 asyncio.to_thread)，
+        同一依赖层的插件的 start() 并发执行
+        """
+        pass
+
     async def stop(self, message):
         raise NotImplementedError("[ 插件管理器 ] 插件主类必须实现 stop 方法")
+
+    def get_service(self, name):
+        """按插件名或服务名 (# __provides__) 取得其他插件的实例，未加载时返回 None"""
+        return self.server.plugin_manager.get_service(name)
+
+    def export_state(self):
+        """热重载时导出需要交给新实例的状态 (可为协程)，返回 None 表示没有状态"""
+        return None
+
+    def import_state(self, state):
+        """热重载时接收旧实例 export_state() 导出的状态 (可为协程)"""
+        pass
     
 
 class PluginManager:
@@ -33,6 +143,24 @@ class PluginManager:
 
         self.folder_plugins = {}
         self.file_plugins = {}
+        # 多 worker 模式下固定在 worker 0 上运行、本 worker 未加载的单例插件
+        self.pinned_plugins = set()
+        # 按 (插件, 方法) 统计的消息处理耗时、调用数、错误数与在途数
+        self.metrics = DispatchMetrics()
+        # 正在热重载的插件 -> 新实例就绪时置位的事件，期间发往该插件的消息等待而不丢弃
+        self.swapping = {}
+        # 插件名 -> 清单中的 PluginEntry
+        self.entries = {}
+        # 插件名 -> 已加载的实例，服务名 (# __provides__) -> 提供该服务的实例
+        self.instances = {}
+        self.services = {}
+        # 插件名 -> 路由表 {方法名: Route}，只包含用 @method 声明了方法的插件
+        self.routes = {}
+        # 声明了 # __lazy__ = True、尚未加载的插件，以及正在进行的按需加载
+        self.lazy_plugins = {}
+        self._lazy_loads = {}
+        # 正在等待全局分发信号量的消息数，即分发队列深度
+        self.dispatch_waiting = 0
 
         self.server.pm_status = 1  # 插件管理器加载状态
 
@@ -58,30 +186,18 @@ class PluginManager:
                 logger.error(f"[ 插件管理器 ] 创建插件文件夹 {file_plugin_folder} 失败: {e}")
                 return  # 创建失败，返回
             
-        # 忽略文件列表
-        ignore_files = {"__init__.py", "__pycache__"}
-
-        # 按顺序加载插件
-        await self._sequentially_load_plugins(folder_plugin_folder, file_plugin_folder, ignore_files)
-
-        # 生成插件的可序列化版本
-        serializable_plugins = {
-            "folder_plugins": {
-                name[2:]: {"enable": data["enable"], "version": data["version"]}
-                for name, data in self.plugins["folder_plugins"].items()
-            },
-            "file_plugins": {
-                name[2:]: {"enable": data["enable"], "version": data["version"]}
-                for name, data in self.plugins["file_plugins"].items()
-            }
-        }
-
-        # 将插件信息写入 JSON 文件
-        with open("cache/plugins.json", "w", encoding="utf-8") as f:
-            json.dump(serializable_plugins, f, ensure_ascii=False, indent=4)
-
-        # 更新 server 实例中的插件列表
-        self.server.pm_list = serializable_plugins
+        # 从清单缓存中取得插件列表与元信息，目录与插件文件未变化时不再重新扫描
+        manifest = PluginManifest()
+        folder_entries = manifest.scan(folder_plugin_folder, "folder")
+        file_entries = manifest.scan(file_plugin_folder, "file")
+        self.entries = {entry.plugin_name: entry for entry in folder_entries + file_entries}
+        logger.debug(f"[ 插件管理器 ] 插件清单缓存命中 {manifest.hits}/{manifest.hits + manifest.misses}")
+
+        # 按依赖关系分层并发加载插件
+        await self._load_entries(folder_plugin_folder, file_plugin_folder, folder_entries + file_entries)
+
+        # 写回清单，并更新 server 实例中的插件列表
+        self.server.pm_list = manifest.save(folder_entries + file_entries)
         # 单独更新插件列表
         self.folder_plugins = self.server.pm_list.get('folder_plugins', {})
         self.file_plugins = self.server.pm_list.get('file_plugins', {})
@@ -108,102 +224,84 @@ class PluginManager:
                 logger.info("[ 插件管理器 ] ❌ 加载失败的插件名单: %s", ', '.join(self.failedloaded_plugins))
         logger.info("-----------------------------****")
 
-    async def _sequentially_load_plugins(self, folder_plugin_folder, file_plugin_folder, ignore_files):
-        """按顺序加载文件夹插件和单文件插件"""
-        # 先加载文件夹插件
-        await self._load_folder_plugins(folder_plugin_folder, ignore_files)
-        
-        # 然后加载单文件插件
-        await self._load_file_plugins(file_plugin_folder, ignore_files)
-
-        logger.info("_____________________________")
-        logger.info("[ 插件管理器 ] 后加载...\n")
+    async def _load_entries(self, folder_plugin_folder, file_plugin_folder, entries):
+        """
+        按 # __requires__ / # __provides__ 构建依赖图，逐层加载插件
 
-    async def _load_folder_plugins(self, folder_plugin_folder, ignore_files):
-        logger.info(f"\n\n##########\n加载文件夹插件目录: {folder_plugin_folder}\n##########\n")
+        同一层的插件互不依赖，依次构造后并发执行各自的 start()；缺少依赖或存在循环依赖的插件在加载前即被排除
+        """
+        logger.info(f"\n\n##########\n加载插件目录: {folder_plugin_folder}, {file_plugin_folder}\n##########\n")
         logger.info("_____________________________")
-        if not os.listdir(folder_plugin_folder):
-            logger.warning(f"[ 插件管理器 ] 插件文件夹 {folder_plugin_folder} 下没有文件")
+        if not entries:
+            logger.warning("[ 插件管理器 ] 插件文件夹下没有插件")
             return
-        for filename in os.listdir(folder_plugin_folder):
-            folder_path = os.path.join(folder_plugin_folder, filename)
 
-            if filename in ignore_files or not os.path.isdir(folder_path):
-                continue
-
-            if not (filename.startswith("p_") or filename.startswith("u_")):
-                continue
-
-            version = self._get_plugin_version(folder_path)
-            self.plugins["folder_plugins"][filename] = {
-                "enable": filename.startswith("p_"),
-                "version": version
-            }
-
-            if filename.startswith("p_"):
-                module_path = f"plugins.{filename}.main"
-                if await self._load_plugin(module_path, filename):
-                    logger.info(f"[ 插件管理器 ] ✔️ 插件📁 {filename[2:]} 加载成功，版本 {version}")
-                    logger.info("-----------------------------")
-                    logger.info("_____________________________")
+        for entry in entries:
+            kind = "folder_plugins" if entry.kind == "folder" else "file_plugins"
+            self.plugins[kind][entry.name] = {"enable": entry.enable, "version": entry.version}
+            if not entry.enable and entry.kind == "file":
+                self.unloaded_plugins.append(entry.name)
+                logger.info(f"[ 插件管理器 ] 🗑️ 插件📄 {entry.name} 处于卸载状态")
+
+        levels, deps, problems = plan_load_levels([entry for entry in entries if entry.enable])
+        for plugin_name, reason in problems.items():
+            self.failedloaded_plugins.append(plugin_name)
+            logger.error(f"[ 插件管理器 ] ❌ 插件 {plugin_name} 无法加载: {reason}")
+
+        # 被其他插件依赖的延迟加载插件在启动时加载
+        required = set().union(*deps.values())
+        unavailable = set(problems)
+        for index, level in enumerate(levels, 1):
+            to_load = []
+            for entry in level:
+                icon = "📁" if entry.kind == "folder" else "📄"
+                missing = deps[entry.plugin_name] & unavailable
+                if missing:
+                    unavailable.add(entry.plugin_name)
+                    self.failedloaded_plugins.append(entry.plugin_name)
+                    logger.error(f"[ 插件管理器 ] ❌ 插件{icon} {entry.plugin_name} 依赖的插件 {', '.join(sorted(missing))} 未在本 worker 加载")
+                elif self._is_pinned_elsewhere(entry):
+                    unavailable.add(entry.plugin_name)
+                    self.pinned_plugins.add(entry.plugin_name)
+                    logger.info(f"[ 插件管理器 ] 📌 插件{icon} {entry.plugin_name} 为单例插件，仅在 worker 0 上运行")
+                elif entry.lazy and entry.plugin_name not in required:
+                    self.lazy_plugins[entry.plugin_name] = entry
+                    logger.info(f"[ 插件管理器 ] 💤 插件{icon} {entry.plugin_name} 延迟加载，收到第一条消息时加载")
                 else:
-                    self.failedloaded_plugins.append(filename[2:])
-                    logger.error(f"[ 插件管理器 ] ❌ 插件📁 {filename[2:]} 初始化时出现错误，版本 {version}")
-                    logger.error(f"[ 插件管理器 / {filename[2:]} ] {traceback.format_exc()}")  # 打印完整的错误堆栈
-                    logger.info("-----------------------------")
-                    logger.info("_____________________________")
-
-    async def _load_file_plugins(self, file_plugin_folder, ignore_files):
-        logger.info(f"\n\n##########\n加载单文件插件目录: {file_plugin_folder}\n##########\n")
-        logger.info("_____________________________")
-        if not os.listdir(file_plugin_folder):
-            logger.warning(f"[ 插件管理器 ] 单文件插件文件夹 {file_plugin_folder} 下没有文件")
-            return
-        for filename in os.listdir(file_plugin_folder):
-            if filename in ignore_files or not filename.endswith(".py"):
-                continue
-
-            plugin_name = filename[:-3]
-            if plugin_name.startswith("u_"):
-                version = self._get_plugin_version(os.path.join(file_plugin_folder, filename))
-                self.plugins["file_plugins"][filename] = {
-                    "enable": False,
-                    "version": version
-                }
-                self.unloaded_plugins.append(plugin_name)
-                logger.info(f"[ 插件管理器 ] 🗑️ 插件📄 {plugin_name} 处于卸载状态")
+                    to_load.append(entry)
+            if not to_load:
                 continue
 
-            version = self._get_plugin_version(os.path.join(file_plugin_folder, filename))
-            self.plugins["file_plugins"][filename] = {
-                "enable": True,
-                "version": version
-            }
-
-            module_path = f"plugins.example.{plugin_name}"
+            logger.info(f"[ 插件管理器 ] 第 {index} 层，并发加载: {', '.join(entry.plugin_name for entry in to_load)}")
+            results = await asyncio.gather(*(self._load_plugin(entry.module_path, entry.name) for entry in to_load))
+            for entry, loaded in zip(to_load, results):
+                icon = "📁" if entry.kind == "folder" else "📄"
+                if loaded:
+                    logger.info(f"[ 插件管理器 ] ✔️ 插件{icon} {entry.plugin_name} 加载成功，版本 {entry.version}")
+                else:
+                    unavailable.add(entry.plugin_name)
+                    self.failedloaded_plugins.append(entry.plugin_name)
+                    logger.error(f"[ 插件管理器 ] ❌ 插件{icon} {entry.plugin_name} 初始化时出现错误，版本 {entry.version}")
+            logger.info("-----------------------------")
 
-            if await self._load_plugin(module_path, plugin_name):
-                logger.info(f"[ 插件管理器 ] ✔️ 插件📄 {plugin_name[2:]} 加载成功，版本 {version}")
-                logger.info("-----------------------------")
-                logger.info("_____________________________")
-            else:
-                self.failedloaded_plugins.append(plugin_name[2:])
-                logger.error(f"[ 插件管理器 ] ❌ 插件📄 {plugin_name[2:]} 初始化时出现错误，版本 {version}")
-                logger.error(f"[ 插件管理器 / {plugin_name[2:]} ] {traceback.format_exc()}")  # 打印完整的错误堆栈
-                logger.info("-----------------------------")
-                logger.info("_____________________________")
+        logger.info("_____________________________")
+        logger.info("[ 插件管理器 ] 后加载...\n")
 
     async def _load_plugin(self, module_path, plugin_name):
         """加载插件并实例化插件类"""
-        if plugin_name in [plugin.__class__.__name__ for plugin in self.plugins["loaded_plugins"]]:
+        if plugin_name[2:] in self.instances:
             logger.warning(f"[ 插件管理器 ] 插件 {plugin_name} 已加载，跳过重复加载。")
             return False
+        if plugin_name[2:] in getattr(self.server, "isolated_plugins", ()):
+            return await self._load_isolated_plugin(module_path, plugin_name)
         try:
-            module = importlib.import_module(module_path)
-            plugin_class = self._get_plugin_class(module, plugin_name)
-            if plugin_class:
-                plugin_instance = plugin_class(self.server)
-                self.plugins["loaded_plugins"].append(plugin_instance)
+            # 导入与实例化在事件循环线程中进行: 插件构造函数可以创建 asyncio 对象，阻塞也能被看门狗发现；
+            # 耗时的初始化在 start() 中，同一层插件的 start() 由 gather 并发执行，完成后才开始接收消息
+            plugin_instance = self._instantiate_plugin(module_path, plugin_name)
+            if plugin_instance is not None:
+                if hasattr(plugin_instance, "start"):
+                    await plugin_instance.start()
+                self._register_instance(plugin_name[2:], plugin_instance)
                 return True
             logger.error(f"[ 插件管理器 ] 插件 {plugin_name} 加载失败，文件命名不规范")
             return False
@@ -227,6 +325,48 @@ class PluginManager:
             logger.debug(f"详细错误信息: {error_trace}")  # 只在调试时打印
         return False
 
+    async def _load_isolated_plugin(self, module_path, plugin_name):
+        """在独立子进程中加载插件，父进程只保留代理，不导入插件模块"""
+        plugin_instance = IsolatedPlugin.create(self.server, module_path, plugin_name[2:])
+        try:
+            await plugin_instance.start()
+        except Exception as e:
+            logger.error(f"[ 插件管理器 ] 插件 {plugin_name} 的子进程启动失败: {e}")
+            return False
+        self._register_instance(plugin_name[2:], plugin_instance)
+        logger.info(f"[ 插件管理器 ] 插件 {plugin_name[2:]} 运行在独立子进程中，PID {plugin_instance.pid}")
+        return True
+
+    def _instantiate_plugin(self, module_path, plugin_name):
+        """导入插件模块并实例化插件类，类名不规范时返回 None"""
+        module = importlib.import_module(module_path)
+        plugin_class = self._get_plugin_class(module, plugin_name)
+        return plugin_class(self.server) if plugin_class else None
+
+    def _register_instance(self, plugin_name, plugin_instance):
+        """记录已加载的插件实例及其提供的服务"""
+        self.plugins["loaded_plugins"].append(plugin_instance)
+        self.instances[plugin_name] = plugin_instance
+        routes = get_routes(type(plugin_instance))
+        if routes:
+            self.routes[plugin_name] = routes
+        entry = self.entries.get(plugin_name)
+        for service in (entry.provides if entry is not None else ()):
+            self.services.setdefault(service, plugin_instance)
+
+    def _unregister_instance(self, plugin_instance):
+        self.plugins["loaded_plugins"].remove(plugin_instance)
+        for name in [name for name, instance in self.instances.items() if instance is plugin_instance]:
+            del self.instances[name]
+            self.routes.pop(name, None)
+        for name in [name for name, instance in self.services.items() if instance is plugin_instance]:
+            del self.services[name]
+
+    def get_service(self, name):
+        """按插件名或服务名取得已加载的插件实例，未加载时返回 None"""
+        instance = self.instances.get(name)
+        return instance if instance is not None else self.services.get(name)
+
     def _get_plugin_class(self, module, plugin_name):
         """从模块中获取插件类"""
         if len(plugin_name) < 3:
@@ -239,23 +379,31 @@ class PluginManager:
         logger.debug(f"[ 插件管理器 ] 拼接到的插件类名：{class_name}")
         return getattr(module, class_name, None)
 
-    def _get_plugin_version(self, plugin_path):
-        """获取插件版本"""
-        version = "未知版本"
-        if os.path.isfile(plugin_path):
-            with open(plugin_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                if len(lines) > 1 and lines[1].startswith('# __version__'):
-                    version = lines[1].split('=')[1].strip().strip('"').strip("'")
-        elif os.path.isdir(plugin_path):
-            init_file = os.path.join(plugin_path, '__init__.py')
-            if os.path.isfile(init_file):
-                with open(init_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    if len(lines) > 1 and lines[1].startswith('# __version__'):
-                        version = lines[1].split('=')[1].strip().strip('"').strip("'")
-        return version
- 
+    def _is_pinned_elsewhere(self, entry):
+        """
+        多 worker 模式下，声明了 # __singleton__ = True 的插件只在 worker 0 上运行，
+        其他 worker 跳过加载
+        """
+        if getattr(self.server, "is_primary", True):
+            return False
+        return entry.singleton
+
+    async def _load_lazy_plugin(self, plugin_name):
+        """延迟加载的插件在收到第一条消息时加载，同时到达的消息共用同一次加载"""
+        task = self._lazy_loads.get(plugin_name)
+        if task is None:
+            entry = self.lazy_plugins[plugin_name]
+            logger.info(f"[ 插件管理器 ] 💤 收到发往插件 {plugin_name} 的第一条消息，开始加载...")
+            task = self._lazy_loads[plugin_name] = asyncio.ensure_future(self._load_plugin(entry.module_path, entry.name))
+        loaded = await asyncio.shield(task)
+        if self.lazy_plugins.pop(plugin_name, None) is not None:
+            self._lazy_loads.pop(plugin_name, None)
+            if loaded:
+                logger.info(f"[ 插件管理器 ] ✔️ 插件 {plugin_name} 加载成功")
+            else:
+                self.failedloaded_plugins.append(plugin_name)
+                logger.error(f"[ 插件管理器 ] ❌ 插件 {plugin_name} 加载失败")
+        return loaded
 
     async def dispatch_message(self, websocket, message, semaphore):
         """异步分发消息"""
@@ -263,58 +411,119 @@ class PluginManager:
         plugin_name = message.get('plugin')
         method = message.get('method')
 
-        if plugin_name != "pluginManager":
+        # 授权检查: 握手时缓存在连接上的权限范围 (batch 子请求经 BatchCollector 转发到同一连接)
+        grant = getattr(websocket, 'auth_grant', None)
+        if grant is None or (plugin_name != "all" and not grant.allows(plugin_name, method)):
+            hot.warning("[ 插件消息分发 ] token %s 无权调用 %s.%s", getattr(grant, 'name', None), plugin_name, method)
+            await reply(websocket, message, {"plugin": plugin_name, "error": f"无权调用 {plugin_name}.{method}"})
+            return
+
+        if plugin_name not in ("pluginManager", "all"):
             # 判断插件是否在插件列表中
             if plugin_name not in self.folder_plugins and plugin_name not in self.file_plugins:
-                logger.debug(f"[ 插件消息分发 ] 插件 {plugin_name} 未加载，取消消息分发")
+                hot.debug("[ 插件消息分发 ] 插件 %s 未加载，取消消息分发", plugin_name)
+                await self._refuse(websocket, message, plugin_name, f"插件 {plugin_name} 未加载")
                 return  # 未加载该插件，直接取消消息分发
             
             # 判断插件是否启用
             if plugin_name in self.folder_plugins and not self.folder_plugins[plugin_name].get('enable', False):
-                logger.debug(f"[ 插件消息分发 ] 插件 {plugin_name} 在 folder_plugins 中未启用，取消消息分发")
+                hot.debug("[ 插件消息分发 ] 插件 %s 在 folder_plugins 中未启用，取消消息分发", plugin_name)
+                await self._refuse(websocket, message, plugin_name, f"插件 {plugin_name} 未启用")
                 return  # 插件未启用，取消消息分发
 
             if plugin_name in self.file_plugins and not self.file_plugins[plugin_name].get('enable', False):
-                logger.debug(f"[ 插件消息分发 ] 插件 {plugin_name} 在 file_plugins 中未启用，取消消息分发")
+                hot.debug("[ 插件消息分发 ] 插件 %s 在 file_plugins 中未启用，取消消息分发", plugin_name)
+                await self._refuse(websocket, message, plugin_name, f"插件 {plugin_name} 未启用")
                 return  # 插件未启用，取消消息分发
                     
-        async with semaphore:
+        if plugin_name not in ("all", "pluginManager"):
+            # 记录连接对插件的订阅关系，供按插件筛选的广播使用 (batch 子请求记在真实的连接上)
+            connection = websocket.websocket if type(websocket) is BatchCollector else websocket
+            self.server.connections.subscribe(connection, plugin_name)
+
+        if plugin_name in self.lazy_plugins:
+            await self._load_lazy_plugin(plugin_name)
+
+        if self.swapping:
+            # 插件热重载期间，发往该插件的消息等新实例就绪后再分发
+            gates = list(self.swapping.values()) if plugin_name == "all" else [self.swapping.get(plugin_name)]
+            for gate in gates:
+                if gate is not None:
+                    await gate.wait()
+
+        async with self._dispatch_slot(semaphore):
             tasks = []
             if plugin_name == 'all':
-                for plugin in self.plugins.get("loaded_plugins", []):
+                for name, plugin in self.instances.items():
+                    routes = self.routes.get(name)
+                    if routes is not None and method not in routes:
+                        continue  # 群发消息只交给支持该方法的插件
+                    if not grant.allows(name, method):
+                        continue  # 以及该 token 有权调用的插件
                     if hasattr(plugin, 'on_message'):
                         # 使用插件的类名作为任务名称
-                        task = asyncio.create_task(plugin.on_message(websocket, message))
+                        task = asyncio.create_task(self._timed_on_message(plugin, websocket, message, method))
                         task.set_name(plugin.__class__.__name__)  # 设置任务名称为插件类名
                         tasks.append(task)  # 并行处理插件消息
-                        logger.debug("[ 插件消息分发 ] 消息已群发")
+                        hot.debug("[ 插件消息分发 ] 消息已群发")
+                if not tasks:
+                    await self._refuse(websocket, message, plugin_name, f"没有可以处理 {method} 的插件")
             elif plugin_name == "pluginManager":
-                logger.info(f"[ 插件消息分发 > 插件管理器事件 ] 操作对象： {plugin_name}")
-                await self.pluginManager(websocket, message)
+                hot.info("[ 插件消息分发 > 插件管理器事件 ] 操作对象： %s", plugin_name)
+                await self.metrics.timed("pluginManager", method, self.pluginManager(websocket, message))
 
             else:
                 # 如果是指定插件名，只分发给对应插件
-                plugin_class = plugin_name + "Plugin"
-                for plugin in self.plugins.get("loaded_plugins", []):
-                    if hasattr(plugin, 'on_message') and plugin.__class__.__name__ == plugin_class:
-                        
-                        task = asyncio.create_task(plugin.on_message(websocket, message))
-                        task.set_name(plugin.__class__.__name__)  # 设置任务名称为插件类名
-                        tasks.append(task)  # 并行处理插件消息
-                        # logger.debug(f"[ 插件消息分发 ] 消息已分发给插件 {plugin_name}")
+                plugin = self.instances.get(plugin_name)
+                routes = self.routes.get(plugin_name)
+                if routes is not None and method not in routes:
+                    # 插件未声明该方法，由框架直接答复，不再交给插件
+                    hot.debug("[ 插件消息分发 ] 插件 %s 不支持方法 %s", plugin_name, method)
+                    await reply(websocket, message, unsupported(plugin_name, method))
+                elif plugin is not None and hasattr(plugin, 'on_message'):
+                    task = asyncio.create_task(self._timed_on_message(plugin, websocket, message, method))
+                    task.set_name(plugin.__class__.__name__)  # 设置任务名称为插件类名
+                    tasks.append(task)
+                    # logger.debug(f"[ 插件消息分发 ] 消息已分发给插件 {plugin_name}")
+                else:
+                    # 插件在列表中但没有可用的实例 (加载失败、已停止，或只在 worker 0 上运行)
+                    hot.debug("[ 插件消息分发 ] 插件 %s 没有可用的实例，取消消息分发", plugin_name)
+                    error = (f"插件 {plugin_name} 仅在 worker 0 上运行" if plugin_name in self.pinned_plugins
+                             else f"插件 {plugin_name} 未加载")
+                    await self._refuse(websocket, message, plugin_name, error)
 
             if tasks:
-                try:
-                    await asyncio.gather(*tasks)
-                except Exception as e:  # 捕获所有异常
-                    for task in tasks:
-                        if task.done() and task.exception() is not None:
-                            plugin_name = task.get_name()  # 获取任务的名称
-                            if isinstance(task.exception(), KeyError):
-                                logger.debug(f"[ 插件管理器 ] 插件类 {plugin_name} 收到的消息中缺少 '喵喵喵' 字段")
-                            else:
-                                logger.error(f"[ 插件管理器 ] 插件类 {plugin_name} 处理消息时发生错误: {task.exception()}")
-                                logger.error(traceback.format_exc())  # 打印完整的错误堆栈
+                # 等待全部任务结束，出错的插件各自答复一条错误
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                for task, result in zip(tasks, results):
+                    if not isinstance(result, Exception):
+                        continue
+                    class_name = task.get_name()  # 获取任务的名称
+                    if isinstance(result, KeyError):
+                        hot.debug("[ 插件管理器 ] 插件类 %s 收到的消息中缺少 '喵喵喵' 字段", class_name)
+                    else:
+                        logger.error("[ 插件管理器 ] 插件类 %s 处理消息时发生错误: %s", class_name, result)
+                        logger.error("".join(traceback.format_exception(result)))  # 打印完整的错误堆栈
+                    await self._refuse(websocket, message, class_name[:-len("Plugin")], "插件处理消息时出错")
+
+    @contextlib.asynccontextmanager
+    async def _dispatch_slot(self, semaphore):
+        """取得全局分发信号量，等待期间计入 dispatch_waiting"""
+        self.dispatch_waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.dispatch_waiting -= 1
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    async def _refuse(self, websocket, message, plugin_name, error):
+        """答复无法处理的请求: 携带 id 的请求需要得到答复，否则客户端会一直等待该 id"""
+        if message.get("id") is not None:
+            await reply(websocket, message, {"plugin": plugin_name, "error": error})
+
 
 
 
@@ -322,35 +531,94 @@ class PluginManager:
 
 
 
+    def _timed_on_message(self, plugin, websocket, message, method):
+        """按路由表调用处理函数 (没有路由表时调用 on_message)，并按 (插件, 方法) 记录耗时"""
+        plugin_name = plugin.__class__.__name__[:-len("Plugin")]
+        routes = self.routes.get(plugin_name)
+        coroutine = route_message(plugin, routes, websocket, message) if routes else plugin.on_message(websocket, message)
+        return self.metrics.timed(plugin_name, method, coroutine)
+
+    async def stop_all(self, timeout=5):
+        """并发停止所有已加载的插件，单个插件最多等待 timeout 秒"""
+        loaded_plugins = list(self.plugins["loaded_plugins"])
+        if not loaded_plugins:
+            return
+
+        async def _stop(plugin):
+            plugin_name = plugin.__class__.__name__
+            if not hasattr(plugin, "stop"):
+                logger.warning(f"[ 插件管理器 / 退出 ] 插件 {plugin_name} 没有定义 stop() 方法")
+                return
+            try:
+                await asyncio.wait_for(plugin.stop(), timeout)
+                logger.info(f"[ 插件管理器 / 退出 ] 插件 {plugin_name} 已停止")
+            except asyncio.TimeoutError:
+                logger.warning(f"[ 插件管理器 / 退出 ] 插件 {plugin_name} 在 {timeout:.1f} 秒内未能停止，跳过")
+            except Exception as e:
+                logger.error(f"[ 插件管理器 / 退出 ] 停止插件 {plugin_name} 时出现错误: {e}")
+
+        logger.info(f"[ 插件管理器 / 退出 ] 正在停止 {len(loaded_plugins)} 个插件...")
+        await asyncio.gather(*(_stop(plugin) for plugin in loaded_plugins))
+        self.plugins["loaded_plugins"].clear()
+        self.instances.clear()
+        self.services.clear()
+        self.routes.clear()
 
     # 以下为插件管理器拓展功能
         
-    async def pluginManager(self, websocket, message):
+    async def pluginManager(self, websocket, message, relayed=False):
+        """
+        插件管理命令 (reload / stop / load)，以及查询消息处理指标 (metrics)
 
+        多 worker 模式下，命令在本 worker 执行后经集群总线转发给其他 worker，
+        relayed 为 True 表示命令来自其他 worker，不再继续转发
+        """
         # 获取消息中插件的名称
         plugin_name = message.get('message')
         method = message.get('method')
 
-        plugin_class = plugin_name + "Plugin"
-        loaded_plugin = next((plugin for plugin in self.plugins["loaded_plugins"] if plugin.__class__.__name__ == plugin_class), None)
-        logger.debug(f"[ 插件管理事件 ] 本次选取的实例：\n{loaded_plugin}")
+        if method == "metrics":
+            # 查询消息处理指标，message 为插件名时只返回该插件 (只统计本 worker)
+            await reply(websocket, message, {"plugin": "pluginManager", "metrics": self.metrics.snapshot(plugin_name)})
+            return
+
+        if not relayed and self.server.cluster is not None and method in ("reload", "stop", "load"):
+            self.server.cluster.publish("plugin_manager", message={
+                "plugin": "pluginManager", "method": method, "message": plugin_name,
+            })
+
+        if plugin_name in self.pinned_plugins:
+            # 单例插件只在 worker 0 上运行，命令已转发
+            if not relayed:
+                await reply(websocket, message, {"message": f"{plugin_name} 仅在 worker 0 上运行，命令已转发"})
+            return
+
+        loaded_plugin = self.instances.get(plugin_name)
+        hot.debug("[ 插件管理事件 ] 本次选取的实例：\n%s", loaded_plugin)
         
         if loaded_plugin:
             # 插件已加载
-            if method == "reload":
+            if method == "reload" and plugin_name in self.swapping:
+                await self._refuse(websocket, message, "pluginManager", f"{plugin_name} 正在重启，请稍后再试")
+            elif method == "reload":
                 logger.info(f"[ 插件管理事件 ] 重启插件： {plugin_name}...")
                 reload = await self.reload_plugin(loaded_plugin, plugin_name)
                 if reload:
                     response = {"message": f"{plugin_name} 重启成功"}
-                    await websocket.send(json.dumps(response, ensure_ascii=False))
+                    await reply(websocket, message, response)
+                else:
+                    await self._refuse(websocket, message, "pluginManager", f"{plugin_name} 重启失败")
             elif method == "stop":
                 logger.info(f"[ 插件管理事件 ] 停止插件： {plugin_name}...")
                 unload = await self._unload_plugin(loaded_plugin, plugin_name)
                 if unload:
                     response = {"message": f"{plugin_name} 停止成功"}
-                    await websocket.send(json.dumps(response, ensure_ascii=False))
+                    await reply(websocket, message, response)
+                else:
+                    await self._refuse(websocket, message, "pluginManager", f"{plugin_name} 停止失败")
             else:
                 logger.warning(f"[ 插件管理事件 ] 不支持的方法！")
+                await self._refuse(websocket, message, "pluginManager", f"不支持的方法 {method}")
 
         else:
             if method == "load":
@@ -358,9 +626,12 @@ class PluginManager:
                 unload = await self._toload_plugin(plugin_name)
                 if unload:
                     response = {"message": f"{plugin_name} 加载成功"}
-                    await websocket.send(json.dumps(response, ensure_ascii=False))
+                    await reply(websocket, message, response)
+                else:
+                    await self._refuse(websocket, message, "pluginManager", f"{plugin_name} 加载失败")
             else:
                 logger.error(f"[ 插件管理事件 ] 插件 {plugin_name} 未加载，暂无相关操作")
+                await self._refuse(websocket, message, "pluginManager", f"插件 {plugin_name} 未加载")
 
     """  
 
@@ -407,7 +678,7 @@ class PluginManager:
                 logger.error(f"[ 插件管理事件 / 插件卸载 ] 停止插件 {plugin_name} 时出现错误: {e}")
 
             # 卸载当前插件
-            self.plugins["loaded_plugins"].remove(loaded_plugin)
+            self._unregister_instance(loaded_plugin)
             logger.info(f"[ 插件管理事件 / 插件卸载 ] 插件 {plugin_name} 已卸载")
             return True
         except Exception as e:
@@ -417,21 +688,17 @@ class PluginManager:
     async def _toload_plugin(self, plugin_name):
         
         logger.debug(f"[ 插件管理事件 / 插件加载 ] 开始初始化插件 {plugin_name} ...\n")
-        plugin_type = self.check_plugin_type(plugin_name)
-        if plugin_type == "folder_plugin":
-            p_plugin_name = "p_" + plugin_name
-            module_path = f"plugins.{p_plugin_name}.main"
-        elif plugin_type == "file_plugin":
-            p_plugin_name = "p_" + plugin_name
-            module_path = f"plugins.example.{p_plugin_name}"
-        else:
+        if not self.check_plugin_type(plugin_name):
             # logger.error(f"[ 插件管理器 ] {plugin_name} 不存在。")
             return False
+        entry = self.entries[plugin_name]
+        # 手动加载延迟加载的插件后，不再等待第一条消息
+        self.lazy_plugins.pop(plugin_name, None)
         
         logger.info("_____________________________")
 
         # 重新加载插件
-        if await self._load_plugin(module_path, p_plugin_name):
+        if await self._load_plugin(entry.module_path, entry.name):
             logger.info(f"[ 插件管理事件 / 手动插件加载 ] 插件 {plugin_name} 重载成功")
             
             logger.info("-----------------------------")
@@ -443,20 +710,71 @@ class PluginManager:
             return False
 
  
-    async def reload_plugin(self, loaded_plugin, plugin_name):
-        """重载指定插件"""
-
-        """调试用的这段        
-                logger.debug(f"[ 插件管理事件 / 插件重载 ] 已加载实例列表：\n{self.plugins["loaded_plugins"]}")
-                for plugin in self.plugins["loaded_plugins"]:
-                    logger.debug(f"[ 插件管理事件 / 插件重载 ] 已加载的插件名称: {plugin.__class__.__name__}, 插件实例: {plugin}")
+    async def reload_plugin(self, loaded_plugin, plugin_name, drain_timeout=5):
         """
+        热重载指定插件
 
+        1. 暂停向该插件分发消息 (新消息在 dispatch_message 中等待)，等待在途消息处理完成
+        2. 通过 export_state() 导出旧实例的状态，再 stop() 停止其后台线程与服务器
+        3. 清除插件包在 sys.modules 中的缓存，重新导入，使代码修改生效
+        4. 将状态交给新实例的 import_state()，恢复消息分发
+        """
+        if plugin_name in self.swapping:
+            # 上一次重载尚未完成，旧实例已在停止中，不能再次导出状态与卸载
+            logger.warning(f"[ 插件管理事件 / 插件重载 ] 插件 {plugin_name} 正在重载，忽略本次重载请求")
+            return False
         logger.info(f"[ 插件管理事件 / 插件重载 ] 正在重载插件: {plugin_name}...\n")
 
-        # 卸载插件
-        if await self._unload_plugin(loaded_plugin, plugin_name):
-            logger.debug(f"[ 插件管理事件 / 插件重载 ] 插件 {plugin_name} 已成功卸载")
+        gate = self.swapping[plugin_name] = asyncio.Event()
+        try:
+            await self._drain_plugin(plugin_name, drain_timeout)
+            state = await self._call_hook(loaded_plugin, "export_state", plugin_name)
+
+            # 卸载插件
+            if await self._unload_plugin(loaded_plugin, plugin_name):
+                logger.debug(f"[ 插件管理事件 / 插件重载 ] 插件 {plugin_name} 已成功卸载")
 
-        if await self._toload_plugin(plugin_name):
+            self._purge_plugin_modules(plugin_name)
+            if not await self._toload_plugin(plugin_name):
+                return False
             logger.debug(f"[ 插件管理事件 / 插件重载 ] 插件 {plugin_name} 初始化成功\n")
+
+            if state is not None:
+                await self._call_hook(self.instances[plugin_name], "import_state", plugin_name, state)
+            return True
+        finally:
+            del self.swapping[plugin_name]
+            gate.set()
+
+    async def _drain_plugin(self, plugin_name, timeout):
+        """等待插件的在途消息处理完成，最多 timeout 秒"""
+        try:
+            await asyncio.wait_for(self.metrics.wait_idle(plugin_name), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[ 插件管理事件 / 插件重载 ] 插件 {plugin_name} 仍有 {self.metrics.inflight(plugin_name)} 条消息未处理完，继续重载")
+
+    async def _call_hook(self, plugin, hook, plugin_name, *args):
+        """调用插件的可选钩子 (普通函数或协程)，出错时记录日志并返回 None"""
+        if not hasattr(plugin, hook):
+            return None
+        try:
+            result = getattr(plugin, hook)(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            logger.error(f"[ 插件管理事件 / 插件重载 ] 插件 {plugin_name} 的 {hook}() 出现错误，状态未能交接: {e}")
+            logger.debug(traceback.format_exc())
+            return None
+
+    def _purge_plugin_modules(self, plugin_name):
+        """从 sys.modules 中移除插件包及其全部子模块，下次导入时重新执行插件代码"""
+        entry = self.entries.get(plugin_name)
+        if entry is None:
+            return
+        package = entry.module_path.rsplit(".", 1)[0] if entry.kind == "folder" else entry.module_path
+        purged = [name for name in sys.modules if name == package or name.startswith(package + ".")]
+        for name in purged:
+            del sys.modules[name]
+        importlib.invalidate_caches()
+        logger.debug(f"[ 插件管理事件 / 插件重载 ] 已清除插件 {plugin_name} 的 {len(purged)} 个模块缓存")
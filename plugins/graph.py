@@ -0,0 +1,80 @@
+# plugins/graph.py
+
+"""
+插件依赖图
+
+插件在头部注释中声明依赖与提供的服务:
+    # __requires__ = "StrMsg, storage"    依赖的插件名或服务名
+    # __provides__ = "storage"            本插件提供的服务名 (插件名本身总是可用作服务名)
+
+plan_load_levels 按依赖关系把插件分层: 每层中的插件只依赖之前各层的插件，同一层的插件可以并发加载。
+缺少依赖或处于依赖环中的插件 (以及依赖它们的插件) 在加载之前就被排除，并给出原因。
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def plan_load_levels(entries):
+    """
+    entries 为启用的 PluginEntry 列表，返回 (levels, deps, problems):
+      levels   [[PluginEntry, ...], ...] 按加载顺序排列的各层，层内按 (priority, 插件名) 排序
+      deps     {插件名: 依赖的插件名集合}
+      problems {插件名: 无法加载的原因}
+    """
+    by_name = {entry.plugin_name: entry for entry in entries}
+
+    # 服务名 -> 提供者，插件名优先，多个插件提供同一服务时 priority 小的优先
+    providers = dict(by_name)
+    for entry in sorted(entries, key=lambda entry: (entry.priority, entry.plugin_name)):
+        for service in entry.provides:
+            provider = providers.setdefault(service, entry)
+            if provider is not entry:
+                logger.warning(f"[ 插件依赖 ] 服务 {service} 同时由 {provider.plugin_name} 与 {entry.plugin_name} 提供，使用 {provider.plugin_name}")
+
+    deps = {name: set() for name in by_name}
+    problems = {}
+    for entry in entries:
+        for required in entry.requires:
+            provider = providers.get(required)
+            if provider is None:
+                problems[entry.plugin_name] = f"缺少依赖 {required}"
+            elif provider is not entry:
+                deps[entry.plugin_name].add(provider.plugin_name)
+
+    levels = []
+    done = set()
+    remaining = {name: set(required) for name, required in deps.items() if name not in problems}
+    while remaining:
+        # 依赖了无法加载的插件的插件同样无法加载
+        blocked = {name: required & problems.keys() for name, required in remaining.items() if required & problems.keys()}
+        if blocked:
+            for name, bad in blocked.items():
+                problems[name] = f"依赖的插件 {', '.join(sorted(bad))} 无法加载"
+                del remaining[name]
+            continue
+
+        ready = [name for name, required in remaining.items() if required <= done]
+        if not ready:
+            cycle = " -> ".join(_find_cycle(remaining))
+            for name in remaining:
+                problems[name] = f"存在循环依赖: {cycle}"
+            break
+        levels.append(sorted((by_name[name] for name in ready), key=lambda entry: (entry.priority, entry.plugin_name)))
+        done.update(ready)
+        for name in ready:
+            del remaining[name]
+    return levels, deps, problems
+
+
+def _find_cycle(graph):
+    """graph 中每个节点都至少依赖 graph 中的另一个节点，沿依赖走到重复节点即得到一个环"""
+    node = min(graph)
+    path = []
+    seen = {}
+    while node not in seen:
+        seen[node] = len(path)
+        path.append(node)
+        node = min(required for required in graph[node] if required in graph)
+    return path[seen[node]:] + [node]
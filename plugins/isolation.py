@@ -0,0 +1,388 @@
+# plugins/isolation.py
+
+"""
+插件子进程隔离
+
+配置 ISOLATED_PLUGINS 中列出的插件不在服务器进程中导入，而是运行在独立的子进程里:
+阻塞、内存泄漏或崩溃都只影响该子进程，CPU 密集的插件也不再与消息分发争抢 GIL。
+
+父进程中由 IsolatedPlugin 代理插件，保持 on_message(websocket, message) 的调用方式不变；
+子进程中插件收到的 websocket 是 ProxyWebSocket，send() 的内容经管道转发给父进程中的真实连接。
+子进程意外退出时，代理会按退避间隔自动重启。
+
+管道中每一帧为一个 JSON 对象，op 字段表示类型:
+  父 -> 子: message (id, message, connection) / stop
+  子 -> 父: ready / failed (error) / send (id, data) / done (id, error, error_type) /
+            log (name, level, msg) / broadcast (payload, selector) / exit_server (reason)
+"""
+
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+import traceback
+import importlib
+import multiprocessing
+
+from log import get_hot_logger
+
+logger = logging.getLogger(__name__)
+
+def _encode(frame):
+    return json.dumps(frame, ensure_ascii=False).encode("utf-8")
+
+
+class _Pending:
+    """一条转发给子进程、尚未处理完成的消息"""
+    __slots__ = ("websocket", "future", "sends")
+
+    def __init__(self, websocket, future):
+        self.websocket = websocket
+        self.future = future
+        self.sends = []  # 子进程通过 ProxyWebSocket 发出的回复 (按顺序发送的任务)
+
+
+class IsolatedPlugin:
+    """
+    父进程中的插件代理
+
+    通过 create() 生成以插件类名命名的子类实例，插件管理器按类名查找、分发、停止插件的逻辑都无需改动
+    """
+    def __init__(self, server, module_path, plugin_name, start_timeout=30):
+        self.server = server
+        self.module_path = module_path
+        self.plugin_name = plugin_name  # 去掉 p_ 前缀的插件名
+        self.start_timeout = start_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.loop = None
+        self.process = None
+        self.ready = None       # 子进程初始化结果，None 表示成功，否则为错误信息
+        self.exited = None      # 子进程退出时完成
+        self.pending = {}       # 请求编号 -> _Pending
+        self.next_id = 0
+        self.stopping = False
+        self.restarts = []      # 最近的重启时间，用于发现崩溃循环
+        self._send_queue = None
+        self._restart_task = None
+
+    @classmethod
+    def create(cls, server, module_path, plugin_name):
+        proxy_class = type(f"{plugin_name}Plugin", (cls,), {})
+        return proxy_class(server, module_path, plugin_name)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    async def start(self):
+        """启动子进程并等待插件初始化完成，失败时抛出 RuntimeError"""
+        self.loop = asyncio.get_running_loop()
+        self.ready = self.loop.create_future()
+        self.exited = self.loop.create_future()
+
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=child_main,
+            args=(child_conn, self.module_path, self.plugin_name, self._server_info()),
+            name=f"SenSus-plugin-{self.plugin_name}",
+            daemon=True,  # 服务器进程退出时子进程随之终止
+        )
+        self.process.start()
+        child_conn.close()
+
+        # 读写都在独立线程中进行，子进程卡住时不会阻塞事件循环
+        self._send_queue = queue.SimpleQueue()
+        threading.Thread(target=self._writer, args=(parent_conn, self._send_queue), daemon=True).start()
+        threading.Thread(target=self._reader, args=(parent_conn, self.process), daemon=True).start()
+
+        try:
+            error = await asyncio.wait_for(asyncio.shield(self.ready), self.start_timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            raise RuntimeError(f"插件子进程在 {self.start_timeout} 秒内未完成初始化")
+        if error is not None:
+            raise RuntimeError(error)
+
+    def _server_info(self):
+        """传给子进程的服务器信息 (子进程中无法访问真正的 server 对象)"""
+        hot = get_hot_logger("plugins")
+        log_level = next((level for level in (logging.DEBUG, logging.INFO, logging.WARNING) if hot.enabled(level)), logging.ERROR)
+        return {
+            "worker_id": getattr(self.server, "worker_id", 0),
+            "workers": getattr(self.server, "workers", 1),
+            "log_level": log_level,
+        }
+
+    def _send(self, frame):
+        self._send_queue.put(_encode(frame))
+
+    def _writer(self, conn, send_queue):
+        while True:
+            data = send_queue.get()
+            if data is None:
+                return
+            try:
+                conn.send_bytes(data)
+            except (OSError, ValueError):
+                return
+
+    def _reader(self, conn, process):
+        try:
+            while True:
+                frame = json.loads(conn.recv_bytes())
+                self.loop.call_soon_threadsafe(self._on_frame, frame)
+        except (EOFError, OSError):
+            pass
+        process.join(1)  # 在读线程中回收子进程，以便记录退出码
+        try:
+            self.loop.call_soon_threadsafe(self._on_child_exit, process)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def _on_frame(self, frame):
+        op = frame.get("op")
+        if op == "send":
+            entry = self.pending.get(frame["id"])
+            if entry is not None:
+                entry.sends.append(asyncio.ensure_future(entry.websocket.send(frame["data"])))
+        elif op == "done":
+            entry = self.pending.get(frame["id"])
+            if entry is not None and not entry.future.done():
+                entry.future.set_result((frame.get("error"), frame.get("error_type")))
+        elif op == "log":
+            logging.getLogger(frame["name"]).log(frame["level"], frame["msg"])
+        elif op == "ready":
+            if not self.ready.done():
+                self.ready.set_result(None)
+        elif op == "failed":
+            if not self.ready.done():
+                self.ready.set_result(frame["error"])
+        elif op == "broadcast":
+            asyncio.ensure_future(self.server.broadcast(frame["payload"], frame.get("selector")))
+        elif op == "exit_server":
+            self.server.exitServer(frame["reason"])
+
+    def _on_child_exit(self, process):
+        if process is not self.process:
+            return  # 已被替换的旧子进程
+        self._send_queue.put(None)
+        for entry in self.pending.values():
+            if not entry.future.done():
+                entry.future.set_result(("插件子进程已退出", "RuntimeError"))
+        if not self.exited.done():
+            self.exited.set_result(process.exitcode)
+
+        if not self.ready.done():
+            # 初始化阶段退出，由 start() 报告失败
+            self.ready.set_result(f"插件子进程初始化时退出 (exitcode={process.exitcode})")
+            return
+        if self.stopping:
+            return
+        logger.error(f"[ 插件隔离 / {self.plugin_name} ] 子进程意外退出 (exitcode={process.exitcode})，准备重启")
+        self._restart_task = asyncio.ensure_future(self._restart())
+
+    async def _restart(self, limit=5, window=60):
+        """按指数退避重启子进程，window 秒内重启超过 limit 次时放弃"""
+        while not self.stopping:
+            now = time.monotonic()
+            self.restarts = [t for t in self.restarts if now - t < window]
+            if len(self.restarts) >= limit:
+                logger.error(f"[ 插件隔离 / {self.plugin_name} ] {window} 秒内连续崩溃 {limit} 次，不再重启")
+                return
+            self.restarts.append(now)
+            await asyncio.sleep(min(2 ** (len(self.restarts) - 1), 30))
+            try:
+                await self.start()
+                logger.info(f"[ 插件隔离 / {self.plugin_name} ] 子进程已重启，PID {self.pid}")
+                return
+            except Exception as e:
+                logger.error(f"[ 插件隔离 / {self.plugin_name} ] 子进程重启失败: {e}")
+
+    async def on_message(self, websocket, message):
+        if self.process is None or not self.ready.done() or self.ready.result() is not None or self.exited.done():
+            raise RuntimeError(f"插件 {self.plugin_name} 的子进程不可用")
+
+        self.next_id += 1
+        request_id = self.next_id
+        entry = self.pending[request_id] = _Pending(websocket, self.loop.create_future())
+
+        info = self.server.connections.get_by_socket(websocket)
+        self._send({
+            "op": "message",
+            "id": request_id,
+            "message": message,
+            "connection": {
+                "connection_id": info.connection_id if info is not None else None,
+                "remote_address": getattr(websocket, "remote_address", None),
+            },
+        })
+        try:
+            error, error_type = await entry.future
+        finally:
+            self.pending.pop(request_id, None)
+
+        # 回复按子进程发出的顺序依次完成，与进程内调用时一样由调用方处理发送异常
+        for send in entry.sends:
+            await send
+        if error is not None:
+            # KeyError 保持原类型，分发器对缺少字段的消息只记录调试日志
+            raise KeyError(error) if error_type == "KeyError" else RuntimeError(error)
+
+    async def stop(self, timeout=5):
+        """通知子进程停止插件并退出，超时后强制终止"""
+        self.stopping = True
+        if self._restart_task is not None:
+            self._restart_task.cancel()
+        if self.process is None or self.exited.done():
+            return
+        self._send({"op": "stop"})
+        try:
+            await asyncio.wait_for(asyncio.shield(self.exited), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[ 插件隔离 / {self.plugin_name} ] 子进程未能在 {timeout} 秒内退出，强制终止")
+        await self.loop.run_in_executor(None, self._join)
+
+    def _join(self):
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+# 以下代码运行在子进程中
+
+class _Channel:
+    """子进程一侧的管道，插件的线程与事件循环都可能发送，发送需加锁"""
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, frame):
+        data = _encode(frame)
+        with self.lock:
+            self.conn.send_bytes(data)
+
+
+class _PipeLogHandler(logging.Handler):
+    """将子进程中的日志转发给父进程，由父进程的日志配置统一输出"""
+    def __init__(self, channel, level):
+        super().__init__(level)
+        self.channel = channel
+
+    def emit(self, record):
+        try:
+            msg = record.getMessage()
+            if record.exc_info:
+                msg += "\n" + "".join(traceback.format_exception(*record.exc_info))
+            self.channel.send({"op": "log", "name": record.name, "level": record.levelno, "msg": msg})
+        except Exception:
+            self.handleError(record)
+
+
+class ProxyWebSocket:
+    """子进程中插件收到的 websocket，send() 经管道交给父进程发送到真实连接"""
+    def __init__(self, channel, request_id, connection):
+        self.channel = channel
+        self.request_id = request_id
+        self.connection_id = connection.get("connection_id")
+        self.remote_address = connection.get("remote_address")
+
+    async def send(self, data, text=None):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        self.channel.send({"op": "send", "id": self.request_id, "data": data})
+
+
+class ChildServer:
+    """子进程中插件看到的 server，只提供与父进程通信的少量接口"""
+    def __init__(self, channel, info):
+        from metrics import MetricsRegistry
+
+        self.channel = channel
+        self.worker_id = info["worker_id"]
+        self.workers = info["workers"]
+        self.is_primary = self.worker_id == 0
+        self.isolated = True
+        # 子进程中的指标只在本进程内有效，不会出现在父进程的 /metrics 中
+        self.metrics = MetricsRegistry()
+
+    def exitServer(self, reason):
+        self.channel.send({"op": "exit_server", "reason": reason})
+
+    async def broadcast(self, payload, selector=None, timeout=None):
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        self.channel.send({"op": "broadcast", "payload": payload, "selector": selector})
+
+    def __getattr__(self, name):
+        raise AttributeError(f"隔离模式下插件无法访问 server.{name}")
+
+
+def child_main(conn, module_path, plugin_name, server_info):
+    """子进程入口"""
+    channel = _Channel(conn)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.DEBUG)
+    root.addHandler(_PipeLogHandler(channel, server_info["log_level"]))
+    try:
+        asyncio.run(_child_run(conn, channel, module_path, plugin_name, server_info))
+    except KeyboardInterrupt:
+        pass  # 终端的 Ctrl+C 同样会发给子进程，退出由父进程控制
+
+
+async def _child_run(conn, channel, module_path, plugin_name, server_info):
+    loop = asyncio.get_running_loop()
+    try:
+        module = importlib.import_module(module_path)
+        plugin_class = getattr(module, f"{plugin_name}Plugin")
+        plugin = plugin_class(ChildServer(channel, server_info))
+        if hasattr(plugin, "start"):
+            await plugin.start()
+    except Exception:
+        channel.send({"op": "failed", "error": traceback.format_exc()})
+        return
+    channel.send({"op": "ready"})
+
+    inbox = asyncio.Queue()
+
+    def read():
+        try:
+            while True:
+                frame = json.loads(conn.recv_bytes())
+                loop.call_soon_threadsafe(inbox.put_nowait, frame)
+        except (EOFError, OSError):
+            # 父进程已退出
+            loop.call_soon_threadsafe(inbox.put_nowait, None)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    tasks = set()
+    while True:
+        frame = await inbox.get()
+        if frame is None or frame["op"] == "stop":
+            break
+        task = asyncio.create_task(_handle_message(plugin, channel, frame))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks, timeout=5)
+    if hasattr(plugin, "stop"):
+        try:
+            await plugin.stop()
+        except Exception as e:
+            logger.error(f"[ 插件隔离 / {plugin_name} ] 停止插件时出现错误: {e}")
+
+
+async def _handle_message(plugin, channel, frame):
+    websocket = ProxyWebSocket(channel, frame["id"], frame.get("connection") or {})
+    error = error_type = None
+    try:
+        await plugin.on_message(websocket, frame["message"])
+    except Exception as e:
+        error, error_type = str(e), type(e).__name__
+    channel.send({"op": "done", "id": frame["id"], "error": error, "error_type": error_type})
@@ -0,0 +1,196 @@
+# plugins/manifest.py
+
+"""
+插件清单缓存
+
+启动时插件管理器需要列出插件目录，并读取每个插件头部的元信息注释。清单把结果缓存在 cache/plugins.json 中:
+  - 目录的 mtime 未变 (没有插件被新增、删除或改名) 时，直接使用缓存的目录列表，不再遍历目录
+  - 头部文件 (文件夹插件的 __init__.py / 单文件插件自身) 的 mtime 与大小未变时，直接使用缓存的元信息，不再打开文件
+
+插件在文件开头的注释中声明元信息:
+    # __version__ = "1.0.0"
+    # __requires__ = "StrMsg, storage"      依赖的插件名或服务名 (也可写作 __dependencies__)
+    # __provides__ = "storage"               本插件提供的服务名
+    # __priority__ = 10                      同一依赖层中数值小的先开始加载，默认 100
+    # __lazy__ = True                        不在启动时加载，收到第一条消息时再加载
+    # __singleton__ = True                   多 worker 模式下只在 worker 0 上运行
+"""
+
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = "cache/plugins.json"
+MANIFEST_FORMAT = 1         # 缓存结构变化时递增，旧缓存会被忽略
+DEFAULT_PRIORITY = 100
+IGNORE_FILES = {"__init__.py", "__pycache__"}
+
+
+def read_plugin_header(header_path):
+    """解析文件开头连续注释行中的 # __key__ = value 元信息"""
+    header = {}
+    with open(header_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            key, sep, value = line[1:].partition('=')
+            key = key.strip()
+            if sep and key.startswith('__') and key.endswith('__'):
+                header[key[2:-2]] = value.strip().strip('"').strip("'")
+    return header
+
+
+class PluginEntry:
+    """清单中的一个插件"""
+    def __init__(self, name, kind, path, module_path, header):
+        self.name = name                # 带 p_ / u_ 前缀的目录名或文件名 (不含 .py)
+        self.kind = kind                # "folder" / "file"
+        self.path = path
+        self.module_path = module_path  # 插件主类所在的模块
+        self.header = header
+
+    @property
+    def plugin_name(self):
+        return self.name[2:]
+
+    @property
+    def enable(self):
+        return self.name.startswith("p_")
+
+    @property
+    def version(self):
+        return self.header.get("version", "未知版本")
+
+    def _names(self, key):
+        return [name.strip() for name in self.header.get(key, "").split(",") if name.strip()]
+
+    @property
+    def requires(self):
+        return list(dict.fromkeys(self._names("requires") + self._names("dependencies")))
+
+    @property
+    def provides(self):
+        return self._names("provides")
+
+    @property
+    def priority(self):
+        try:
+            return int(self.header.get("priority", DEFAULT_PRIORITY))
+        except ValueError:
+            logger.warning(f"[ 插件清单 ] 插件 {self.plugin_name} 的 priority 不是整数: {self.header['priority']}")
+            return DEFAULT_PRIORITY
+
+    @property
+    def lazy(self):
+        return self.header.get("lazy", "").lower() == "true"
+
+    @property
+    def singleton(self):
+        return self.header.get("singleton", "").lower() == "true"
+
+    def to_dict(self):
+        return {
+            "enable": self.enable,
+            "version": self.version,
+            "requires": self.requires,
+            "provides": self.provides,
+            "priority": self.priority,
+            "lazy": self.lazy,
+        }
+
+
+class PluginManifest:
+    """
+    读取并维护 cache/plugins.json
+
+    scan() 返回目录中的插件，save() 写回本次扫描的结果；
+    文件中 folder_plugins / file_plugins 两项为插件列表，manifest 项为缓存数据
+    """
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.cache = self._read()
+        self.dirs = {}      # 目录 -> {"mtime", "names"}
+        self.files = {}     # 头部文件 -> {"stamp": [mtime_ns, size], "header"}
+        self.hits = 0
+        self.misses = 0
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f).get("manifest") or {}
+        except (OSError, ValueError, AttributeError):
+            manifest = {}
+        if manifest.get("format") != MANIFEST_FORMAT:
+            return {"dirs": {}, "files": {}}
+        return manifest
+
+    def scan(self, directory, kind):
+        """列出目录中的插件 (kind 为 "folder" 或 "file")，按 (priority, 名称) 排序"""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+        cached = self.cache["dirs"].get(directory)
+        if cached is not None and cached["mtime"] == mtime:
+            names = cached["names"]
+        else:
+            names = sorted(self._list(directory, kind))
+        self.dirs[directory] = {"mtime": mtime, "names": names}
+
+        package = os.path.normpath(directory).replace(os.sep, ".")
+        entries = [self._entry(directory, package, name, kind) for name in names]
+        entries.sort(key=lambda entry: (entry.priority, entry.name[2:]))
+        return entries
+
+    def _list(self, directory, kind):
+        with os.scandir(directory) as it:
+            for item in it:
+                if item.name in IGNORE_FILES or not item.name.startswith(("p_", "u_")):
+                    continue
+                if kind == "folder" and item.is_dir():
+                    yield item.name
+                elif kind == "file" and item.is_file() and item.name.endswith(".py"):
+                    yield item.name[:-3]
+
+    def _entry(self, directory, package, name, kind):
+        if kind == "folder":
+            path = os.path.join(directory, name)
+            header_path = os.path.join(path, "__init__.py")
+            module_path = f"{package}.{name}.main"
+        else:
+            path = header_path = os.path.join(directory, name + ".py")
+            module_path = f"{package}.{name}"
+
+        try:
+            stat = os.stat(header_path)
+            stamp = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            stamp = None
+        cached = self.cache["files"].get(header_path)
+        if stamp is not None and cached is not None and cached["stamp"] == stamp:
+            header = cached["header"]
+            self.hits += 1
+        else:
+            header = read_plugin_header(header_path) if stamp is not None else {}
+            self.misses += 1
+        self.files[header_path] = {"stamp": stamp, "header": header}
+        return PluginEntry(name, kind, path, module_path, header)
+
+    def save(self, entries):
+        """写回清单，返回 {folder_plugins, file_plugins} 插件列表"""
+        plugins = {
+            "folder_plugins": {entry.plugin_name: entry.to_dict() for entry in entries if entry.kind == "folder"},
+            "file_plugins": {entry.plugin_name: entry.to_dict() for entry in entries if entry.kind == "file"},
+        }
+        data = {**plugins, "manifest": {"format": MANIFEST_FORMAT, "dirs": self.dirs, "files": self.files}}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"[ 插件清单 ] 写入 {self.path} 失败: {e}")
+        return plugins
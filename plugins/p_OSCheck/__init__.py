@@ -1,6 +1,7 @@
 # plugins/p_OSCheck/__init__.py
 # __version__ = "1.0.0"
 # __name__ = "系统信息监视器"
+# __singleton__ = True
 
 import logging
 
@@ -1,12 +1,9 @@
-import time
 import subprocess
 import asyncio
 import threading
-import signal
 from colorama import init, Fore, Back, Style
 import platform
 import os
-import sys
 from plugins import Plugin
 import logging
 
@@ -17,9 +14,8 @@ class OSCheckPlugin(Plugin):
     def __init__(self, server):
         self.server = server
         self._stop_event = threading.Event()  # 用于停止后台线程
-        # 设置信号处理器
-        logger.debug("[ OSCheck ] 设置信号处理器...")
-        signal.signal(signal.SIGINT, self.handle_sigint)
+        # 退出信号由 WebSocketServer 统一处理，插件不再单独注册信号处理器
+        self.monitorTermux = None
 
         # 获取操作系统名称
         self.os_name = platform.system()
@@ -43,18 +39,13 @@ class OSCheckPlugin(Plugin):
             try:
                 self.termuxMark = 1
                 # 实例化 Termux 进程监视器
-                monitorTermux = MonitorTermux(server)
+                self.monitorTermux = MonitorTermux(server, self._stop_event)
                 logger.info(f"[ OSCheck ] {Fore.YELLOW}当前在 Android Termux 环境中运行{Style.RESET_ALL}")
             except Exception as e:
                 logger.error(f"[ OSCheck ] MonitorTermux 实例化错误: {e}")
             
         logger.info("[ OSCheck ] 初始化完毕\n")
         
-    # 自定义 Ctrl+C 处理函数
-    def handle_sigint(self, signal, frame):
-        logger.debug("[ OSCheck ] 正在关闭主进程...")
-        sys.exit(0)  # 优雅退出
-
     def is_termux(self):
         """
         检查当前是否在 Termux 环境中运行
@@ -63,8 +54,8 @@ class OSCheckPlugin(Plugin):
         return (platform.system() == "Linux" and 'TERMUX_VERSION' in os.environ) or os.path.exists('/data/data/com.termux/')
 
     async def stop(self):
-        logger.info("[ OSCheck ] 正在销毁自身实例...\n")
-        del self
+        logger.info("[ OSCheck ] 正在停止 Termux 监控...\n")
+        self._stop_event.set()
 
     async def on_message(self, websocket, message):
         # 可以根据消息执行相应的操作
@@ -72,8 +63,9 @@ class OSCheckPlugin(Plugin):
 
 
 class MonitorTermux():
-    def __init__(self, server):
+    def __init__(self, server, stop_event):
         self.server = server
+        self._stop_event = stop_event
         # 启动监控线程
         
         logger.info(f"[ OSCheck / MonitorTermux ] 启动 Termux 监控进程...")
@@ -111,11 +103,12 @@ class MonitorTermux():
         持续监控 Termux 是否存活
         若 Termux 进程关闭，则终止当前 Python 进程及所有子线程
         """
-        while True:
+        while not self._stop_event.is_set():
             if not self.is_termux_running():
                 reason = "Termux 已退出"
                 logger.warning(f"[ OSCheck / MonitorTermux ] {reason}，正在终止 SenSus 项目进程...")
-                # 退出当前进程及子线程
+                # 通知服务器优雅退出
                 self.server.exitServer(reason)
-            time.sleep(5)  # 每 5 秒检查一次
+                return
+            self._stop_event.wait(5)  # 每 5 秒检查一次
 
@@ -16,6 +16,7 @@ logger.info("[ StrMsg ] StrMsg 插件包正在初始化...")
 查询消息示例
 ws 请求
 {"token":"LovHuTao","plugin":"StrMsg","method":"get_latest_messages","message":"{\"count\": 10}"}
+{"token":"LovHuTao","plugin":"StrMsg","method":"search","message":"{\"query\": \"快递 deliver*\", \"limit\": 20, \"offset\": 0}"}
 
 POST 请求
 {"title":"喵喵喵2","source":"5600G的Chrome","content":"喵喵喵222"}
@@ -1,13 +1,10 @@
 from plugins import Plugin
+from plugins.routing import method
 import logging
 import asyncio
-import threading
-import signal
-import sys
-import time
-import json
 from .routes import Routes
 from .services import Services
+from .models.models import LatestMessagesQuery, SearchQuery
 
 # 配置这个插件的日志
 logger = logging.getLogger(__name__)
@@ -16,71 +13,77 @@ logger = logging.getLogger(__name__)
 class StrMsgPlugin(Plugin):
     def __init__(self, server):
         self.server = server
-        self._stop_event = threading.Event()  # 用于停止后台线程
-        # 设置信号处理器
-        logger.debug("[ SystemMonitor ] 设置信号处理器...")
-        signal.signal(signal.SIGINT, self.handle_sigint)
+        # 退出信号由 WebSocketServer 统一处理，插件不再单独注册信号处理器
+        self.routes = None
+        self.services = None
 
+    async def start(self):
+        """
+        创建路由与数据库服务并启动路由服务器
+
+        注册路由与打开数据库都是阻塞操作，在线程中进行，不阻塞事件循环上的 ws 连接与其他插件的启动
+        """
         # 初始化路由
         logger.info("[ StrMsg ] 实例化路由模块...")
-        self.routes = Routes(self.server)
+        self.routes = await asyncio.to_thread(Routes, self.server)
 
         # 初始化服务
         logger.info("[ StrMsg ] 实例化服务模块...")
-        self.services = Services(self.routes.app, self.server)
+        self.services = await asyncio.to_thread(Services, self.routes.app, self.server)
 
-        logger.info("[ StrMsg ] 初始化完毕\n")
+        # 路由与服务共用同一个数据库服务实例，再启动路由服务器
+        self.routes.app.state.db_service = self.services.DBservice
+        if self.server.is_primary:
+            self.routes.start_async_server()
+        else:
+            # 多 worker 模式下 webhook 监听端口只能由一个进程绑定，其他 worker 只负责 ws 查询
+            logger.info(f"[ StrMsg ] 当前为 worker {self.server.worker_id}，webhook 路由服务器由 worker 0 运行")
 
-    
-    # 自定义 Ctrl+C 处理函数
-    def handle_sigint(self, signal, frame):
-        logger.debug("[ StrMsg ] 正在关闭 通知聚合 进程...")
-        sys.exit(0)  # 优雅退出
+        logger.info("[ StrMsg ] 初始化完毕\n")
 
     async def stop(self):
-        logger.info("[ SystemMonitor ] 正在销毁自身实例...\n")
-        del self
+        """
+        停止插件：先让路由服务器停止接收并处理完在途的 webhook 请求 (写入数据库)，再停止数据库后台任务
+        """
+        logger.info("[ StrMsg ] 正在停止路由服务器与数据库服务...")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.routes.stop)
+        await loop.run_in_executor(None, self.services.stop)
+        logger.info("[ StrMsg ] 已停止\n")
 
-    async def on_message(self, websocket, message):
-        # logger.debug(f"[ StrMsg ] 收到消息：\n{message}")
-        
-        # 检查消息的 method 是否是 "get_latest_messages"
-        if message.get('method') == "get_latest_messages":
-            try:
-                # 从消息中提取 count 参数
-                messagecon = json.loads(message.get('message'))  # 默认为10条
-                count = messagecon.get('count')
-                count = int(count)  # 将 count 转换为整数
-                
-                # 验证 count 是否为正整数
-                if count <= 0:
-                    raise ValueError("count 必须是一个正整数")
-                
-                # logger.debug(f"[ StrMsg > get_latest_messages ] 获取最新的 {count} 条消息")
-                
-                # 获取最新的消息
-                response = {"plugin": "StrMsg","message": await self.get_latest_messages_async(count)}
-                
-            except ValueError as ve:
-                logger.error(f"[ StrMsg ] 无效的 count 参数：{ve}")
-                response = {"error": "无效的 count 参数，必须是一个正整数"}
-            except Exception as e:
-                logger.error(f"[ StrMsg ] 获取最新消息时出错: {e}")
-                response = {"error": "获取消息失败，请稍后再试"}
+    @method("get_latest_messages", schema=LatestMessagesQuery)
+    async def on_get_latest_messages(self, websocket, message, query):
+        # count 为正整数已由 LatestMessagesQuery 校验，不符合时框架直接答复参数错误
+        try:
+            # 获取最新的消息
+            response = {"plugin": "StrMsg","message": await self.get_latest_messages_async(query.count, query.before_id)}
+        except Exception as e:
+            logger.error(f"[ StrMsg ] 获取最新消息时出错: {e}")
+            response = {"error": "获取消息失败，请稍后再试"}
 
-            # 发送消息
-            await websocket.send(json.dumps(response, ensure_ascii=False))
-            return
-        
-        # 处理不支持的操作
-        logger.warning(f"[ StrMsg ] 不支持的操作：{message.get('message')}")
-        response = {"message": f"不支持的操作：{message.get('message')}"}
-        await websocket.send(json.dumps(response, ensure_ascii=False))
-        pass
+        # 发送消息
+        await self.reply(websocket, message, response)
 
-    async def get_latest_messages_async(self, count):
+    async def get_latest_messages_async(self, count, before_id=None):
         """ 异步获取最新消息的方法 """
         # 假设 DBservice.get_latest_messages 是同步的，因此使用线程池执行
         loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, self.services.DBservice.get_latest_messages, count)
-        return response
\ No newline at end of file
+        response = await loop.run_in_executor(None, self.services.DBservice.get_latest_messages, count, before_id)
+        return response
+
+    @method("search", schema=SearchQuery)
+    async def on_search(self, websocket, message, query):
+        # 全文搜索消息，结果按相关度排序 (见 services/search.py)
+        try:
+            loop = asyncio.get_event_loop()
+            results = await loop.run_in_executor(None, self.services.DBservice.search_messages,
+                                                 query.query, query.limit, query.offset)
+            if results is None:
+                response = {"plugin": "StrMsg", "error": "消息搜索不可用"}
+            else:
+                response = {"plugin": "StrMsg", "message": results}
+        except Exception as e:
+            logger.error(f"[ StrMsg ] 搜索消息时出错: {e}")
+            response = {"error": "搜索消息失败，请稍后再试"}
+
+        await self.reply(websocket, message, response)
@@ -1 +1,32 @@
 # 这里可以定义你的数据库模型，利用 ORM 来管理数据
+
+# StrMsg 的消息结构，插件导入时编译一次校验器 (见 schema.py)
+from schema import Schema, Field
+
+
+class LatestMessagesQuery(Schema):
+    """ws 方法 get_latest_messages 的参数"""
+    count = Field(int, min=1)
+    before_id = Field(int, default=None)        # 翻页: 只返回 id 小于它的消息 (上一页最后一条消息的 id)
+
+
+class SearchQuery(Schema):
+    """ws 方法 search 的参数"""
+    query = Field(str, min_length=1, max_length=200)    # 以空白分隔的词须全部命中，以 * 结尾的词按前缀匹配
+    limit = Field(int, default=20, min=1, max=100)
+    offset = Field(int, default=0, min=0)               # 翻页: 跳过的结果数
+
+
+class WebhookBody(Schema):
+    """webhook 消息 (POST 的 JSON 请求体 / GET 的查询参数)"""
+    title = Field(str)                          # 消息标题，空字符串记为 "标题为空"
+    source = Field(str, min_length=1)           # 消息来源
+    message = Field(str, min_length=1)          # 消息内容
+    appname = Field(str, default=None)          # 应用名称
+    fixed = Field(int, default=0)
+    status = Field(str, default='pending')
+    message_type = Field(str, default='message')
+    priority = Field(int, default=1)
+    tags = Field((list, str), default=[])
+    user_id = Field(int, default=None)
+    is_active = Field(int, default=0)
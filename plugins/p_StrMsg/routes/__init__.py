@@ -1,16 +1,13 @@
 
 from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
-import threading
 from threading import Thread
-import sys
 import time
-import signal
-import asyncio
 import uvicorn
 from .webhook_routes import webhook_bp
-from ..services.data_service import DBservice
 from config.StrMsg import config
+from ratelimit import RateLimiter
+from ..utils.signature import SignatureVerifier
 
 import logging
 
@@ -20,13 +17,35 @@ logger = logging.getLogger(__name__)
 class Routes:
     def __init__(self, server):
         self.server = server
-        # 设置信号处理器
-        logger.debug("[ StrMsg / Routes ] 设置信号处理器...")
-        self._stop_event = threading.Event()  # 用于停止后台线程
-        signal.signal(signal.SIGINT, self.handle_sigint)
+        self.uvicorn_server = None  # uvicorn 服务实例，启动后赋值
+        self.server_thread = None
         logger.info("[ StrMsg / Routes ] 创建路由服务器实例...")
         # 创建 FastAPI 实例
         self.app = FastAPI()
+        # webhook 接收计数 (按请求方法与处理结果)，用于计算接收速率
+        webhooks = server.metrics.counter("sensus_strmsg_webhooks_total", "StrMsg 收到的 webhook 数量", ("method", "result"))
+        self.app.state.webhook_counters = {
+            (method, result): webhooks.labels(method, result)
+            for method in ("POST", "GET") for result in ("ok", "invalid", "unauthorized", "limited", "error")
+        }
+        # webhook 令牌桶限流，配置为 (每秒令牌数, 突发容量)，None 表示不限制:
+        # 按客户端 IP 在读取请求体之前检查，按消息来源 source 在写入数据库之前检查
+        self.app.state.rate_limiters = {
+            "ip": RateLimiter.from_config(getattr(config, 'RATE_LIMIT_IP', (20, 100))),
+            "source": RateLimiter.from_config(getattr(config, 'RATE_LIMIT_SOURCE', (10, 50))),
+        }
+        # webhook 签名校验，SECRET_KEY 仍为示例值 'your_secret_key' 时不启用
+        secret_key = getattr(config, 'SECRET_KEY', None)
+        if secret_key and secret_key != 'your_secret_key':
+            self.app.state.signature_verifier = SignatureVerifier(
+                secret_key,
+                tolerance=getattr(config, 'SIGNATURE_TOLERANCE', 300),
+                max_nonces=getattr(config, 'SIGNATURE_NONCE_CACHE', 100000),
+            )
+            logger.info("[ StrMsg / Routes ] 已启用 webhook 签名校验")
+        else:
+            self.app.state.signature_verifier = None
+            logger.warning("[ StrMsg / Routes ] 未设置 SECRET_KEY，webhook 签名校验未启用")
 
         # 配置 CORS ######### 测试用 ########## 测试用 ########## 测试用 ########## 测试用 ########## 测试用 ########## 测试用 ########## 测试用 ########## 测试用 ##########
         self.app.add_middleware(
@@ -41,31 +60,40 @@ class Routes:
         logger.info("[ StrMsg / Routes ] 开始注册路由...\n")
         self.register_routes()
 
-        # 异步启动 FastAPI 服务
-        self.start_async_server()        
-
-    # 自定义 Ctrl+C 处理函数
-    def handle_sigint(self, signal, frame):
-        logger.debug("[ StrMsg / Routes ] 正在关闭路由服务器...")
-        sys.exit(0)  # 优雅退出
-
+        # FastAPI 服务由插件在数据库服务就绪后通过 start_async_server() 启动
 
     def start_async_server(self):
         """ 使用 asyncio 在后台启动 FastAPI 服务器 """
-        server = Thread(target=self.run_server, daemon=True)  # daemon=True 确保主线程退出时，后台线程自动退出
-        server.start()
-
-    def run_server(self):
-        """ 启动 Uvicorn 服务 """
-        logger.info("[ StrMsg / Routes ] 启动路由服务...")
-        # 使用 uvicorn 启动 FastAPI 应用
-        uvicorn.run(
+        self.uvicorn_server = uvicorn.Server(uvicorn.Config(
             self.app, 
             host=config.HOST, 
             port=config.PORT, 
             log_level=config.LOG_LEVEL, 
             log_config=config.LOG_CONFIG,
-        )
+        ))
+        self.server_thread = Thread(target=self.run_server, daemon=True)  # daemon=True 确保主线程退出时，后台线程自动退出
+        self.server_thread.start()
+
+    def run_server(self):
+        """ 启动 Uvicorn 服务 """
+        logger.info("[ StrMsg / Routes ] 启动路由服务...")
+        # 非主线程中 uvicorn 不会注册信号处理器，停止由 stop() 控制
+        self.uvicorn_server.run()
+
+    def stop(self, timeout=5):
+        """
+        优雅地停止路由服务器：不再接收新请求，等待在途请求处理完毕 (最多 timeout 秒)
+        """
+        if self.uvicorn_server is None:
+            return
+        logger.info("[ StrMsg / Routes ] 正在关闭路由服务器...")
+        self.uvicorn_server.should_exit = True
+        self.server_thread.join(timeout)
+        if self.server_thread.is_alive():
+            # 超时后强制关闭剩余连接
+            self.uvicorn_server.force_exit = True
+            self.server_thread.join(1)
+        logger.info("[ StrMsg / Routes ] 路由服务器已关闭")
     
     def register_routes(self):
         """注册所有路由到 FastAPI 应用"""
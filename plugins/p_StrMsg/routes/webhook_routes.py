@@ -2,18 +2,26 @@ from fastapi import APIRouter, Request, HTTPException
 from typing import Optional
 from datetime import datetime, timedelta
 import time
-import json
-from colorama import init, Fore, Back, Style
+import math
+from colorama import init, Fore, Back
 import logging
+from log import get_hot_logger, color_tag
+from schema import SchemaError
+from ..models.models import WebhookBody
+from ..utils.signature import SignatureError, SIGNATURE_HEADER, TIMESTAMP_HEADER
 
-from ..services.data_service import DBservice
 # 配置这个插件的日志
 logger = logging.getLogger(__name__)
+# 每个 webhook 请求都会经过的日志使用带级别缓存的 logger
+hot = get_hot_logger(__name__)
+
+# 日志前缀在导入时拼接一次，避免每次请求重复拼接 colorama 转义序列
+POST_TAG = f"[ StrMsg / Routes > webhook | {color_tag('POST', Fore.CYAN)} ]"
+GET_TAG = f"[ StrMsg / Routes > webhook | {color_tag('GET', Fore.CYAN)} ]"
 
 webhook_bp = APIRouter()
 
-# 初始化数据库服务
-db_service = DBservice(app=None, server=None)
+# 数据库服务由 StrMsgPlugin 创建并挂载到 app.state.db_service，与 ws 查询共用同一实例
 
 icon_url = "http://klk.aethereiva.cn/image/app/Fluent/Fluent.png"
 
@@ -31,6 +39,42 @@ def iconUrlMatch(appname):
     else:
         return "http://klk.aethereiva.cn/image/app/Fluent/Fluent.png"
 
+OPTIONAL_FIELDS = ("fixed", "status", "message_type", "priority", "tags", "user_id", "is_active")
+
+def decode_body(data, method, request):
+    """按 WebhookBody 校验请求数据，不符合时计入 invalid 并返回 400，detail 为 {error, details}"""
+    try:
+        return WebhookBody.decode(data)
+    except SchemaError as e:
+        hot.warning("%s 请求数据无效: %s", POST_TAG if method == "POST" else GET_TAG, e)
+        request.app.state.webhook_counters[method, "invalid"].inc()
+        raise HTTPException(status_code=400, detail={"error": f"请求数据无效: {e}", "details": e.errors})
+
+def check_signature(request, method, payload):
+    """校验原始请求数据的签名 (未启用签名校验时跳过)，不通过时计入 unauthorized 并返回 401"""
+    verifier = request.app.state.signature_verifier
+    if verifier is None:
+        return
+    try:
+        verifier.verify(request.headers.get(SIGNATURE_HEADER), request.headers.get(TIMESTAMP_HEADER), payload)
+    except SignatureError as e:
+        hot.warning("%s 签名校验失败: %s", POST_TAG if method == "POST" else GET_TAG, e)
+        request.app.state.webhook_counters[method, "unauthorized"].inc()
+        raise HTTPException(status_code=401, detail=f"签名校验失败: {e}")
+
+def check_rate(request, method, scope, key):
+    """按 IP 或消息来源取一个令牌，令牌不足时计入 limited 并返回 429"""
+    limiter = request.app.state.rate_limiters[scope]
+    if limiter is None or limiter.allow(key):
+        return
+    hot.warning("%s %s %s 的请求过于频繁，已拒绝", POST_TAG if method == "POST" else GET_TAG, "IP" if scope == "ip" else "来源", key)
+    request.app.state.webhook_counters[method, "limited"].inc()
+    raise HTTPException(status_code=429, detail="请求过于频繁",
+                        headers={"Retry-After": str(math.ceil(limiter.retry_after(key)))})
+
+def optional_fields_of(body):
+    return {name: getattr(body, name) for name in OPTIONAL_FIELDS}
+
 # 定义处理 webhook 的消息 POST 路由
 @webhook_bp.post("/")
 async def handle_webhook(request: Request):
@@ -42,27 +86,24 @@ async def handle_webhook(request: Request):
         if forwarded_for:
             # X-Forwarded-For 可能包含多个 IP 地址，取第一个即为客户端 IP
             client_ip = forwarded_for.split(',')[0].strip()
-        logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 来自 IP : {client_ip} 的访问")
-
-        # 获取请求体的 JSON 数据
-        body = await request.json()
-
-        # 解析必填字段
-        title = body.get("title")       # 消息标题
-        if title == "" :
-            title = "标题为空"
-        source = body.get("source")     # 消息来源
-        message = body.get("message")   # 消息内容
-
-        if not title or not source or not message:
-            logger.warning(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 缺少必要字段")
-            raise HTTPException(status_code=400, detail="缺少必要字段")
+        hot.info("%s 来自 IP : %s 的访问", POST_TAG, client_ip)
+        check_rate(request, "POST", "ip", client_ip)  # 在读取与解析请求体之前
+
+        # 原始请求体一次完成 JSON 解析、字段校验与类型转换
+        raw_body = await request.body()
+        check_signature(request, "POST", raw_body)  # 对原始字节校验签名，通过后再解析
+        body = decode_body(raw_body, "POST", request)
+
+        title = body.title or "标题为空"  # 消息标题
+        source = body.source            # 消息来源
+        message = body.message          # 消息内容
+        check_rate(request, "POST", "source", source)
         
-        logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 收到来自 {source} 的 POST 消息")
-        logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 消息标题：{title}")
+        hot.info("%s 收到来自 %s 的 POST 消息", POST_TAG, source)
+        hot.info("%s 消息标题：%s", POST_TAG, title)
 
         current_time = datetime.now()
-        appname = body.get("appname")   # 应用名称
+        appname = body.appname          # 应用名称
         iconUrl = icon_url
         if (appname or appname != ""):
             iconUrl = iconUrlMatch(appname)
@@ -78,18 +119,10 @@ async def handle_webhook(request: Request):
             "receiving_time": current_time.strftime('%Y-%m-%d %H:%M:%S')  # 格式化为 TIMESTAMP 格式
         }
         # logger.debug(f"[ StrMsg / Routes > webhook | POST ] 消息内容: {data}")
-        logger.debug(f"[ StrMsg / Routes > webhook | {Fore.CYAN}POST{Style.RESET_ALL} ] 消息内容: {str(body)}")
+        hot.debug("%s 消息内容: %s", POST_TAG, body)  # str(body) 只会在真正输出时执行
 
-        # 获取可选字段
-        optional_fields = {
-            "fixed": body.get("fixed", 0),
-            "status": body.get("status", 'pending'),
-            "message_type": body.get("message_type", 'message'),
-            "priority": body.get("priority", 1),
-            "tags": body.get("tags", []),
-            "user_id": body.get("user_id"),
-            "is_active": body.get("is_active", 0),
-        }
+        # 获取可选字段 (未提供时为 WebhookBody 中声明的默认值)
+        optional_fields = optional_fields_of(body)
 
         # 计算三天后的过期时间
         three_days_later = current_time + timedelta(days=3)
@@ -98,7 +131,8 @@ async def handle_webhook(request: Request):
 
         # 在这里处理接收到的数据
         # 存储消息到数据库
-        db_service.store_message(source, data, optional_fields)
+        request.app.state.db_service.store_message(source, data, optional_fields)
+        request.app.state.webhook_counters["POST", "ok"].inc()
 
         # 一个简单的示例，将所有字段一起返回
         return {
@@ -112,9 +146,10 @@ async def handle_webhook(request: Request):
             }
         }
 
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid JSON format")
+    except HTTPException:
+        raise
     except Exception as e:
+        request.app.state.webhook_counters["POST", "error"].inc()
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
@@ -129,26 +164,25 @@ async def handle_webhook(request: Request):
         if forwarded_for:
             # X-Forwarded-For 可能包含多个 IP 地址，取第一个即为客户端 IP
             client_ip = forwarded_for.split(',')[0].strip()
-        logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}GET{Style.RESET_ALL} ] 来自 IP : {client_ip} 的访问")
-
-        # 获取查询参数
-        title = request.query_params.get("title")       # 消息标题
-        if title == "" :
-            title = "标题为空"
-        source = request.query_params.get("source")     # 消息来源
-        message = request.query_params.get("message")   # 消息内容
-
-        # 检查必填字段是否存在
-        if not title or not source or not message:
-            logger.warning(f"[ StrMsg / Routes > webhook | {Fore.CYAN}GET{Style.RESET_ALL} ] 缺少必要字段")
-            raise HTTPException(status_code=400, detail="缺少必要字段")
+        hot.info("%s 来自 IP : %s 的访问", GET_TAG, client_ip)
+        check_rate(request, "GET", "ip", client_ip)
+
+        # 查询参数按与 POST 相同的结构校验并转换类型
+        check_signature(request, "GET", request.scope["query_string"])  # 对原始查询字符串校验签名
+        body = decode_body(dict(request.query_params), "GET", request)
+
+        title = body.title or "标题为空"  # 消息标题
+        source = body.source            # 消息来源
+        message = body.message          # 消息内容
+        check_rate(request, "GET", "source", source)
         
-        logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}GET{Style.RESET_ALL} ] 收到来自 {source} 的 GET 消息")
-        logger.info(f"[ StrMsg / Routes > webhook | {Fore.CYAN}GET{Style.RESET_ALL} ] 消息标题：{title}")
-        logger.debug(f"[ StrMsg / Routes > webhook | {Fore.CYAN}GET{Style.RESET_ALL} ] 消息内容: {message}")
+        hot.info("%s 收到来自 %s 的 GET 消息", GET_TAG, source)
+        hot.info("%s 消息标题：%s", GET_TAG, title)
+        hot.debug("%s 消息内容: %s", GET_TAG, message)
 
         current_time = datetime.now()
-        appname = request.query_params.get("appname")   # 应用名称
+        appname = body.appname          # 应用名称
+        iconUrl = icon_url
         if (appname or appname != ""):
             iconUrl = iconUrlMatch(appname)
 
@@ -165,15 +199,7 @@ async def handle_webhook(request: Request):
         }
 
         # 获取可选字段
-        optional_fields = {
-            "fixed": request.query_params.get("fixed", 0),
-            "status": request.query_params.get("status", 'pending'),
-            "message_type": request.query_params.get("message_type", 'message'),
-            "priority": request.query_params.get("priority", 1),
-            "tags": request.query_params.get("tags", []),
-            "user_id": request.query_params.get("user_id"),
-            "is_active": request.query_params.get("is_active", 0),
-        }
+        optional_fields = optional_fields_of(body)
 
         # 计算三天后的过期时间
         three_days_later = current_time + timedelta(days=3)
@@ -182,7 +208,8 @@ async def handle_webhook(request: Request):
 
         # 在这里处理接收到的数据
         # 存储消息到数据库
-        db_service.store_message(source, data, optional_fields)
+        request.app.state.db_service.store_message(source, data, optional_fields)
+        request.app.state.webhook_counters["GET", "ok"].inc()
 
         # 返回响应结果
         return {
@@ -196,5 +223,8 @@ async def handle_webhook(request: Request):
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
+        request.app.state.webhook_counters["GET", "error"].inc()
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
@@ -18,3 +18,7 @@ class Services:
     def process_webhook_message(self, source, data):
         # 这里可以添加更多的逻辑，比如消息的转发、过滤、格式化等
         self.DBservice.store_message(source, data)
+
+    def stop(self):
+        """停止数据库服务的后台任务"""
+        self.DBservice.stop()
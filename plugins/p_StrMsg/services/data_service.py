@@ -3,23 +3,80 @@ import threading
 import traceback
 import time
 import json
-from datetime import datetime, timedelta
-import schedule
+import functools
+from datetime import date, datetime, timedelta
 import logging
 from config.StrMsg import config
+from .dedup import RecentHashes, content_hash
+from .partitions import (LEGACY_TABLE, PARTITION_PREFIX, MESSAGE_COLUMNS, partition_name, first_id,
+                         table_for_id, id_range, compress_data, decode_data)
+from .search import FTS_TABLE, FTS_COLUMNS, create_index, document, match_expression
 
 logger = logging.getLogger(__name__)
 
+# store_message 写入的可选列 (optional_fields 的键会拼进 SQL，只接受这些列名)
+OPTIONAL_COLUMNS = ("fixed", "status", "message_type", "priority", "tags", "user_id", "is_active", "expires_at")
+
+# get_latest_messages 返回的列
+MESSAGE_FIELDS = ("id", "source", "data", "fixed", "created_at", "status", "message_type", "processed_at",
+                  "error_message", "priority", "retried", "tags", "expires_at", "user_id", "is_active", "duplicates")
+
+INDEX_MESSAGE = f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) VALUES (?, ?, ?, ?, ?)"
+MAX_ROWID = 2 ** 63 - 1  # SQLite 整数的上限
+
 def datetime_converter(o):
     """将 datetime 对象转换为字符串"""
     if isinstance(o, datetime):
         return o.isoformat()
 
+def format_message(row):
+    """一行查询结果 (MESSAGE_FIELDS) -> 消息字典"""
+    message = dict(zip(MESSAGE_FIELDS, row))
+    message["data"] = decode_data(message["data"])  # JSON 字符串 (或压缩数据) 转换为字典
+    message["duplicates"] = message["duplicates"] or 0
+    return message
+
+def timed(op):
+    """记录数据库操作耗时到 sensus_strmsg_db_seconds{op=...}"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.db_timings[op].observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
 class DBservice:
     def __init__(self, app, server):
         self.server = server
         self.app = app
         self.schDay = config.SCHDAY
+        self._stop_event = threading.Event()  # 用于停止后台线程
+        self.schedule_thread = None
+        # 增量清理: 每 PURGE_INTERVAL 秒按 expires_at 索引分批删除过期消息，每批 PURGE_BATCH_SIZE 行，批次之间暂停 PURGE_PAUSE 秒
+        self.purge_interval = getattr(config, 'PURGE_INTERVAL', 60)
+        self.purge_batch_size = getattr(config, 'PURGE_BATCH_SIZE', 500)
+        self.purge_pause = getattr(config, 'PURGE_PAUSE', 0.05)
+        self.purge_vacuum_pages = getattr(config, 'PURGE_VACUUM_PAGES', 2000)  # 每轮最多归还给文件系统的空闲页数
+        # 数据库操作耗时，按操作类型预先取好子指标
+        db_seconds = server.metrics.histogram("sensus_strmsg_db_seconds", "StrMsg 数据库操作耗时", ("op",))
+        self.db_timings = {op: db_seconds.labels(op) for op in ("store", "purge", "compact", "index", "latest", "search")}
+        # 入库去重: DEDUP_WINDOW 秒内重复推送的相同消息合并到已有的行 (计入 duplicates)，为 0 时不去重
+        self.dedup_window = getattr(config, 'DEDUP_WINDOW', 30)
+        self.recent = RecentHashes(self.dedup_window, getattr(config, 'DEDUP_MAX_ENTRIES', 10000)) if self.dedup_window else None
+        self.duplicates = server.metrics.counter("sensus_strmsg_duplicates_total", "StrMsg 合并的重复消息数")
+        self.purged = server.metrics.counter("sensus_strmsg_purged_total", "StrMsg 清理的过期消息数")
+        # 按天分区 (见 partitions.py): 超过 COMPACT_AFTER_DAYS 天的分区在清理线程中压缩 data 列，为 0 时不压缩
+        self.compact_after_days = getattr(config, 'COMPACT_AFTER_DAYS', 1)
+        self._current = None            # (日期, 当天分区的表名)
+        self._partitions = (None, [])   # (schema_version, 从旧到新的表名)
+        # 全文搜索 (见 search.py)，SEARCH_INDEX 为 False 或 SQLite 不支持 FTS5 时不可用:
+        # search_index 为 True 时新消息写入索引；已有消息的索引由清理线程在后台补建，补建完成后 search_enabled 才为 True
+        self.search_index = False
+        self.search_enabled = False
         logger.info("[ StrMsg / Services / DBservice ] 初始化消息数据库...")
         self.init_db()
 
@@ -67,75 +124,260 @@ class DBservice:
                 user_id INTEGER,
                 is_active BOOLEAN DEFAULT 0
             );''')
+            self.migrate_dedup_columns(db)
+            # 清理按 expires_at 查找过期消息
+            db.execute("CREATE INDEX IF NOT EXISTS idx_webhook_messages_expires_at ON webhook_messages (expires_at)")
+            # 按天分区的登记表，记录分区是否已压缩
+            db.execute('''CREATE TABLE IF NOT EXISTS webhook_partitions (
+                name TEXT PRIMARY KEY,      -- 分区表名
+                compacted_at TIMESTAMP      -- 压缩完成的时间，未压缩为 NULL
+            );''')
             db.commit()
+            self.current_partition(db)
+            if getattr(config, 'SEARCH_INDEX', True):
+                self.init_search_index(db)
+            self.warm_recent(db)
 
-            # 启动定时任务删除超过三天的消息
-            threading.Thread(target=self.schedule_delete_old_messages, daemon=True).start()
+            # 启动后台线程增量清理过期消息 (多 worker 模式下只由 worker 0 执行)
+            if getattr(self.server, "is_primary", True):
+                self.schedule_thread = threading.Thread(target=self.schedule_delete_old_messages, daemon=True)
+                self.schedule_thread.start()
 
         except Exception as e:
             # 捕获并记录完整的错误堆栈信息
             error_trace = traceback.format_exc()
             logger.error(f"[ StrMsg / Services / DBservice ] 初始化消息数据库时出错: {e}\n详细错误信息: {error_trace}")
 
+    def migrate_dedup_columns(self, db):
+        """为旧数据库补上去重用的列与索引"""
+        columns = {row[1] for row in db.execute("PRAGMA table_info(webhook_messages)")}
+        for column, definition in (
+            ("content_hash", "TEXT"),                   # 消息内容摘要
+            ("duplicates", "INTEGER DEFAULT 0"),        # 合并到本行的重复消息数
+            ("last_seen_at", "TIMESTAMP"),              # 最近一次收到重复消息的时间
+        ):
+            if column not in columns:
+                db.execute(f"ALTER TABLE webhook_messages ADD COLUMN {column} {definition}")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_webhook_messages_content_hash ON webhook_messages (content_hash)")
+
+    def init_search_index(self, db):
+        """创建全文索引，之后写入的消息即建立索引；已有的消息由清理线程补建 (见 backfill_search_index)"""
+        if db.in_transaction:
+            db.commit()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone():
+                create_index(db)
+                logger.info("[ StrMsg / Services / DBservice ] 已创建全文索引，已有消息的索引在后台补建，完成之前消息搜索不可用")
+            db.commit()
+        except sqlite3.OperationalError as e:
+            db.rollback()
+            logger.warning(f"[ StrMsg / Services / DBservice ] 创建全文索引失败 (SQLite 可能未启用 FTS5)，消息搜索不可用: {e}")
+            return
+        self.search_index = True
+
+    @staticmethod
+    def unindexed_below(db):
+        """
+        id 小于返回值的消息尚未建立索引
+
+        新消息写入时即建立索引，补建从新到旧进行，因此索引中最小的 id 及以上的消息都已建立索引；索引为空时全部消息都未建立
+        """
+        row = db.execute(f"SELECT rowid FROM {FTS_TABLE} ORDER BY rowid LIMIT 1").fetchone()
+        return row[0] if row else MAX_ROWID
+
+    def backfill_pending(self, db):
+        """是否还有未建立索引的已有消息"""
+        below = self.unindexed_below(db)
+        return any(db.execute(f"SELECT 1 FROM {table} WHERE id < ? LIMIT 1", (below,)).fetchone()
+                   for table in self.partitions(db))
+
+    def backfill_search_index(self):
+        """
+        为创建索引之前的已有消息补建索引，完成后开放搜索
+
+        从新到旧按 id 分批进行，每批 purge_batch_size 条单独提交，批次之间暂停 purge_pause 秒，webhook 写入不会被长时间阻塞；
+        中途停止时下次启动从索引中最小的 id 继续
+        """
+        if not self.search_index:
+            return
+        start = time.perf_counter()
+        indexed = 0
+        try:
+            with self.get_db() as db:
+                below = self.unindexed_below(db)
+                for table in reversed(self.partitions(db)):
+                    while not self._stop_event.is_set():
+                        batch = self.index_batch(db, table, below)
+                        if not batch:
+                            break
+                        below = batch[-1][0]
+                        indexed += len(batch)
+                        self._stop_event.wait(self.purge_pause)
+                    else:
+                        return  # 正在停止，索引未补建完
+        except Exception as e:
+            error_trace = traceback.format_exc()
+            logger.error(f"[ StrMsg / Services / DBservice < {FTS_TABLE} ] 补建全文索引时出错: {e}")
+            logger.debug(f"详细错误信息: {error_trace}")
+            return
+        self.search_enabled = True
+        if indexed:
+            logger.info(f"[ StrMsg / Services / DBservice < {FTS_TABLE} ] 已为 {indexed} 条已有消息补建索引，"
+                        f"用时 {time.perf_counter() - start:.2f} 秒，消息搜索可用")
+
+    @timed("index")
+    def index_batch(self, db, table, below):
+        """为 id 小于 below 的一批消息建立索引并提交，返回 [(id, ...)]，从新到旧排列"""
+        rows = db.execute(f"SELECT id, source, data FROM {table} WHERE id < ? ORDER BY id DESC LIMIT ?",
+                          (below, self.purge_batch_size)).fetchall()
+        db.executemany(INDEX_MESSAGE, self.documents(rows))
+        db.commit()
+        return rows
+
+    @staticmethod
+    def documents(rows):
+        """(id, source, data) -> 索引表的一行；data 无法解析的旧消息只索引来源"""
+        for row_id, source, value in rows:
+            try:
+                data = decode_data(value)
+            except ValueError:
+                data = {}
+            yield (row_id, *document(source, data if isinstance(data, dict) else {}))
+
+    def enable_incremental_vacuum(self):
+        """
+        把数据库切换为 auto_vacuum = INCREMENTAL，之后删除消息空出的页可以由 PRAGMA incremental_vacuum 分批归还
+
+        已有数据库需要执行一次 VACUUM 才能切换，只在第一次启动时发生；由清理线程在第一轮清理之前调用，不阻塞插件启动
+        """
+        try:
+            with self.get_db() as db:
+                if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                    return
+                start = time.perf_counter()
+                db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                db.execute("VACUUM")
+                logger.info(f"[ StrMsg / Services / DBservice ] 已切换为增量 vacuum，用时 {time.perf_counter() - start:.2f} 秒")
+        except Exception as e:
+            error_trace = traceback.format_exc()
+            logger.error(f"[ StrMsg / Services / DBservice ] 切换增量 vacuum 时出错: {e}")
+            logger.debug(f"详细错误信息: {error_trace}")
+
+    def warm_recent(self, db):
+        """从数据库载入去重窗口内的摘要，重启后立即收到的重复消息也能被合并"""
+        if self.recent is None:
+            return
+        now = self.recent.clock()
+        rows = []
+        # 去重窗口只有几十秒，最多跨越最新的两个分区 (跨过零点时)
+        for table in self.partitions(db)[-2:]:
+            rows += db.execute(f'''SELECT content_hash, id,
+                                          strftime('%s', 'now') - strftime('%s', COALESCE(last_seen_at, created_at)) AS age
+                                   FROM {table}
+                                   WHERE content_hash IS NOT NULL AND COALESCE(last_seen_at, created_at) >= datetime('now', ?)''',
+                               (f"-{int(self.dedup_window)} seconds",)).fetchall()
+        for digest, row_id, age in sorted(rows, key=lambda row: -row[2]):
+            self.recent.add(digest, row_id, now - age)
+
     def get_db(self):
         """连接到数据库"""
         # 使用 SQLite 连接数据库
         conn = sqlite3.connect(config.DATABASE_URI)
         return conn
 
+    def partitions(self, conn):
+        """
+        全部消息表，从旧到新: 旧表 webhook_messages 在最前，之后是按日期排列的分区
+
+        表名列表缓存到数据库结构变化 (schema_version 改变) 为止，其他 worker 新建或删除分区后也会重新读取
+        """
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        cached_version, tables = self._partitions
+        if version != cached_version:
+            names = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                                 (PARTITION_PREFIX + "%",)).fetchall()
+            tables = [LEGACY_TABLE] + sorted(name for (name,) in names if name[len(PARTITION_PREFIX):].isdigit())
+            self._partitions = (version, tables)
+        return tables
 
+    def current_partition(self, conn):
+        """当天的分区表名，不存在时创建"""
+        today = date.today()
+        current = self._current
+        if current is not None and current[0] == today:
+            return current[1]
+        name = partition_name(today)
+        if conn.in_transaction:
+            conn.commit()
+        # 多个 worker 可能同时创建同一天的分区: 在写事务中建表并设定自增起点，只有第一个生效
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({MESSAGE_COLUMNS})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_content_hash ON {name} (content_hash)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_expires_at ON {name} (expires_at)")
+            conn.execute('''INSERT INTO sqlite_sequence (name, seq)
+                            SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)''',
+                         (name, first_id(today) - 1, name))
+            conn.execute("INSERT OR IGNORE INTO webhook_partitions (name) VALUES (?)", (name,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._current = (today, name)
+        return name
+
+
+    @timed("store")
     def store_message(self, source, data, optional_fields):
-        """将 Webhook 消息存储到数据库"""
+        """将 Webhook 消息存储到当天的分区"""
         try:
-            # 使用自定义的 datetime_converter 函数来处理 datetime 类型
-            data_json = json.dumps(data, default=datetime_converter)
-            # 插入必填数据
+            digest = content_hash(source, data)
+            duplicate_of = self.recent.hit(digest) if self.recent is not None else None
             with self.get_db() as conn:
-                logger.debug("[ StrMsg / Services / DBservice > webhook_messages ] 添加消息到数据库...")
-                cursor = conn.cursor()  # 使用游标对象
-                cursor.execute('INSERT INTO webhook_messages (source, data) VALUES (?, ?)', (source, data_json))
-                conn.commit()
+                if duplicate_of is not None:
+                    # 窗口内的重复消息只给已有的行计数
+                    table = table_for_id(duplicate_of)
+                    if table in self.partitions(conn):
+                        cursor = conn.execute(f'''UPDATE {table} SET duplicates = duplicates + 1, last_seen_at = CURRENT_TIMESTAMP
+                                                  WHERE id = ?''', (duplicate_of,))
+                        if cursor.rowcount:
+                            self.duplicates.inc()
+                            logger.debug(f"[ StrMsg / Services / DBservice > {table} ] 重复消息，已合并到消息 {duplicate_of}")
+                            return
+                    # 原消息已被清理，按新消息存储
 
-                # 获取插入后的消息 ID
-                last_row_id = cursor.lastrowid
+                # 可选字段与必填数据一起插入 (列表类型转换为 JSON 字符串)
+                fields = {}
+                for key, value in optional_fields.items():
+                    if value is not None and key in OPTIONAL_COLUMNS:
+                        fields[key] = json.dumps(value) if isinstance(value, list) else value
+                # 使用自定义的 datetime_converter 函数来处理 datetime 类型
+                data_json = json.dumps(data, default=datetime_converter)
+                columns = ", ".join(("source", "data", *fields))
+                placeholders = ", ".join("?" * (len(fields) + 2))
 
-                # 检查插入是否成功
+                table = self.current_partition(conn)
+                logger.debug(f"[ StrMsg / Services / DBservice > {table} ] 添加消息到数据库...")
+                cursor = conn.execute(f"INSERT INTO {table} ({columns}, content_hash) VALUES ({placeholders}, ?)",
+                                      (source, data_json, *fields.values(), digest))
+                last_row_id = cursor.lastrowid
                 if last_row_id is None:
-                    logger.error("[ StrMsg / Services / DBservice > webhook_messages ] 插入消息失败，没有生成新记录的ID")
+                    logger.error(f"[ StrMsg / Services / DBservice > {table} ] 插入消息失败，没有生成新记录的ID")
                     return False  # 插入失败
-
-                # 更新可选字段
-                update_fields = []
-                for key, value in optional_fields.items():
-                    if value is not None:
-                        # 如果字段是列表类型，转换为 JSON 字符串
-                        if isinstance(value, list):
-                            value = json.dumps(value)
-                        update_fields.append((key, value, last_row_id))
-                
-                # 更新可选字段
-                for field, value, message_id in update_fields:
-                    cursor.execute(f'UPDATE webhook_messages SET {field} = ? WHERE id = ?', (value, message_id))
-                conn.commit()
-
-                # 检查是否成功更新字段
-                if cursor.rowcount == 0:
-                    logger.error("[ StrMsg / Services / DBservice > webhook_messages ] 更新可选字段失败，未修改任何记录")
-                    return False  # 更新失败
+                if last_row_id >= id_range(table)[1]:
+                    logger.error(f"[ StrMsg / Services / DBservice > {table} ] 分区消息数超出上限，消息 id {last_row_id} 已进入下一天的范围")
+                if self.search_index:
+                    conn.execute(INDEX_MESSAGE, (last_row_id, *document(source, data)))
 
                 # 如果消息是固定的，则插入到永久存储表
-                if optional_fields.get('fixed', 0) == 1:
+                if fields.get('fixed', 0) == 1:
                     logger.debug("[ StrMsg / Services / DBservice > permanent_webhook_messages ] 添加消息到永久数据表...")
-                    cursor.execute('INSERT INTO permanent_webhook_messages (source, data) VALUES (?, ?)', (source, json.dumps(data)))
-                    # 更新可选字段
-                    for field, value, message_id in update_fields:
-                        cursor.execute(f'UPDATE permanent_webhook_messages SET {field} = ? WHERE id = ?', (value, message_id))
-                    conn.commit()
+                    conn.execute(f"INSERT INTO permanent_webhook_messages ({columns}) VALUES ({placeholders})",
+                                 (source, data_json, *fields.values()))
 
-                    # 检查永久存储表更新是否成功
-                    if cursor.rowcount == 0:
-                        logger.error("[ StrMsg / Services / DBservice > permanent_webhook_messages ] 永久消息更新失败，未修改任何记录")
-                        return False  # 更新失败
+            if self.recent is not None:
+                self.recent.add(digest, last_row_id)
 
         except Exception as e:
             error_trace = traceback.format_exc()
@@ -143,71 +385,231 @@ class DBservice:
             logger.debug(f"详细错误信息: {error_trace}")  # 只在调试时打印
 
     def schedule_delete_old_messages(self):
-        """定时删除超过指定日期的消息"""
-        # 每天运行一次，删除超过指定天的消息
-        schedule.every().day.at("04:00").do(self.delete_old_messages)
-        while True:
-            schedule.run_pending()
-            time.sleep(60)
+        """先完成一次性的维护 (切换增量 vacuum、补建全文索引)，之后每隔 purge_interval 秒增量清理一次过期消息"""
+        self.enable_incremental_vacuum()
+        self.backfill_search_index()
+        while not self._stop_event.wait(self.purge_interval):
+            self.delete_old_messages()
+
+    def stop(self, timeout=5):
+        """停止定时任务线程"""
+        self._stop_event.set()
+        if self.schedule_thread is not None:
+            self.schedule_thread.join(timeout)
 
     def delete_old_messages(self):
-        """删除超过指定日期的消息"""
+        """
+        清理过期消息，返回 (删除行数, 用时秒数)
+
+        过期条件: expires_at 早于当前时间 (expires_at 由 webhook 路由按本地时间写入)；
+        没有 expires_at 的旧数据按 created_at (UTC) 超过 SCHDAY 天处理。
+        除当天以外，全部消息都已过期的分区整表删除；其余的表经 expires_at 索引分批删除，
+        每批只删除 purge_batch_size 行并单独提交，批次之间让出写锁，webhook 写入不会被长时间阻塞。
+        清理之后压缩较旧的分区
+        """
+        start = time.perf_counter()
+        purged = 0
+        dropped = 0
+        pages = 0
         try:
             with self.get_db() as db:
-                # 删除超过三天的消息
-                cutoff_date = (datetime.now() - timedelta(days=self.schDay)).strftime('%Y-%m-%d %H:%M:%S')
-                db.execute('DELETE FROM webhook_messages WHERE created_at < ?', (cutoff_date,))
-                db.commit()
-                logger.info(f"[ StrMsg / Services / DBservice - webhook_messages ] 已清理超过 {self.schDay} 天的消息")
+                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                conditions = (
+                    ("expires_at < ?", (now,)),
+                    ("expires_at IS NULL AND created_at < datetime('now', ?)", (f"-{int(self.schDay)} days",)),
+                )
+                today = partition_name(date.today())
+                for table in self.partitions(db):
+                    if self._stop_event.is_set():
+                        break
+                    if table not in (LEGACY_TABLE, today) and not self.has_live_messages(db, table, conditions):
+                        purged += self.drop_partition(db, table)
+                        dropped += 1
+                        continue
+                    for condition, params in conditions:
+                        while not self._stop_event.is_set():
+                            deleted = self.delete_batch(db, table, condition, params)
+                            purged += deleted
+                            if deleted < self.purge_batch_size:
+                                break
+                            self._stop_event.wait(self.purge_pause)
+                pages = db.execute("PRAGMA freelist_count").fetchone()[0]
+                if pages:
+                    # execute() 只执行一步 (归还一页)，executescript() 才会把该语句执行完
+                    db.executescript(f"PRAGMA incremental_vacuum({int(self.purge_vacuum_pages)});")
+                if self.compact_after_days:
+                    self.compact_partitions(db)
         except Exception as e:
             error_trace = traceback.format_exc()
-            logger.error(f"[ StrMsg / Services / DBservice - webhook_messages ] 删除超过 {self.schDay} 天的消息时出错: {e}")
+            logger.error(f"[ StrMsg / Services / DBservice - webhook_messages ] 清理过期消息时出错: {e}")
             logger.debug(f"详细错误信息: {error_trace}")
+            return purged, time.perf_counter() - start
+
+        elapsed = time.perf_counter() - start
+        if purged:
+            self.purged.inc(purged)
+            logger.info(f"[ StrMsg / Services / DBservice - webhook_messages ] 已清理 {purged} 条过期消息 (删除 {dropped} 个分区)，"
+                        f"用时 {elapsed * 1000:.1f} ms，回收 {min(pages, self.purge_vacuum_pages)} 个空闲页")
+        return purged, elapsed
+
+    def has_live_messages(self, db, table, conditions):
+        """分区中是否还有未过期的消息 (两个查询都走 expires_at 索引)"""
+        (_, expired_params), (_, legacy_params) = conditions
+        if db.execute(f"SELECT 1 FROM {table} WHERE expires_at >= ? LIMIT 1", expired_params).fetchone():
+            return True
+        return db.execute(f"SELECT 1 FROM {table} WHERE expires_at IS NULL AND created_at >= datetime('now', ?) LIMIT 1",
+                          legacy_params).fetchone() is not None
+
+    @timed("purge")
+    def drop_partition(self, db, table):
+        """删除整个分区，返回其中的行数 (正在停止、分区未删除时返回 0)"""
+        count = db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if self.search_index:
+            # 先按 id 范围分批删除索引，中途停止时分区仍在，下一轮重新删除
+            low, high = id_range(table)
+            while True:
+                cursor = db.execute(f'''DELETE FROM {FTS_TABLE} WHERE rowid IN (
+                                          SELECT rowid FROM {FTS_TABLE} WHERE rowid >= ? AND rowid < ? LIMIT ?
+                                      )''', (low, high, self.purge_batch_size))
+                db.commit()
+                if cursor.rowcount < self.purge_batch_size:
+                    break
+                if self._stop_event.wait(self.purge_pause):
+                    return 0
+        db.execute(f"DROP TABLE {table}")
+        db.execute("DELETE FROM webhook_partitions WHERE name = ?", (table,))
+        db.commit()
+        logger.info(f"[ StrMsg / Services / DBservice - {table} ] 分区内的消息已全部过期，删除分区 ({count} 条消息)")
+        return count
+
+    @timed("purge")
+    def delete_batch(self, db, table, condition, params):
+        """删除一批满足条件的消息 (及其索引) 并提交，返回删除的行数"""
+        deleted = db.execute(f'''DELETE FROM {table} WHERE id IN (
+                                    SELECT id FROM {table} WHERE {condition} LIMIT ?
+                                ) RETURNING id''', (*params, self.purge_batch_size)).fetchall()
+        if self.search_index and deleted:
+            db.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = ?", deleted)
+        db.commit()
+        return len(deleted)
 
-    def get_latest_messages(self, count=10):
-        """查询最新的指定数量条消息内容"""
+    def compact_partitions(self, db):
+        """
+        把超过 compact_after_days 天的分区的 data 列压缩为 zlib 数据 (见 partitions.py)
+
+        这些分区已不再写入，按 id 分批压缩并单独提交，批次之间暂停 purge_pause 秒；中途停止时下一轮从未压缩的行继续
+        """
+        cutoff = partition_name(date.today() - timedelta(days=self.compact_after_days))
+        compacted = {name for (name,) in db.execute("SELECT name FROM webhook_partitions WHERE compacted_at IS NOT NULL")}
+        for table in self.partitions(db)[1:]:
+            if table > cutoff or table in compacted:
+                continue
+            after_id = id_range(table)[0]
+            before = after = rows = 0
+            while not self._stop_event.is_set():
+                batch = self.compact_batch(db, table, after_id)
+                if not batch:
+                    break
+                after_id = batch[-1][0]
+                rows += len(batch)
+                before += sum(size for _, size, _ in batch)
+                after += sum(len(value) for _, _, value in batch)
+                self._stop_event.wait(self.purge_pause)
+            else:
+                return  # 正在停止，分区未压缩完
+            db.execute("INSERT OR REPLACE INTO webhook_partitions (name, compacted_at) VALUES (?, CURRENT_TIMESTAMP)", (table,))
+            db.commit()
+            logger.info(f"[ StrMsg / Services / DBservice - {table} ] 分区已压缩: {rows} 条消息，"
+                        f"{before / 1024:.1f} KB -> {after / 1024:.1f} KB")
+
+    @timed("compact")
+    def compact_batch(self, db, table, after_id):
+        """压缩 id 大于 after_id 的一批未压缩消息并提交，返回 [(id, 原大小, 压缩后的数据)]"""
+        rows = db.execute(f"SELECT id, data FROM {table} WHERE id > ? AND typeof(data) = 'text' ORDER BY id LIMIT ?",
+                          (after_id, self.purge_batch_size)).fetchall()
+        batch = [(row_id, len(text.encode("utf-8")), compress_data(text)) for row_id, text in rows]
+        db.executemany(f"UPDATE {table} SET data = ? WHERE id = ?", [(value, row_id) for row_id, _, value in batch])
+        db.commit()
+        return batch
+
+    @timed("latest")
+    def get_latest_messages(self, count=10, before_id=None):
+        """
+        查询最新的指定数量条消息内容，按 id (即接收顺序) 倒序
+
+        从最新的分区开始依次向前查询，取够 count 条即停止，最近的消息通常只涉及当天的分区。
+        给出 before_id 时只返回 id 小于它的消息: 以上一页最后一条消息的 id 作为 before_id 即可翻页
+        """
         try:
+            latest_messages = []
             with self.get_db() as conn:
-                cursor = conn.cursor()
-                
-                # 查询最新的指定数量条消息
-                # 查询所有字段，按时间倒序排列，限制返回数量
-                cursor.execute('''SELECT id, source, data, fixed, created_at, status, message_type, processed_at, 
-                                  error_message, priority, retried, tags, expires_at, user_id, is_active
-                                  FROM webhook_messages
-                                  ORDER BY created_at DESC LIMIT ?''', (count,))
-                messages = cursor.fetchall()
-
-                if not messages:
-                    # logger.debug(f"[ StrMsg / Services / DBservice < get_latest_messages < webhook_messages ] 没有找到最新的 {count} 条消息")
-                    return []
-
-                # 格式化消息数据，返回
-                latest_messages = []
-                for msg in messages:
-                    message_data = {
-                        "id": msg[0],
-                        "source": msg[1],
-                        "data": json.loads(msg[2]),  # 将 JSON 字符串转换为字典
-                        "fixed": msg[3],
-                        "created_at": msg[4],
-                        "status": msg[5],
-                        "message_type": msg[6],
-                        "processed_at": msg[7],
-                        "error_message": msg[8],
-                        "priority": msg[9],
-                        "retried": msg[10],
-                        "tags": msg[11],
-                        "expires_at": msg[12],
-                        "user_id": msg[13],
-                        "is_active": msg[14]
-                    }
-                    latest_messages.append(message_data)
-
-                return latest_messages
+                for table in reversed(self.partitions(conn)):
+                    low, high = id_range(table)
+                    if before_id is not None:
+                        if low >= before_id:
+                            continue
+                        high = min(high, before_id)
+                    # 查询所有字段，按 id 倒序排列，限制返回数量
+                    rows = conn.execute(f'''SELECT {", ".join(MESSAGE_FIELDS)} FROM {table}
+                                            WHERE id < ? ORDER BY id DESC LIMIT ?''',
+                                        (high, count - len(latest_messages))).fetchall()
+                    latest_messages.extend(format_message(row) for row in rows)
+                    if len(latest_messages) >= count:
+                        break
+
+            return latest_messages
 
         except Exception as e:
             error_trace = traceback.format_exc()
             logger.error(f"[ StrMsg / Services / DBservice < webhook_messages ] 查询最新消息时出错: {e}")
             logger.debug(f"详细错误信息: {error_trace}")
-            return []
\ No newline at end of file
+            return []
+
+    @timed("search")
+    def search_messages(self, query, limit=20, offset=0):
+        """
+        全文搜索消息 (查询语法见 search.match_expression)，按相关度排序
+
+        返回与 get_latest_messages 格式相同的消息，另附 rank (bm25 得分，越小越相关)；
+        翻页时把 offset 增加 limit。全文索引不可用或尚未补建完成时返回 None
+        """
+        if not self.search_enabled:
+            # 补建由 worker 0 的清理线程进行，其他 worker 在这里确认补建已完成
+            if not self.search_index:
+                return None
+            with self.get_db() as conn:
+                if self.backfill_pending(conn):
+                    return None
+            self.search_enabled = True
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        try:
+            with self.get_db() as conn:
+                hits = conn.execute(f'''SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?
+                                        ORDER BY rank, rowid DESC LIMIT ? OFFSET ?''', (expression, limit, offset)).fetchall()
+                # 按 id 算出所在的分区，每个分区一次查询取回命中的消息
+                by_table = {}
+                for row_id, _ in hits:
+                    by_table.setdefault(table_for_id(row_id), []).append(row_id)
+                tables = self.partitions(conn)
+                rows = {}
+                for table, ids in by_table.items():
+                    if table in tables:
+                        for row in conn.execute(f'''SELECT {", ".join(MESSAGE_FIELDS)} FROM {table}
+                                                    WHERE id IN ({", ".join("?" * len(ids))})''', ids):
+                            rows[row[0]] = row
+
+            results = []
+            for row_id, rank in hits:
+                if row_id in rows:
+                    message = format_message(rows[row_id])
+                    message["rank"] = rank
+                    results.append(message)
+            return results
+
+        except Exception as e:
+            error_trace = traceback.format_exc()
+            logger.error(f"[ StrMsg / Services / DBservice < {FTS_TABLE} ] 搜索消息时出错: {e}")
+            logger.debug(f"详细错误信息: {error_trace}")
+            return []
@@ -0,0 +1,62 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 入库前的消息去重
+#
+# 手机经常在几秒内重复推送同一条通知。以 (来源, 标题, 内容, 应用名) 的摘要识别重复消息，
+# 最近 window 秒内出现过的摘要记录在按最近出现时间排列的 LRU 中，命中时只给已有的行计数，不再插入新行。
+# 每次命中都会刷新出现时间，持续重复推送的通知会一直合并到同一行。
+
+
+def content_hash(source, data):
+    """消息内容的摘要 (32 位十六进制)"""
+    content = data.get("content") or {}
+    key = json.dumps([source, data.get("title"), content.get("message"), content.get("appname")], ensure_ascii=False)
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class RecentHashes:
+    """
+    时间有界的 LRU: 摘要 -> [行 id, 最近出现时间]
+
+    超过 window 秒未再出现的摘要、以及超出 max_entries 的最久未出现的摘要从头部淘汰
+    """
+    def __init__(self, window, max_entries=10000, clock=time.monotonic):
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, digest):
+        """摘要在窗口内出现过时刷新出现时间并返回对应的行 id，否则返回 None"""
+        now = self.clock()
+        with self._lock:
+            self._evict(now)
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            entry[1] = now
+            self.entries.move_to_end(digest)
+            return entry[0]
+
+    def add(self, digest, row_id, seen_at=None):
+        now = self.clock() if seen_at is None else seen_at
+        with self._lock:
+            self.entries[digest] = [row_id, now]
+            self.entries.move_to_end(digest)
+            self._evict(self.clock())
+
+    def _evict(self, now):
+        entries = self.entries
+        while entries:
+            digest, entry = next(iter(entries.items()))
+            if now - entry[1] < self.window and len(entries) <= self.max_entries:
+                break
+            del entries[digest]
+
+    def __len__(self):
+        return len(self.entries)
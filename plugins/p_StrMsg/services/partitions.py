@@ -0,0 +1,96 @@
+import json
+import zlib
+from datetime import date
+
+# 按天分区的消息表
+#
+# 每天的消息写入各自的表 webhook_messages_pYYYYMMDD；建表时把 sqlite_sequence 中的自增起点设为 YYYYMMDD * 10^7，
+# 因此消息 id 全局唯一且按时间递增，由 id 即可算出所在的分区 (每个分区最多容纳 10^7 - 1 条消息)。
+# 分区之前的旧表 webhook_messages 视为最早的分区 (其 id 远小于任何分区的起点)。
+#
+# 过期清理整表删除分区；不再写入的旧分区把 data 列压缩为 zlib 数据 (BLOB)，读取时按类型自动解压。
+
+LEGACY_TABLE = "webhook_messages"
+PARTITION_PREFIX = "webhook_messages_p"
+ID_SPAN = 10 ** 7
+
+# 消息表的列 (旧表在此基础上通过迁移补齐)
+MESSAGE_COLUMNS = '''
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,   -- 消息来源
+    data TEXT NOT NULL,     -- 消息数据主体 (格式化成字符串的 json 对象，压缩后为 BLOB)
+    fixed INTEGER DEFAULT 0,    -- 消息是否标记为持久化
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT DEFAULT 'pending',
+    message_type TEXT,  -- 记录消息类型
+    processed_at TIMESTAMP,  -- 消息处理时间
+    error_message TEXT,  -- 错误信息（如果有）
+    priority INTEGER DEFAULT 1,  -- 消息优先级，1为默认
+    retried INTEGER DEFAULT 0,  -- 重试次数
+    tags TEXT,  -- 标签字段
+    expires_at TIMESTAMP,  -- 过期时间
+    user_id INTEGER,  -- 关联用户的ID
+    is_active BOOLEAN DEFAULT 0,  -- 表示消息是否处于活动状态
+    content_hash TEXT,  -- 消息内容摘要
+    duplicates INTEGER DEFAULT 0,  -- 合并到本行的重复消息数
+    last_seen_at TIMESTAMP  -- 最近一次收到重复消息的时间
+'''
+
+
+def day_number(day):
+    """date -> YYYYMMDD 整数"""
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day_number(day)}"
+
+
+def partition_day(name):
+    """分区表名 -> YYYYMMDD 整数，旧表为 0"""
+    return int(name[len(PARTITION_PREFIX):]) if name.startswith(PARTITION_PREFIX) else 0
+
+
+def first_id(day):
+    """该日分区的第一条消息 id"""
+    return day_number(day) * ID_SPAN + 1
+
+
+def table_for_id(message_id):
+    """消息 id 所在的表名"""
+    day = message_id // ID_SPAN
+    return f"{PARTITION_PREFIX}{day}" if day >= 19700101 else LEGACY_TABLE
+
+
+def id_range(name):
+    """分区中消息 id 的范围 [起, 止)，旧表为 [0, 最早的分区起点)"""
+    day = partition_day(name)
+    if not day:
+        return 0, day_number(date(1970, 1, 1)) * ID_SPAN
+    return day * ID_SPAN, (day + 1) * ID_SPAN
+
+
+# 压缩用的预置字典: 消息 JSON 中反复出现的键与常见值，显著提高短消息的压缩率
+# 以版本号作为压缩数据的第一个字节，字典内容一旦使用就不能修改，只能新增版本
+ZDICTS = {
+    1: (
+        b'ncm.png"bili.png"email.png"QQ.png"wechat.png"'
+        b'\\u6807\\u9898\\u4e3a\\u7a7a'     # "标题为空" (json.dumps 默认转义非 ASCII 字符)
+        b'{"title": "", "source": "", "content": {"message": "", "appname": null, "appname": "", '
+        b'"iconUrl": "http://klk.aethereiva.cn/image/app/Fluent/Fluent.png"}, "receiving_time": "20'
+    ),
+}
+ZDICT_VERSION = 1
+
+
+def compress_data(text):
+    compressor = zlib.compressobj(9, zdict=ZDICTS[ZDICT_VERSION])
+    return bytes([ZDICT_VERSION]) + compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def decode_data(value):
+    """读取 data 列: 文本直接解析，压缩数据先解压"""
+    if isinstance(value, bytes):
+        decompressor = zlib.decompressobj(zdict=ZDICTS[value[0]])
+        value = decompressor.decompress(value[1:]) + decompressor.flush()
+    return json.loads(value)
@@ -0,0 +1,53 @@
+import re
+
+# 消息全文搜索 (SQLite FTS5)
+#
+# 索引表 webhook_messages_fts 的 rowid 即消息 id (各分区的 id 全局唯一，见 partitions.py)，
+# 索引标题、内容、来源与应用名，与消息在同一事务中写入，清理消息时一并删除。
+#
+# unicode61 分词器按空白与标点切分，连续的中文会被当作一个词。索引前在每个中日文字符两侧加空格，
+# 把它们切成单字；查询时中文词作为由单字组成的短语匹配，因此任意长度的中文词都能搜到。
+
+FTS_TABLE = "webhook_messages_fts"
+FTS_COLUMNS = ("title", "message", "source", "appname")
+
+# 排序权重 (bm25，与 FTS_COLUMNS 对应): 标题命中比内容更相关，来源与应用名次之
+RANK = "bm25(2.0, 1.0, 0.5, 0.5)"
+
+CJK = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])")  # 假名与中日韩统一表意文字
+
+
+def create_index(db):
+    """创建索引表并设定默认排序；SQLite 未编译 FTS5 时抛出 sqlite3.OperationalError"""
+    db.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({', '.join(FTS_COLUMNS)}, "
+               f"tokenize = 'unicode61 remove_diacritics 2')")
+    db.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', ?)", (RANK,))
+
+
+def index_text(text):
+    """把中日文字符切成单字"""
+    return CJK.sub(r" \1 ", text) if text else ""
+
+
+def document(source, data):
+    """消息 -> 索引各列的文本"""
+    content = data.get("content") or {}
+    return (index_text(data.get("title")), index_text(content.get("message")),
+            index_text(source), index_text(content.get("appname")))
+
+
+def match_expression(query):
+    """
+    用户输入 -> FTS5 查询表达式，没有可搜索的内容时返回 None
+
+    以空白分隔的各词须全部命中 (AND)；以 * 结尾的词按前缀匹配 (如 meet*)。
+    每个词都作为带引号的短语传给 FTS5，输入中的引号、括号与 AND / OR / NOT 等不会被当作查询语法
+    """
+    phrases = []
+    for term in query.split():
+        prefix = term.endswith("*")
+        tokens = index_text(term.rstrip("*")).split()
+        if tokens:
+            phrase = " ".join(tokens).replace('"', '""')
+            phrases.append(f'"{phrase}"*' if prefix else f'"{phrase}"')
+    return " ".join(phrases) or None
@@ -1,8 +1,88 @@
 import hmac
+import time
 import hashlib
-from config import SECRET_KEY
+from collections import OrderedDict
 
-def verify_signature(signature, body):
-    """验证 Webhook 签名"""
-    calculated_signature = hmac.new(SECRET_KEY.encode(), body.encode(), hashlib.sha256).hexdigest()
-    return hmac.compare_digest(calculated_signature, signature)
+# Webhook 签名校验
+#
+# 发送方对 "<时间戳>." + 原始请求数据 计算 HMAC-SHA256 (密钥为 config.StrMsg 中的 SECRET_KEY)，随请求附带:
+#     X-Timestamp: 1700000000                 Unix 时间戳 (秒)
+#     X-Signature: sha256=<十六进制摘要>        也可以省略 "sha256=" 前缀
+# 原始请求数据: POST 为请求体的原始字节，GET 为原始查询字符串 (? 之后的部分)
+#
+# 时间戳与当前时间相差超过 tolerance 秒的请求被拒绝；窗口内的签名记入有界的 nonce 缓存，同一签名只接受一次
+
+SIGNATURE_HEADER = "X-Signature"
+TIMESTAMP_HEADER = "X-Timestamp"
+
+
+class SignatureError(Exception):
+    """签名校验失败，str(e) 为原因"""
+
+
+class NonceCache:
+    """
+    已接受的签名 -> 过期时间，按插入顺序从头部淘汰过期项
+
+    超过 max_size 时也从头部淘汰 (最早接受的签名)，内存有上限
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def add(self, nonce, expires_at, now):
+        """记录 nonce，已存在 (重放) 时返回 False"""
+        entries = self.entries
+        while entries:
+            key, expiry = next(iter(entries.items()))
+            if expiry > now and len(entries) < self.max_size:
+                break
+            del entries[key]
+        if nonce in entries:
+            return False
+        entries[nonce] = expires_at
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SignatureVerifier:
+    """
+    校验 webhook 签名
+
+    HMAC 密钥在创建时处理一次 (预先计算好内外两层填充后的状态)，每个请求只复制该状态再计算消息部分
+    """
+    def __init__(self, secret_key, tolerance=300, max_nonces=100000, clock=time.time):
+        self._mac = hmac.new(secret_key.encode("utf-8"), digestmod=hashlib.sha256)
+        self.tolerance = tolerance
+        self.nonces = NonceCache(max_nonces)
+        self.clock = clock
+
+    def sign(self, timestamp, payload):
+        """计算 "<时间戳>." + payload 的签名 (十六进制)"""
+        mac = self._mac.copy()
+        mac.update(f"{timestamp}.".encode("utf-8"))
+        mac.update(payload)
+        return mac.hexdigest()
+
+    def verify(self, signature, timestamp, payload):
+        """校验签名、时间戳与重放，不通过时抛出 SignatureError"""
+        if not signature or not timestamp:
+            raise SignatureError(f"缺少 {SIGNATURE_HEADER} 或 {TIMESTAMP_HEADER} 请求头")
+        try:
+            issued_at = int(timestamp)
+        except ValueError:
+            raise SignatureError("时间戳格式无效")
+        now = self.clock()
+        if abs(now - issued_at) > self.tolerance:
+            raise SignatureError("时间戳超出允许范围")
+
+        if signature.startswith("sha256="):
+            signature = signature[7:]
+        signature = signature.lower()
+        # 签名按请求头中时间戳的原文计算；先校验签名再记录 nonce，未通过校验的请求不会占用缓存
+        if not hmac.compare_digest(self.sign(timestamp, payload).encode(), signature.encode()):
+            raise SignatureError("签名无效")
+        if not self.nonces.add(signature, issued_at + self.tolerance, now):
+            raise SignatureError("重复的请求")
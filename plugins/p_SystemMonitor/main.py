@@ -1,10 +1,8 @@
-import time
+import asyncio
 import threading
-import signal
 import psutil  # 用于获取系统信息
-import json
-import sys
 from plugins import Plugin
+from plugins.routing import method
 import logging
 
 # 获取模块级别的 logger
@@ -13,27 +11,50 @@ logger = logging.getLogger(__name__)
 class SystemMonitorPlugin(Plugin):
     def __init__(self, server):
         self.server = server
-        self._stop_event = threading.Event()  # 用于停止后台线程
-        # 设置信号处理器
-        logger.debug("[ SystemMonitor ] 设置信号处理器...")
-        signal.signal(signal.SIGINT, self.handle_sigint)
+        # 退出信号由 WebSocketServer 统一处理，插件不再单独注册信号处理器
         self.cpuMonitor = cpuMonitor(self.server)
         self.ramMonitor = ramMonitor(self.server)
         self.netMonitor = netMonitor(self.server)
         self.batteryMonitor = batteryMonitor(self.server)
         self.diskMonitor = diskMonitor(self.server)
+
+        # 以数值形式发布到框架指标，ws 查询仍返回格式化后的字符串
+        self.server.metrics.gauge_func("sensus_system_cpu_percent", "CPU 使用率", lambda: self.cpuMonitor.cpu_usage)
+        self.server.metrics.gauge_func("sensus_system_memory_percent", "内存使用率", lambda: self.ramMonitor.memory_usage)
+        self.server.metrics.gauge_func("sensus_system_memory_used_bytes", "已用内存", lambda: self.ramMonitor.used_memory or 0)
         
         logger.info("[ SystemMonitor ] 初始化完毕\n")
-        
-    # 自定义 Ctrl+C 处理函数
-    def handle_sigint(self, signal, frame):
-        logger.info("[ SystemMonitor ] 收到退出信号，正在停止后台线程...")
-        sys.exit(0)
-        # self.server.exitServer("SystemMonitor 尝试强制结束异步多线程")
 
     async def stop(self):
-        logger.info("[ SystemMonitor ] 正在销毁自身实例...\n")
-        del self
+        """停止所有监控线程"""
+        logger.info("[ SystemMonitor ] 正在停止后台线程...")
+        for name in ("sensus_system_cpu_percent", "sensus_system_memory_percent", "sensus_system_memory_used_bytes"):
+            self.server.metrics.unregister(name)
+        monitors = (self.cpuMonitor, self.ramMonitor, self.netMonitor, self.batteryMonitor, self.diskMonitor)
+        # 先通知全部线程退出，再统一等待，避免逐个等待累加耗时
+        for monitor in monitors:
+            monitor._stop_event.set()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, monitor.stop_monitoring, 3) for monitor in monitors))
+        logger.info("[ SystemMonitor ] 后台线程已停止\n")
+
+    def export_state(self):
+        """热重载时交出最近一次的采集结果，新实例在首次采集完成前仍能返回数据"""
+        return {name: monitor.response for name, monitor in self._monitors().items()}
+
+    def import_state(self, state):
+        for name, monitor in self._monitors().items():
+            if not monitor.response and state.get(name):
+                monitor.response = state[name]
+
+    def _monitors(self):
+        return {
+            'cpu': self.cpuMonitor,
+            'memory': self.ramMonitor,
+            'network': self.netMonitor,
+            'battery': self.batteryMonitor,
+            'disk': self.diskMonitor
+        }
 
     async def get_status(self):
         # 返回当前的系统状态
@@ -45,23 +66,10 @@ class SystemMonitorPlugin(Plugin):
             'disk': self.diskMonitor.response
         }
 
-    async def on_message(self, websocket, message):
-        # 可以根据消息执行相应的操作
-        # logger.debug(f"[ SystemMonitor ] 收到消息：\n{message}")
-        if message.get('method') == "get_status":
-            # logger.debug(f"[ SystemMonitor > get_status ] 查询系统状态")
-            response = {"plugin": "SystemMonitor","message": await self.get_status()}
-            await websocket.send(json.dumps(response, ensure_ascii=False))
-            return
-        logger.warning(f"[ SystemMonitor ] 不支持的操作：{message.get('message')}")
-        response = {"message": f"不支持的操作：{message.get('message')}"}
-        await websocket.send(json.dumps(response, ensure_ascii=False))
-
-
-
-
-
-
+    @method("get_status")
+    async def on_get_status(self, websocket, message):
+        response = {"plugin": "SystemMonitor","message": await self.get_status()}
+        await self.reply(websocket, message, response)
 
 
 class cpuMonitor:
@@ -79,10 +87,10 @@ class cpuMonitor:
         self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
         self.monitor_thread.start()
 
-    def stop_monitoring(self):
+    def stop_monitoring(self, timeout=None):
         # 停止监控
         self._stop_event.set()
-        self.monitor_thread.join()
+        self.monitor_thread.join(timeout)
 
     def _monitor(self):
         while not self._stop_event.is_set():
@@ -94,7 +102,7 @@ class cpuMonitor:
                 'cpu_usage': self.cpu_usage,
                 'per_core': self.cpu_percent_per_core
             }
-            time.sleep(1)  # 每秒钟获取一次数据
+            self._stop_event.wait(1)  # 每秒钟获取一次数据
 
 class ramMonitor:
     def __init__(self, server):
@@ -112,10 +120,10 @@ class ramMonitor:
         self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
         self.monitor_thread.start()
 
-    def stop_monitoring(self):
+    def stop_monitoring(self, timeout=None):
         # 停止监控
         self._stop_event.set()
-        self.monitor_thread.join()
+        self.monitor_thread.join(timeout)
 
     def convert_memory_size(self, size_in_mb):
         """将内存大小转换为MB或GB"""
@@ -139,7 +147,7 @@ class ramMonitor:
                 'total_memory': self.convert_memory_size(total_memory_mb),
                 'used_memory': self.convert_memory_size(used_memory_mb)
             }
-            time.sleep(1)  # 每秒钟获取一次数据
+            self._stop_event.wait(1)  # 每秒钟获取一次数据
 
 class netMonitor:
     def __init__(self, server):
@@ -189,16 +197,16 @@ class netMonitor:
         self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
         self.monitor_thread.start()
 
-    def stop_monitoring(self):
+    def stop_monitoring(self, timeout=None):
         # 停止监控
         self._stop_event.set()
-        self.monitor_thread.join()
+        self.monitor_thread.join(timeout)
 
     def _monitor(self):
         while not self._stop_event.is_set():
             # 获取 网络速率 
             self.update_network_info()
-            time.sleep(1)  # 每秒钟获取一次数据
+            self._stop_event.wait(1)  # 每秒钟获取一次数据
 
 class batteryMonitor:
     def __init__(self, server):
@@ -245,16 +253,16 @@ class batteryMonitor:
         self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
         self.monitor_thread.start()
 
-    def stop_monitoring(self):
+    def stop_monitoring(self, timeout=None):
         # 停止监控
         self._stop_event.set()
-        self.monitor_thread.join()
+        self.monitor_thread.join(timeout)
 
     def _monitor(self):
         while not self._stop_event.is_set():
             # 获取 电源 使用率
             self.update_battery_info()
-            time.sleep(30)  # 每秒钟获取一次数据
+            self._stop_event.wait(30)  # 每秒钟获取一次数据
 
 class diskMonitor:
     def __init__(self, server):
@@ -300,13 +308,13 @@ class diskMonitor:
         self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
         self.monitor_thread.start()
 
-    def stop_monitoring(self):
+    def stop_monitoring(self, timeout=None):
         # 停止监控
         self._stop_event.set()
-        self.monitor_thread.join()
+        self.monitor_thread.join(timeout)
 
     def _monitor(self):
         while not self._stop_event.is_set():
             # 获取 磁盘 使用率
             self.update_disk_info()
-            time.sleep(10)  # 每秒钟获取一次数据
+            self._stop_event.wait(10)  # 每秒钟获取一次数据
@@ -0,0 +1,81 @@
+# plugins/routing.py
+
+"""
+插件方法路由
+
+插件用 @method 把协程方法注册为消息方法，不必在 on_message 中逐个比较 message['method']:
+
+    class StrMsgPlugin(Plugin):
+        @method("get_latest_messages", params={"count": int})
+        async def get_latest_messages(self, websocket, message, count):
+            ...
+
+参数的结构用 schema (见 schema.py) 声明，取自消息的 message 字段 (JSON 字符串或对象)，处理函数收到解码后的对象:
+
+        @method("get_latest_messages", schema=LatestMessagesQuery)
+        async def get_latest_messages(self, websocket, message, query):
+            ...
+
+params={"count": int} 为简写，校验后的各参数作为关键字参数传入。
+
+插件加载时按类生成一次路由表 {方法名: Route}，插件管理器按 (插件, 方法) 直接找到处理函数；
+声明了路由的插件收到未注册的方法、或参数不符合声明时，由框架直接答复，不再调用插件。
+"""
+
+from schema import Schema
+
+ROUTES_ATTR = "__sensus_routes__"
+
+
+def method(name=None, params=None, schema=None):
+    """把插件方法注册为名为 name (默认为函数名) 的消息方法"""
+    def decorator(func):
+        method_name = name or func.__name__
+        if params:
+            route_schema, expand = Schema.from_fields(f"{method_name}Params", params), True
+        else:
+            route_schema, expand = schema, False
+        func.__sensus_method__ = (method_name, route_schema, expand)
+        return func
+    return decorator
+
+
+class Route:
+    """一个消息方法: 处理函数名与参数结构"""
+    __slots__ = ("name", "attr", "schema", "expand")
+
+    def __init__(self, name, attr, schema, expand):
+        self.name = name
+        self.attr = attr
+        self.schema = schema
+        self.expand = expand  # True 时参数作为关键字参数传入，否则传入解码后的对象
+
+    def bind(self, plugin, websocket, message):
+        """解码参数并返回处理函数的协程，参数不符合声明时抛出 SchemaError"""
+        handler = getattr(plugin, self.attr)
+        if self.schema is None:
+            return handler(websocket, message)
+        payload = message.get("message")
+        args = self.schema.decode(payload if payload is not None else {})
+        if self.expand:
+            return handler(websocket, message, **args.__dict__)
+        return handler(websocket, message, args)
+
+
+def get_routes(plugin_class):
+    """插件类的路由表 {方法名: Route}，每个类只生成一次；没有声明路由时为空字典"""
+    routes = plugin_class.__dict__.get(ROUTES_ATTR)
+    if routes is None:
+        routes = {}
+        # 按 MRO 逆序收集，子类的同名方法覆盖父类
+        for cls in reversed(plugin_class.__mro__):
+            for attr, value in vars(cls).items():
+                declared = getattr(value, "__sensus_method__", None)
+                if declared is not None:
+                    routes[declared[0]] = Route(declared[0], attr, *declared[1:])
+        setattr(plugin_class, ROUTES_ATTR, routes)
+    return routes
+
+
+def unsupported(plugin_name, method_name):
+    return {"plugin": plugin_name, "error": f"不支持的方法 {method_name}"}
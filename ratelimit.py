@@ -0,0 +1,76 @@
+# ratelimit.py
+
+"""
+令牌桶限流
+
+每个键 (连接、token、IP、webhook 来源) 一个桶: 容量为 burst，每秒补充 rate 个令牌。
+桶只保存 [令牌数, 上次更新时间]，补充在取令牌时按经过的时间一次算出 (惰性补充)，不需要定时任务；
+超过 burst / rate 秒未访问的桶已经补满，与不存在等价，按最近访问顺序从头部淘汰，
+因此内存只与最近活跃的键数量有关，每次检查均为 O(1) (淘汰为均摊 O(1))。
+"""
+
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    一组令牌桶
+
+    不加锁，只应在同一个线程 (事件循环) 中使用
+    """
+    def __init__(self, rate, burst=None, max_keys=100000, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.idle = self.burst / self.rate  # 空桶补满所需的秒数
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets = OrderedDict()        # key -> [令牌数, 更新时间]，头部为最久未访问的桶
+
+    @classmethod
+    def from_config(cls, value, **kwargs):
+        """由配置项 (每秒令牌数, 突发容量) 创建限流器，配置为 None 时返回 None (不限制)"""
+        if not value:
+            return None
+        rate, burst = value if isinstance(value, (tuple, list)) else (value, None)
+        return cls(rate, burst, **kwargs)
+
+    def allow(self, key, cost=1):
+        """取 cost 个令牌，成功返回 True；令牌不足时不扣减并返回 False"""
+        now = self.clock()
+        buckets = self.buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [self.burst, now]
+        else:
+            buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        allowed = bucket[0] >= cost
+        if allowed:
+            bucket[0] -= cost
+        self._evict(now)
+        return allowed
+
+    def retry_after(self, key, cost=1):
+        """还需等待多少秒才能取到 cost 个令牌"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return 0.0
+        tokens = min(self.burst, bucket[0] + (self.clock() - bucket[1]) * self.rate)
+        return max(0.0, (cost - tokens) / self.rate)
+
+    def forget(self, key):
+        """丢弃一个桶 (如连接断开时)"""
+        self.buckets.pop(key, None)
+
+    def _evict(self, now):
+        buckets = self.buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket[1] < self.idle and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def __len__(self):
+        return len(self.buckets)
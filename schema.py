@@ -0,0 +1,295 @@
+# schema.py
+
+"""
+声明式消息结构，用于校验 ws 方法参数与 webhook 请求体
+
+    class LatestQuery(Schema):
+        count = Field(int, min=1)
+        source = Field(str, default=None)
+
+    query = LatestQuery.decode('{"count": 20}')   # JSON 文本 (str / bytes) 或 dict
+    query.count                                    # 20
+
+校验器在类定义时编译一次 (插件模块导入即插件加载时):
+  - 安装了 pydantic 时编译为 pydantic 模型，JSON 文本由 pydantic-core 一次完成解析、校验与类型转换
+  - 否则使用标准库实现的校验器
+两种实现的转换规则与错误信息一致，校验失败抛出 SchemaError，其 errors 为 [{"field", "error"}]
+"""
+
+import copy
+import json
+import typing
+
+try:
+    import pydantic
+except ImportError:
+    pydantic = None
+
+REQUIRED = object()
+
+TYPE_NAMES = {int: "整数", float: "数字", str: "字符串", bool: "布尔值", list: "数组", dict: "JSON 对象"}
+
+
+class SchemaError(ValueError):
+    """消息不符合声明的结构，errors 为 [{"field": 字段名 (整体错误时为空), "error": 原因}]"""
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{error['field']}: {error['error']}" if error["field"] else error["error"] for error in errors))
+
+
+class Field:
+    """
+    字段声明
+
+    type 为 int / float / str / bool / list / dict 或它们组成的元组；default 为 None 时字段可为 null；
+    min / max 限制数值，min_length / max_length 限制字符串与数组长度，choices 限制取值
+    """
+    __slots__ = ("type", "default", "min", "max", "min_length", "max_length", "choices")
+
+    def __init__(self, type, default=REQUIRED, min=None, max=None, min_length=None, max_length=None, choices=None):
+        self.type = type
+        self.default = default
+        self.min = min
+        self.max = max
+        self.min_length = min_length
+        self.max_length = max_length
+        self.choices = tuple(choices) if choices is not None else None
+
+    @property
+    def required(self):
+        return self.default is REQUIRED
+
+    @property
+    def types(self):
+        return self.type if isinstance(self.type, tuple) else (self.type,)
+
+    def type_error(self):
+        return "应为" + "或".join(TYPE_NAMES.get(t, t.__name__) for t in self.types)
+
+    def choices_error(self):
+        return f"取值应为 {' 或 '.join(repr(choice) for choice in self.choices)}"
+
+    def default_value(self):
+        # 可变默认值每次复制一份
+        return copy.copy(self.default) if isinstance(self.default, (list, dict)) else self.default
+
+
+class Schema:
+    """声明式结构的基类，子类以 Field 类属性声明字段；__backend__ 可指定 "pydantic" 或 "stdlib" """
+    __fields__ = {}
+    __backend__ = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = dict(cls.__fields__)
+        for name, value in list(vars(cls).items()):
+            if isinstance(value, Field):
+                fields[name] = value
+                delattr(cls, name)
+        cls.__fields__ = fields
+        backend = cls.__backend__ or ("pydantic" if pydantic is not None else "stdlib")
+        cls._decode = staticmethod(_compile_pydantic(cls) if backend == "pydantic" else _compile_stdlib(cls))
+
+    @classmethod
+    def decode(cls, data):
+        """校验 JSON 文本或 dict，返回本类的实例，不符合时抛出 SchemaError"""
+        return cls._decode(data)
+
+    @classmethod
+    def from_fields(cls, name, fields):
+        """由 {字段名: 类型或 Field} 生成结构类"""
+        return type(name, (cls,), {key: value if isinstance(value, Field) else Field(value) for key, value in fields.items()})
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__fields__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={value!r}' for name, value in self.to_dict().items())})"
+
+
+def _instance(cls, values):
+    instance = cls.__new__(cls)
+    instance.__dict__.update(values)
+    return instance
+
+
+# ---- pydantic 实现 ----
+
+# pydantic 错误类型 -> 错误信息 (类型错误统一由 Field.type_error 给出)
+_PYDANTIC_MESSAGES = {
+    "missing": "缺少字段",
+    "greater_than_equal": "不能小于 {ge}",
+    "less_than_equal": "不能大于 {le}",
+    "string_too_short": "长度不能小于 {min_length}",
+    "string_too_long": "长度不能超过 {max_length}",
+    "too_short": "长度不能小于 {min_length}",
+    "too_long": "长度不能超过 {max_length}",
+    "json_invalid": "不是合法的 JSON",
+    "model_type": "应为 JSON 对象",
+    "model_attributes_type": "应为 JSON 对象",
+}
+
+
+def _annotation(field):
+    if field.choices is not None:
+        annotation = typing.Literal[field.choices]
+    elif len(field.types) > 1:
+        annotation = typing.Union[field.types]
+    else:
+        annotation = field.type
+    if field.default is None:
+        annotation = typing.Optional[annotation]
+    return annotation
+
+
+def _compile_pydantic(cls):
+    definitions = {}
+    for name, field in cls.__fields__.items():
+        constraints = {
+            key: value for key, value in (
+                ("ge", field.min), ("le", field.max), ("min_length", field.min_length), ("max_length", field.max_length),
+            ) if value is not None
+        }
+        default = ... if field.required else field.default
+        definitions[name] = (_annotation(field), pydantic.Field(default, **constraints))
+    model = pydantic.create_model(f"{cls.__name__}Model", **definitions)
+    fields = cls.__fields__
+
+    def convert(error):
+        loc = error["loc"]
+        name = str(loc[0]) if loc else ""
+        message = _PYDANTIC_MESSAGES.get(error["type"])
+        if message is not None:
+            message = message.format(**error.get("ctx", {}))
+        elif name in fields and error["type"] == "literal_error":
+            message = fields[name].choices_error()
+        elif name in fields and error["type"].endswith(("_type", "_parsing", "_from_float")):
+            message = fields[name].type_error()
+        else:
+            message = error["msg"]
+        return {"field": name, "error": message}
+
+    def decode(data):
+        try:
+            if isinstance(data, (str, bytes, bytearray)):
+                model_instance = model.model_validate_json(data)
+            else:
+                model_instance = model.model_validate(data)
+        except pydantic.ValidationError as e:
+            errors = {}
+            for error in e.errors(include_url=False):
+                converted = convert(error)
+                errors.setdefault(converted["field"], converted)  # 联合类型的每个分支都会报错，每个字段只保留一条
+            raise SchemaError(list(errors.values()))
+        return _instance(cls, model_instance.__dict__)
+    return decode
+
+
+# ---- 标准库实现 ----
+
+def _to_int(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return int(value.strip())
+    raise ValueError
+
+def _to_float(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return float(value.strip())
+    raise ValueError
+
+_BOOL_STRINGS = {"true": True, "1": True, "yes": True, "on": True, "false": False, "0": False, "no": False, "off": False}
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in _BOOL_STRINGS:
+        return _BOOL_STRINGS[value.lower()]
+    raise ValueError
+
+def _exact(expected):
+    def convert(value):
+        if type(value) is not expected:
+            raise ValueError
+        return value
+    return convert
+
+_CONVERTERS = {int: _to_int, float: _to_float, bool: _to_bool, str: _exact(str), list: _exact(list), dict: _exact(dict)}
+
+
+def _checker(field):
+    """编译单个字段的校验函数: value -> (错误信息或 None, 转换后的值)"""
+    types = field.types
+    converters = [_CONVERTERS[t] for t in types]
+
+    def check(value):
+        # 与值类型完全一致的分支优先，其次按声明顺序尝试转换
+        if type(value) in types:
+            converted = value
+        else:
+            for convert in converters:
+                try:
+                    converted = convert(value)
+                    break
+                except (TypeError, ValueError):
+                    pass
+            else:
+                return field.type_error(), None
+        if field.choices is not None and converted not in field.choices:
+            return field.choices_error(), None
+        if field.min is not None and converted < field.min:
+            return f"不能小于 {field.min}", None
+        if field.max is not None and converted > field.max:
+            return f"不能大于 {field.max}", None
+        if field.min_length is not None and len(converted) < field.min_length:
+            return f"长度不能小于 {field.min_length}", None
+        if field.max_length is not None and len(converted) > field.max_length:
+            return f"长度不能超过 {field.max_length}", None
+        return None, converted
+    return check
+
+
+def _compile_stdlib(cls):
+    checks = [(name, field, _checker(field)) for name, field in cls.__fields__.items()]
+
+    def decode(data):
+        if isinstance(data, (str, bytes, bytearray)):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                raise SchemaError([{"field": "", "error": "不是合法的 JSON"}])
+        if not isinstance(data, dict):
+            raise SchemaError([{"field": "", "error": "应为 JSON 对象"}])
+        values = {}
+        errors = []
+        for name, field, check in checks:
+            if name not in data:
+                if field.required:
+                    errors.append({"field": name, "error": "缺少字段"})
+                else:
+                    values[name] = field.default_value()
+                continue
+            value = data[name]
+            if value is None and field.default is None:
+                values[name] = None
+                continue
+            error, value = check(value)
+            if error is not None:
+                errors.append({"field": name, "error": error})
+            else:
+                values[name] = value
+        if errors:
+            raise SchemaError(errors)
+        return _instance(cls, values)
+    return decode
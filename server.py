@@ -1,32 +1,104 @@
 # websocket_server.py
 
-import sys
+import math
 import signal
 import asyncio
 import websockets
 from websockets.exceptions import ConnectionClosed, NegotiationError
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 import urllib.parse
 import json
 import os
-import re
 import importlib
-from plugins import PluginManager
+from http import HTTPStatus
+from plugins import PluginManager, BatchCollector, reply
+from session import ConnectionRegistry
+from cluster import ClusterBus, DiscardSocket
+from loopmon import LoopLagMonitor, LoopWatchdog
+from ratelimit import RateLimiter
+from auth import TokenStore, TOKEN_FILE
+from metrics import MetricsRegistry, MetricsExporter, LogLevelMetricsHandler
 import logging
 
 from config import config
 from conf import ConfigLoader
+from log import get_hot_logger, flush_logs
 
 # 获取模块级别的 logger
 logger = logging.getLogger(__name__)
-
-# 用于存放多个 ws 连接的实例
-connections = {}
+# 热路径 (握手、消息处理) 使用带级别缓存的 logger
+hot = get_hot_logger(__name__)
+
+# ws 传输参数预设，通过配置项 WS_PRESET 选择，WS_OPTIONS 可逐项覆盖
+WS_PRESETS = {
+    # 与 websockets 默认值一致
+    "default": {
+        "compression": "deflate",
+        "deflate_window_bits": 12,
+        "deflate_mem_level": 5,
+        "deflate_level": 6,
+        "max_size": 2 ** 20,
+        "max_queue": 16,
+        "write_limit": 32 * 2 ** 10,
+        "ping_interval": 20,
+        "ping_timeout": 20,
+    },
+    # 局域网: 带宽充足，关闭压缩以节省 CPU，放宽帧大小与写缓冲
+    "lan": {
+        "compression": None,
+        "max_size": 8 * 2 ** 20,
+        "max_queue": 64,
+        "write_limit": 256 * 2 ** 10,
+        "ping_interval": 20,
+        "ping_timeout": 20,
+    },
+    # 移动网络: 带宽紧张，用更大的压缩窗口换取更小的 StrMsg 历史与 SystemMonitor 帧；
+    # 写缓冲较小以便尽早发现慢连接，心跳放宽以容忍网络抖动
+    "mobile": {
+        "compression": "deflate",
+        "deflate_window_bits": 15,
+        "deflate_mem_level": 8,
+        "deflate_level": 6,
+        "max_size": 2 ** 20,
+        "max_queue": 16,
+        "write_limit": 16 * 2 ** 10,
+        "ping_interval": 30,
+        "ping_timeout": 60,
+    },
+}
+
+def build_ws_options(preset_name, overrides=None):
+    """根据预设与覆盖项生成 websockets.serve 的传输参数"""
+    if preset_name not in WS_PRESETS:
+        logger.warning(f"[ ws 服务器 ] 未知的传输预设 {preset_name}，使用 default")
+        preset_name = "default"
+    options = dict(WS_PRESETS[preset_name])
+    options.update(overrides or {})
+
+    serve_options = {
+        key: options[key]
+        for key in ("max_size", "max_queue", "write_limit", "ping_interval", "ping_timeout")
+        if key in options
+    }
+
+    # 关闭 websockets 的默认压缩，改为按配置构造 permessage-deflate 扩展
+    serve_options["compression"] = None
+    if options.get("compression") == "deflate":
+        window_bits = options.get("deflate_window_bits", 12)
+        serve_options["extensions"] = [
+            ServerPerMessageDeflateFactory(
+                server_max_window_bits=window_bits,
+                client_max_window_bits=window_bits,
+                compress_settings={
+                    "memLevel": options.get("deflate_mem_level", 5),
+                    "level": options.get("deflate_level", 6),
+                },
+            )
+        ]
+    return serve_options
 
 class WebSocketServer:
-    def __init__(self):
-        # 监听 SIGTERM 信号
-        signal.signal(signal.SIGTERM, self.handle_sigterm)
-
+    def __init__(self, worker_id=0, workers=1):
         # 确保关键目录存在
         os.makedirs("cache", exist_ok=True)
         os.makedirs("logs", exist_ok=True)
@@ -37,102 +109,402 @@ class WebSocketServer:
 
         self.host = config.HOST
         self.port = config.PORT
-        self.token = config.TOKEN
-
+        # 可用的 token 及其权限范围，配置项 TOKEN 视为拥有全部权限的 token
+        self.tokens = TokenStore(getattr(config, 'TOKEN_FILE', TOKEN_FILE), getattr(config, 'TOKEN', None))
+
+        # 多 worker 模式: 各 worker 以 SO_REUSEPORT 绑定同一端口，单例任务只在 worker 0 上运行
+        self.worker_id = worker_id
+        self.workers = workers
+        self.is_primary = worker_id == 0
+        self.cluster = None  # 集群消息总线，仅多 worker 模式下存在
+
+        # 用于存放多个 ws 连接的实例
+        self.connections = ConnectionRegistry()
+        # 广播时单个连接的发送超时 (秒)，超时的连接会被视为慢连接并断开
+        self.broadcast_timeout = getattr(config, 'BROADCAST_TIMEOUT', 5)
+
+        # ws 传输参数 (压缩、帧大小、队列、写缓冲、心跳)
+        self.ws_preset = getattr(config, 'WS_PRESET', 'default')
+        self.ws_options = build_ws_options(self.ws_preset, getattr(config, 'WS_OPTIONS', None))
+
+        # 限制全局并发处理任务数量为 200
+        self.dispatch_semaphore = asyncio.Semaphore(200)
+        # 单个连接允许同时在途 (带 id 流水线) 的请求数，超过后暂停读取该连接
+        self.max_inflight = getattr(config, 'MAX_INFLIGHT_PER_CONNECTION', 32)
+        # 所有正在处理中的流水线请求
+        self.inflight_tasks = set()
+        # 单个 batch 请求最多包含的子请求数
+        self.max_batch_size = getattr(config, 'MAX_BATCH_SIZE', 50)
+
+        # 令牌桶限流，配置为 (每秒令牌数, 突发容量)，None 表示不限制:
+        # 每条消息在解析 JSON 之前按连接与 token 各取一个令牌，每次握手按客户端 IP 取一个令牌
+        self.connection_limiter = RateLimiter.from_config(getattr(config, 'RATE_LIMIT_CONNECTION', (50, 100)))
+        self.token_limiter = RateLimiter.from_config(getattr(config, 'RATE_LIMIT_TOKEN', (200, 400)))
+        self.ip_limiter = RateLimiter.from_config(getattr(config, 'RATE_LIMIT_HANDSHAKE_IP', (2, 10)))
+
+        # 优雅退出: 收到退出信号后，在 SHUTDOWN_TIMEOUT 秒内完成排空、停止插件与关闭连接
+        self.shutdown_timeout = getattr(config, 'SHUTDOWN_TIMEOUT', 10)
+        self.shutdown_event = asyncio.Event()
+        self.draining = False           # 排空阶段不再分发新消息
+        self.active_dispatches = 0      # 正在分发中的消息数
+        self._drained = asyncio.Event() # 排空阶段在途消息全部完成时置位
+        self.loop = None
+        self.exit_code = 0
+
+        # 事件循环调度延迟监控，用于发现阻塞事件循环的插件
+        self.loop_monitor = LoopLagMonitor(
+            interval=getattr(config, 'LOOP_LAG_INTERVAL', 0.5),
+            report_interval=getattr(config, 'LOOP_LAG_REPORT_INTERVAL', 60),
+            warn_threshold=getattr(config, 'LOOP_LAG_WARN', 0.1),
+        )
+        # 事件循环阻塞超过 WATCHDOG_THRESHOLD 秒时抓取调用栈并归因到插件
+        self.watchdog = None
+        if getattr(config, 'WATCHDOG_ENABLED', True):
+            self.watchdog = LoopWatchdog(threshold=getattr(config, 'WATCHDOG_THRESHOLD', 0.5))
+
+        # 框架级指标注册表，插件通过 self.server.metrics 发布自己的指标
+        self.metrics = MetricsRegistry()
+        rate_limited = self.metrics.counter("sensus_rate_limited_total", "被限流的消息与握手数", ("scope",))
+        self.rate_limited = {scope: rate_limited.labels(scope) for scope in ("connection", "token", "ip")}
+
+        # 运行在独立子进程中的插件 (插件名，不含 p_ 前缀)
+        self.isolated_plugins = set(getattr(config, 'ISOLATED_PLUGINS', ()))
 
         self.pm_list = None
         self.pm_status = 1  # 插件管理状态
         # 实例化插件管理器
         self.plugin_manager = PluginManager(self)
+        self._register_core_metrics()
+
+        # Prometheus 指标服务，配置 METRICS_PORT 后启用 (多 worker 模式下每个 worker 使用 METRICS_PORT + worker_id)
+        self.metrics_exporter = None
+        metrics_port = getattr(config, 'METRICS_PORT', None)
+        if metrics_port:
+            self.metrics_exporter = MetricsExporter(
+                getattr(config, 'METRICS_HOST', '127.0.0.1'), metrics_port + worker_id, self.metrics,
+            )
 
     @classmethod
-    async def create(cls):
+    async def create(cls, worker_id=0, workers=1):
         """
         类方法进行异步初始化
         """
-        self = cls()  # 创建类的实例
+        self = cls(worker_id, workers)  # 创建类的实例
         # 这里可以执行其他异步操作，如初始化数据库连接等
         await self.async_initialize()  # 异步初始化
         
-        return
+        return self
+
+    def _register_core_metrics(self):
+        """注册框架核心指标，均为采集时才求值的仪表，平时没有开销"""
+        metrics = self.metrics
+        metrics.gauge_func("sensus_info", "SenSus 版本与 worker 信息", lambda: [
+            ((getattr(config, 'VER', ''), str(self.worker_id), self.ws_preset), 1),
+        ], ("version", "worker", "preset"))
+        metrics.gauge_func("sensus_connections", "当前 ws 连接数", lambda: len(self.connections))
+        metrics.gauge_func("sensus_dispatch_active", "正在分发中的消息数", lambda: self.active_dispatches)
+        metrics.gauge_func("sensus_pipelined_inflight", "带 id 流水线处理中的请求数", lambda: len(self.inflight_tasks))
+        # 等待全局分发信号量的消息数，即分发队列深度
+        metrics.gauge_func("sensus_dispatch_queue_depth", "等待分发的消息数", lambda: self.plugin_manager.dispatch_waiting)
+        metrics.gauge_func("sensus_loaded_plugins", "已加载的插件数",
+                           lambda: len(self.plugin_manager.plugins["loaded_plugins"]))
+
+        def loop_lag():
+            stats = self.loop_monitor.stats()
+            return [(("0.5",), stats["p50"]), (("0.99",), stats["p99"]), (("1",), stats["max"])]
+        metrics.gauge_func("sensus_loop_lag_seconds", "最近窗口内的事件循环调度延迟", loop_lag, ("quantile",))
+
+        def loop_stalls():
+            if self.watchdog is None:
+                return []
+            return [((name,), item["stalls"]) for name, item in self.watchdog.stats().items()]
+        metrics.gauge_func("sensus_loop_stalls", "看门狗检测到的事件循环阻塞次数 (按插件归因)", loop_stalls, ("plugin",))
+
+        metrics.register_collector(self.plugin_manager.metrics.prometheus)
+
+        # WARNING 及以上级别的日志计数
+        log_counter = metrics.counter("sensus_log_messages_total", "WARNING 及以上级别的日志条数", ("level",))
+        logging.getLogger().addHandler(LogLevelMetricsHandler(log_counter))
 
     async def async_initialize(self):
         """
         异步初始化操作
         """
+        self.loop = asyncio.get_running_loop()
+        self._install_signal_handlers()
+
+        if self.workers > 1:
+            # 连接 supervisor 的集群总线，接收其他 worker 转发的广播与插件管理命令
+            self.cluster = ClusterBus(self.worker_id)
+            self.cluster.on("broadcast", self._on_cluster_broadcast)
+            self.cluster.on("plugin_manager", self._on_cluster_plugin_manager)
+            if not await self.cluster.connect():
+                self.cluster = None
+
+        if self.metrics_exporter is not None:
+            try:
+                await self.metrics_exporter.start()
+            except OSError as e:
+                logger.error(f"[ 指标 ] 指标服务启动失败: {e}")
+                self.metrics_exporter = None
+
         asyncio.create_task(self.log_connections())  # 每隔 10 秒打印连接列表
+        self.loop_monitor.start()
+        if self.watchdog is not None:
+            self.watchdog.start()  # 在加载插件之前启动，插件构造函数中的阻塞也能被发现
 
         # 启动 WebSocket 服务器
         await self.start_server()  # 使用异步任务启动服务器
 
 
-    def handle_sigterm(self, signum, frame):
-        logger.info("[ ws 服务器 ] 收到终止信号，正在关闭 ws 服务器...")
-        sys.exit(0)
+    def _install_signal_handlers(self):
+        """SIGINT / SIGTERM 统一交给事件循环处理，插件不应再注册自己的信号处理器"""
+        signals = (signal.SIGINT, signal.SIGTERM)
+        if self.workers > 1:
+            # worker 进程与 supervisor 处于同一进程组，终端的 Ctrl+C 会同时发给所有进程；
+            # worker 忽略 SIGINT，统一等待 supervisor 转发的 SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signals = (signal.SIGTERM,)
+        for sig in signals:
+            try:
+                self.loop.add_signal_handler(sig, self.request_shutdown, sig.name)
+            except (NotImplementedError, RuntimeError):
+                # Windows 不支持 add_signal_handler，退回到 signal.signal 并转交给事件循环
+                signal.signal(sig, lambda signum, frame: self.loop.call_soon_threadsafe(
+                    self.request_shutdown, signal.Signals(signum).name))
+
+    def request_shutdown(self, reason):
+        """请求优雅退出，需在事件循环线程中调用"""
+        if self.shutdown_event.is_set():
+            if self.workers > 1:
+                # worker 可能同时收到 supervisor 转发的与进程管理器 (如 systemd) 直接发送的 SIGTERM，
+                # 超时后由 supervisor 负责强制终止
+                return
+            # 退出流程中再次收到信号，视为用户要求立即退出
+            logger.warning(f"[ ws 服务器 ] 退出过程中再次收到 {reason}，立即终止进程")
+            flush_logs()
+            os._exit(1)
+        logger.info(f"[ ws 服务器 ] 收到 {reason}，正在优雅地关闭 ws 服务器...")
+        self.shutdown_event.set()
 
     def exitServer(self, reason):
-        logger.info(f"[ ws 服务器 ] 因为 {reason} , 正在强制关闭 ws 服务器...")
-        pid = os.getpid()
-        os.kill(pid, signal.SIGTERM)
+        """供其他线程 (如插件的监控线程) 调用，请求服务器优雅退出"""
+        logger.info(f"[ ws 服务器 ] 因为 {reason} , 正在关闭 ws 服务器...")
+        if self.workers > 1:
+            # 多 worker 模式下通知 supervisor 关闭整个集群，否则 supervisor 会把退出的 worker 重新拉起
+            os.kill(os.getppid(), signal.SIGTERM)
+            return
+        if self.loop is None:
+            pid = os.getpid()
+            os.kill(pid, signal.SIGTERM)
+            return
+        self.loop.call_soon_threadsafe(self.request_shutdown, reason)
+
+    async def shutdown(self):
+        """
+        优雅退出，所有步骤共享 SHUTDOWN_TIMEOUT 的截止时间:
+        1. 停止接收新连接
+        2. 等待在途的消息分发完成
+        3. 并发停止所有插件 (StrMsg 会先处理完在途的 webhook 写入)
+        4. 关闭所有 ws 连接 (1001 going away)
+        5. 刷新日志
+        """
+        deadline = self.loop.time() + self.shutdown_timeout
+
+        def remaining():
+            return max(deadline - self.loop.time(), 0.1)
+
+        self.draining = True
+        logger.info("[ ws 服务器 / 退出 ] 停止接收新连接...")
+        self.server.server.close()  # 只关闭监听 socket，已有连接保持到排空结束
+
+        if self.active_dispatches:
+            logger.info(f"[ ws 服务器 / 退出 ] 等待 {self.active_dispatches} 个在途请求处理完成...")
+            try:
+                await asyncio.wait_for(self._drained.wait(), remaining())
+            except asyncio.TimeoutError:
+                logger.warning(f"[ ws 服务器 / 退出 ] 等待超时，仍有 {self.active_dispatches} 个请求未完成")
+
+        await self.plugin_manager.stop_all(remaining())
+
+        logger.info(f"[ ws 服务器 / 退出 ] 正在关闭 {len(self.connections)} 个 ws 连接...")
+        self.server.close(close_connections=True)
+        try:
+            await asyncio.wait_for(self.server.wait_closed(), remaining())
+        except asyncio.TimeoutError:
+            logger.warning("[ ws 服务器 / 退出 ] 部分 ws 连接未能在截止时间内关闭")
 
-    async def validate_token(self, token):
+        if self.cluster is not None:
+            await self.cluster.close()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.metrics_exporter is not None:
+            await self.metrics_exporter.close()
 
-        if token != self.token:
+        logger.info("[ ws 服务器 / 退出 ] ws 服务器已关闭")
+        flush_logs()
+
+    def process_handshake(self, connection, request):
+        """
+        websockets 的 process_request 钩子，在升级为 ws 连接之前:
+          1. 按客户端 IP 限制握手频率，超出时返回 429
+          2. 验证子协议第一项中的 token，失败时返回 401；成功时把权限范围 (Grant) 缓存在连接上，
+             之后的消息只做授权检查，不再验证 token
+        """
+        response = self.limit_handshake(connection)
+        if response is not None:
+            return response
+
+        protocols = ",".join(request.headers.get_all('Sec-WebSocket-Protocol'))
+        token = protocols.split(',')[0].strip()
+        self.tokens.refresh()
+        grant = self.tokens.verify(token) if token else None
+        if grant is None:
             logger.warning("[ ws 服务器 ] 子协议 (Token) 验证失败！")
-            logger.debug(f"[ ws 服务器 ] 接收到的 Token 为：{token}")
-            raise Exception("Invalid token")
-        logger.info("[ ws 服务器 ] 子协议 (Token) 验证成功")
-        logger.debug(f"[ ws 服务器 ] 接收到的 Token 为：{token}")
-
-        return True
-    
-    async def get_unique_connection_id(self, base_connection_id):
+            return connection.respond(HTTPStatus.UNAUTHORIZED, "token 无效\n")
+        connection.auth_grant = grant
+        hot.info("[ ws 服务器 ] 子协议 (Token) 验证成功: %s", grant.name)
+        return None
+
+    def select_subprotocol(self, connection, subprotocols):
+        """回应子协议第一项 (token，已在 process_handshake 中验证)"""
+        return subprotocols[0] if subprotocols else None
+
+    def limit_handshake(self, connection):
+        """按客户端 IP 限制握手频率，超出时返回 429 响应，否则返回 None"""
+        if self.ip_limiter is None or not connection.remote_address:
+            return None
+        ip = connection.remote_address[0]
+        if self.ip_limiter.allow(ip):
+            return None
+        self.rate_limited["ip"].inc()
+        hot.warning("[ ws 服务器 / 限流 ] 来自 %s 的握手过于频繁，已拒绝", ip)
+        response = connection.respond(HTTPStatus.TOO_MANY_REQUESTS, "请求过于频繁\n")
+        response.headers["Retry-After"] = str(math.ceil(self.ip_limiter.retry_after(ip)))
+        return response
+
+    def admit_message(self, connection_key, token):
         """
-        检查是否有同名项，并在标识符后加上递增数字（如 _2，_3 等）
+        按连接与 token (名称) 各取一个令牌，在解析 JSON 之前调用；被限流时返回限流范围 ("connection" / "token")，否则返回 None
         """
-        connection_id = base_connection_id
-        counter = 1
-
-        # 如果已有相同标识符，则继续递增数字后缀
-        while connection_id in connections:
-            match = re.search(r"_(\d+)$", connection_id)  # 查找后缀数字部分
-            if match:
-                # 如果已找到类似 _2, _3 的后缀，则递增
-                counter = int(match.group(1)) + 1
-                connection_id = f"{base_connection_id}_{counter}"
-            else:
-                # 如果没有找到数字后缀，则添加 _2
-                connection_id = f"{base_connection_id}_2"
-        
-        return connection_id
-        return True
+        if self.connection_limiter is not None and not self.connection_limiter.allow(connection_key):
+            return "connection"
+        if self.token_limiter is not None and not self.token_limiter.allow(token):
+            return "token"
+        return None
+
+    def throttled_response(self, scope, connection_key, token):
+        """记录一次限流，返回告知客户端的错误，附带建议的重试等待秒数"""
+        self.rate_limited[scope].inc()
+        limiter, key = (self.connection_limiter, connection_key) if scope == "connection" else (self.token_limiter, token)
+        return {"error": "请求过于频繁", "scope": scope, "retry_after": round(limiter.retry_after(key), 3)}
+
+    async def notify_throttled(self, websocket, scope, connection_key, token):
+        """通知客户端已被限流"""
+        response = self.throttled_response(scope, connection_key, token)
+        hot.warning("[ ws 服务器 / 限流 ] 连接 %s 发送消息过于频繁 (%s)，丢弃消息直到令牌恢复", connection_key, scope)
+        try:
+            await websocket.send(json.dumps(response))
+        except ConnectionClosed:
+            pass
 
-    async def process_message(self, websocket, message):
+    def decode_message(self, message):
         """
-        处理从 WebSocket 接收到的消息
+        将收到的帧解析为字典，无法解析时返回 None
         """
         try:
-            if isinstance(message, str):
+            if isinstance(message, (str, bytes)):
                 message = json.loads(message)  # 将字符串解析为字典
         except json.JSONDecodeError:
             logger.error("[ 插件消息分发 ] 无法解析 message 为字典: 非有效的 JSON 格式")
+            return None
         except Exception as e:
-            logger.error(f"[ 插件消息分发 ] 处理消息时发生错误: {e}")
-            return
+            logger.error("[ 插件消息分发 ] 处理消息时发生错误: %s", e)
+            return None
+
+        if not isinstance(message, dict):
+            logger.error("[ 插件消息分发 ] 消息必须是 JSON 对象")
+            return None
+        return message
 
-        semaphore = asyncio.Semaphore(200)  # 限制并发处理任务数量为200
+    async def process_message(self, websocket, message):
+        """
+        处理从 WebSocket 接收到的消息
+        """
+        if not isinstance(message, dict):
+            message = self.decode_message(message)
+            if message is None:
+                return
+
+        if message.get("plugin") == "batch":
+            await self.process_batch(websocket, message)
+            return
 
         try:
 
-            await self.plugin_manager.dispatch_message(websocket, message, semaphore)
+            await self.plugin_manager.dispatch_message(websocket, message, self.dispatch_semaphore)
 
         except KeyError as e:
             if str(e) == "'喵喵喵'":
-                logger.debug("[ 插件消息分发 ] 收到的消息中缺少 '喵喵喵' 字段")
+                hot.debug("[ 插件消息分发 ] 收到的消息中缺少 '喵喵喵' 字段")
             else:
-                logger.error(f"[ 插件消息分发 ] 某个插件在处理消息时出错: {e}")
+                logger.error("[ 插件消息分发 ] 某个插件在处理消息时出错: %s", e)
         except Exception as e:
-            logger.error(f"[ 插件消息分发 ] 某个插件在处理消息时出错: {e}")
+            logger.error("[ 插件消息分发 ] 某个插件在处理消息时出错: %s", e)
+
+    async def process_batch(self, websocket, message):
+        """
+        处理 batch 请求：并发分发其中的所有子请求，并将结果合并为一帧返回
+
+        请求: {"plugin": "batch", "id": 可选, "requests": [{"plugin": ..., "method": ..., "message": ...}, ...]}
+        响应: {"plugin": "batch", "id": 同请求, "responses": [与 requests 一一对应的结果]}
+        子请求没有回复时对应位置为 null，有多条回复时为数组
+        每个子请求与单独发送的消息一样计入限流，被限流的子请求对应位置为限流错误
+        """
+        requests = message.get("requests")
+        if not isinstance(requests, list):
+            await reply(websocket, message, {"plugin": "batch", "error": "requests 必须是数组"})
+            return
+        if len(requests) > self.max_batch_size:
+            await reply(websocket, message, {"plugin": "batch", "error": f"子请求数量超过上限 {self.max_batch_size}"})
+            return
+
+        collectors = [BatchCollector(websocket) for _ in requests]
+        await asyncio.gather(*(
+            self._process_sub_request(collector, sub_request)
+            for collector, sub_request in zip(collectors, requests)
+        ))
+
+        await reply(websocket, message, {
+            "plugin": "batch",
+            "responses": [collector.result() for collector in collectors],
+        })
+
+    async def _process_sub_request(self, collector, sub_request):
+        """分发 batch 中的单个子请求，回复由 collector 收集"""
+        if not isinstance(sub_request, dict):
+            collector.collect({"error": "子请求必须是 JSON 对象"})
+            return
+        if sub_request.get("plugin") == "batch":
+            collector.collect({"error": "batch 不能嵌套"})
+            return
+        info = self.connections.get_by_socket(collector.websocket)
+        if info is not None:
+            scope = self.admit_message(info.connection_id, info.token)
+            if scope is not None:
+                collector.collect(self.throttled_response(scope, info.connection_id, info.token))
+                return
+        await self.process_message(collector, sub_request)
+
+    async def _dispatch_tracked(self, websocket, message):
+        """分发消息并记录在途数量，供优雅退出时等待"""
+        self.active_dispatches += 1
+        try:
+            await self.process_message(websocket, message)
+        finally:
+            self.active_dispatches -= 1
+            if self.draining and not self.active_dispatches:
+                self._drained.set()
 
     async def handle_message(self, websocket):
         """
@@ -147,42 +519,83 @@ class WebSocketServer:
             connection = connection if connection is not None else "非在线地址"
             host = websocket.request.headers.get('Host')
             ua = websocket.request.headers.get('User-Agent')
-            logger.info(f"[ ws 服务器 ] {connection} | {origin} > ws://{host} ")
-            logger.debug(f"[ ws 服务器 ] 用户 UA | \n {ua} ")
+            hot.info("[ ws 服务器 ] %s | %s > ws://%s ", connection, origin, host)
+            hot.debug("[ ws 服务器 ] 用户 UA | \n %s ", ua)
             sec_websocket_key = websocket.request.headers.get('Sec-WebSocket-Key')
             # 解析 Sec-WebSocket-Protocol 头部
             protocol_string = websocket.request.headers.get('Sec-WebSocket-Protocol')
             if protocol_string:
                 protocol_list = [item.strip() for item in protocol_string.split(',')]
-                token = protocol_list[0]  # token 在协议字段的第一部分
-                mark = protocol_list[1]  # mark 在协议字段的第二部分
-                # 检测协议头中的 token 是否与配置文件一致
-                if await self.validate_token(token): pass
-                if await self.validate_token(token): pass
+                mark = protocol_list[1]  # mark 在协议字段的第二部分 (第一部分的 token 已在握手时验证)
+                grant = websocket.auth_grant
+
+                # 保存 WebSocket 连接，connection_id 由注册表按 mark 分配 (mark、mark_2 ...)；
+                # 原生客户端不发送 Origin，同样登记，广播与按插件筛选都能覆盖
+                info = self.connections.add(websocket, mark, origin, sec_websocket_key, host, ua)
+                info.settings = self._negotiated_settings(websocket)
+                info.token = grant.name
+                connection_id = info.connection_id
+                hot.info("[ ws 服务器 ] WebSocket 连接已建立，Connection ID: %s", connection_id)
 
-                if origin and sec_websocket_key:
-                    connection_id = f"{mark}_{origin}_{sec_websocket_key}"
+                # 同一连接的在途请求数限制，达到上限时暂停读取，形成背压
+                inflight_limit = asyncio.Semaphore(self.max_inflight)
+                pipelined = set()  # 本连接流水线处理中的任务，连接关闭时取消
 
-                    # 检查是否已存在该标识符
-                    connection_id = await self.get_unique_connection_id(connection_id)
-                    # 保存 WebSocket 连接
-                    connections[connection_id] = websocket
-                    logger.info(f"[ ws 服务器 ] WebSocket 连接已建立，Connection ID: {connection_id}")
+                def _on_done(task):
+                    self.inflight_tasks.discard(task)
+                    pipelined.discard(task)
+                    inflight_limit.release()
+
+                limit_key = connection_id  # 按连接限流的键
+                throttled = False  # 是否处于限流状态，进入时只通知一次，之后的消息直接丢弃
 
                 try:
 
-                    async for message in websocket:
-                        await self.process_message(websocket, message)
+                    async for raw in websocket:
+                        scope = self.admit_message(limit_key, grant.name)
+                        if scope is not None:
+                            if not throttled:
+                                throttled = True
+                                await self.notify_throttled(websocket, scope, limit_key, grant.name)
+                            continue
+                        throttled = False
+
+                        message = self.decode_message(raw)
+                        if message is None:
+                            continue
+
+                        if self.draining:
+                            # 服务器正在退出，不再分发新消息
+                            if message.get("id") is not None:
+                                await reply(websocket, message, {"error": "服务器正在关闭"})
+                            continue
+
+                        if message.get("id") is None:
+                            # 未携带 id 的请求保持严格的请求-响应顺序
+                            await self._dispatch_tracked(websocket, message)
+                            continue
+
+                        # 携带 id 的请求流水线处理：不等待上一个请求完成，响应可能乱序返回，由客户端按 id 匹配
+                        await inflight_limit.acquire()
+                        task = asyncio.create_task(self._dispatch_tracked(websocket, message))
+                        self.inflight_tasks.add(task)
+                        pipelined.add(task)
+                        task.add_done_callback(_on_done)
 
                 except Exception as e:
                     if "no close frame received or sent" in str(e):
-                        logger.debug(f"[ ws 服务器 ] 未接收或发送关闭帧: {e}")
+                        hot.debug("[ ws 服务器 ] 未接收或发送关闭帧: %s", e)
                         return
-                    logger.error(f"[ ws 服务器 ] 解析时 websocket 对象时出错: {e}")
+                    logger.error("[ ws 服务器 ] 解析时 websocket 对象时出错: %s", e)
                 finally:
                     # 无论连接是否正常关闭，都会进入此块，进行清理操作
-                    self.remove_connection(connection_id)
-                    logger.info(f"[ ws 会话管理 ] WebSocket 连接已断开，Connection ID: {connection_id}")
+                    for task in list(pipelined):
+                        task.cancel()  # 连接已关闭，不再为它执行插件代码
+                    if self.connection_limiter is not None:
+                        self.connection_limiter.forget(limit_key)
+                    if connection_id in self.connections:  # 可能已被广播移出
+                        self.remove_connection(connection_id)
+                        hot.info("[ ws 会话管理 ] WebSocket 连接已断开，Connection ID: %s", connection_id)
 
             else:
                 logger.warning("[ ws 服务器 ] 没有找到 Sec-WebSocket-Protocol 头部")
@@ -204,21 +617,122 @@ class WebSocketServer:
 
     async def log_connections(self):
         """
-        每隔 10 秒钟打印一次当前的连接列表
+        每隔 10 秒钟检查一次连接列表，仅在发生变化时打印连接摘要；
+        同时检查 token 文件，使吊销与权限变更在没有新握手时也能对已建立的连接生效
         """
+        last_version = self.connections.version
         while True:
-            await asyncio.sleep(10)  # 每隔 10 秒打印一次连接列表
-            logger.debug(f"[ ws 会话管理 ] 当前连接列表: {list(connections.keys())}")
+            await asyncio.sleep(10)
+            self.tokens.refresh()
+            if self.connections.version == last_version:
+                continue
+            last_version = self.connections.version
+            if hot.enabled(logging.DEBUG):
+                logger.debug("[ ws 会话管理 ] 当前连接摘要: %s", self.connections.summary())
 
     def remove_connection(self, connection_id):
         """
         移除连接
         """
-        if connection_id in connections:
-            del connections[connection_id]
-            logger.info(f"[ ws 会话管理 ] 连接 {connection_id} 已被移除")
+        if self.connections.remove(connection_id) is not None:
+            hot.info("[ ws 会话管理 ] 连接 %s 已被移除", connection_id)
         else:
-            logger.warning(f"[ ws 会话管理 ] 尝试移除一个不存在的连接: {connection_id}")
+            logger.warning("[ ws 会话管理 ] 尝试移除一个不存在的连接: %s", connection_id)
+
+    def _negotiated_settings(self, websocket):
+        """记录该连接握手时实际协商到的传输参数"""
+        settings = {"preset": self.ws_preset, "compression": None}
+        for extension in websocket.protocol.extensions:
+            if extension.name == "permessage-deflate":
+                settings["compression"] = {
+                    "name": extension.name,
+                    "server_max_window_bits": extension.local_max_window_bits,
+                    "client_max_window_bits": extension.remote_max_window_bits,
+                    "server_no_context_takeover": extension.local_no_context_takeover,
+                    "client_no_context_takeover": extension.remote_no_context_takeover,
+                }
+        return settings
+
+    def _select_connections(self, selector):
+        """根据 selector 选出需要广播的连接"""
+        if selector is None or selector == "all":
+            return self.connections.select()
+        if isinstance(selector, dict):
+            return self.connections.select(
+                mark=selector.get("mark"),
+                origin=selector.get("origin"),
+                plugin=selector.get("plugin"),
+            )
+        if callable(selector):
+            return [info for info in self.connections if selector(info)]
+        # 其余情况视为 connection_id 列表
+        return [info for info in map(self.connections.get, selector) if info is not None]
+
+    async def broadcast(self, payload, selector=None, timeout=None, local_only=False):
+        """
+        向全部或部分连接广播同一条消息
+
+        payload: dict / list 会且只会被序列化一次；str / bytes 视为已编码好的文本帧
+        selector: None 或 "all" 表示全部连接；
+                  dict 按 mark / origin / plugin 索引筛选 (多个条件取交集)；
+                  函数 (接收 ConnectionInfo，返回 bool)；
+                  或 connection_id 列表
+        timeout: 单个连接的发送超时，默认使用 BROADCAST_TIMEOUT
+        local_only: 多 worker 模式下默认同时经集群总线转发给其他 worker；
+                    为 True 时只发给本 worker 的连接 (函数形式的 selector 无法跨进程，总是只在本地生效)
+
+        各连接并发发送，已断开或发送超时的连接会被移出连接列表
+        返回本 worker 的 {"delivered": 成功数, "dropped": 失败数}，其他 worker 的发送结果不等待
+        """
+        if isinstance(payload, bytes):
+            frame = payload
+        elif isinstance(payload, str):
+            frame = payload.encode("utf-8")
+        else:
+            frame = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+        if self.cluster is not None and not local_only and not callable(selector):
+            self.cluster.publish("broadcast", frame=frame.decode("utf-8"), selector=selector, timeout=timeout)
+
+        targets = self._select_connections(selector)
+        if not targets:
+            return {"delivered": 0, "dropped": 0}
+
+        timeout = self.broadcast_timeout if timeout is None else timeout
+        results = await asyncio.gather(*(self._send_frame(info, frame, timeout) for info in targets))
+
+        delivered = sum(results)
+        dropped = len(results) - delivered
+        hot.debug("[ ws 广播 ] 广播完成，成功 %s 个，失败 %s 个", delivered, dropped)
+        return {"delivered": delivered, "dropped": dropped}
+
+    async def _on_cluster_broadcast(self, frame):
+        """其他 worker 发起的广播，只发送给本 worker 的连接"""
+        await self.broadcast(frame["frame"], frame.get("selector"), frame.get("timeout"), local_only=True)
+
+    async def _on_cluster_plugin_manager(self, frame):
+        """其他 worker 转发的插件管理命令，回复已由发起的 worker 发送，这里丢弃"""
+        await self.plugin_manager.pluginManager(DiscardSocket(), frame["message"], relayed=True)
+
+    async def _send_frame(self, info, frame, timeout):
+        """向单个连接发送已编码的文本帧，失败时将其移出连接列表"""
+        websocket = info.websocket
+        try:
+            # bytes + text=True: 直接以文本帧发送已编码的 UTF-8 数据，不再逐连接编码
+            await asyncio.wait_for(websocket.send(frame, text=True), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("[ ws 广播 ] 连接 %s 发送超时，断开慢连接", info.connection_id)
+            self.remove_connection(info.connection_id)
+            # 关闭握手本身也可能很慢，放到后台进行
+            asyncio.create_task(websocket.close(code=1013, reason="too slow"))
+        except ConnectionClosed:
+            hot.debug("[ ws 广播 ] 连接 %s 已断开，移出连接列表", info.connection_id)
+            self.remove_connection(info.connection_id)
+        except Exception as e:
+            logger.error("[ ws 广播 ] 向连接 %s 发送消息时出错: %s", info.connection_id, e)
+            self.remove_connection(info.connection_id)
+        return False
 
     async def start_server(self):
         """
@@ -226,21 +740,24 @@ class WebSocketServer:
         """
         while True:
             try:
-                self.server = await websockets.serve(self.handle_message, self.host, self.port, subprotocols=[config.TOKEN])# 支持的子协议
+                self.server = await websockets.serve(
+                    self.handle_message, self.host, self.port,
+                    process_request=self.process_handshake,  # 握手前按 IP 限流并验证 token
+                    select_subprotocol=self.select_subprotocol,
+                    reuse_port=self.workers > 1,  # 多 worker 共享同一端口，由内核分配连接
+                    **self.ws_options,
+                )
                 logger.info(f"[ ws 服务器 ] WebSocket 服务器启动在地址 ws://{self.host}:{self.port}")
-        while True:
-            try:
-                self.server = await websockets.serve(self.handle_message, self.host, self.port, subprotocols=[config.TOKEN])# 支持的子协议
-                logger.info(f"[ ws服务器 ] WebSocket 服务器启动在地址 ws://{self.host}:{self.port}")
+                if self.workers > 1:
+                    logger.info(f"[ ws 服务器 ] 当前为 worker {self.worker_id} / {self.workers}")
+                logger.info(f"[ ws 服务器 ] 传输预设: {self.ws_preset}")
 
-                # 初始化插件管理器并加载插件
-                await self.plugin_manager.load_plugins('plugins', 'plugins/example') 
                 # 初始化插件管理器并加载插件
                 await self.plugin_manager.load_plugins('plugins', 'plugins/example') 
 
-                # 等待服务器关闭
-                await self.server.wait_closed()
-                logger.info(f"[ ws 服务器 ] WebSocket 服务器已关闭")
+                # 等待退出信号，然后优雅地关闭服务器
+                await self.shutdown_event.wait()
+                await self.shutdown()
 
                 return
 
@@ -252,41 +769,19 @@ class WebSocketServer:
             except PermissionError as e:
                 logging.error(f"[ ws 服务器 ] 权限错误：无法绑定端口 {self.port}. 请检查是否有足够的权限，或该端口是否被其他进程占用。")
                 logging.exception(e)
+                self.exit_code = 1
                 return 
-                # 等待服务器关闭
-                await self.server.wait_closed()
-                logger.info(f"[ ws服务器 ] WebSocket 服务器已关闭")
-                
-                sys.exit(1)
-
-            except NegotiationError as e:
-                # 捕获协议协商错误
-                logging.error(f"[ ws服务器 ] 认证错误，无效的子协议，客户端与服务器的协议或 token 不匹配。\n{e}")
-                # 这里可以做一些处理，比如记录日志、通知管理员等
-            
-            except PermissionError as e:
-                logging.error(f"[ ws服务器 ] 权限错误：无法绑定端口 {self.port}. 请检查是否有足够的权限，或该端口是否被其他进程占用。")
-                logging.exception(e)
-                sys.exit(1)  
 
             except OSError as e:
                 # 如果是 OSError 也可能是其他网络相关的错误
                 logging.error(f"[ ws 服务器 ] OSError 错误：无法绑定地址 {self.host}:{self.port}")
                 logging.exception(e)
+                self.exit_code = 1
                 return
-            except OSError as e:
-                # 如果是 OSError 也可能是其他网络相关的错误
-                logging.error(f"[ ws服务器 ] OSError 错误：无法绑定地址 {self.host}:{self.port}")
-                logging.exception(e)
-                sys.exit(1)
 
             except Exception as e:
                 # 捕获其他未预料的错误
                 logging.error("[ ws 服务器 ] 服务器启动失败")
                 logging.exception(e)
+                self.exit_code = 1
                 return
-            except Exception as e:
-                # 捕获其他未预料的错误
-                logging.error("[ ws服务器 ] 服务器启动失败")
-                logging.exception(e)
-                sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,159 @@
+# session.py
+
+import time
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+class ConnectionInfo:
+    """单个 ws 连接的元信息"""
+    __slots__ = (
+        "connection_id", "websocket", "mark", "origin", "key",
+        "host", "user_agent", "connected_at", "plugins", "settings", "token",
+    )
+
+    def __init__(self, connection_id, websocket, mark, origin=None, key=None, host=None, user_agent=None):
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.mark = mark
+        self.origin = origin
+        self.key = key                  # Sec-WebSocket-Key，不再拼接进 connection_id
+        self.host = host
+        self.user_agent = user_agent
+        self.connected_at = time.time()
+        self.plugins = set()            # 该连接订阅 (访问过) 的插件
+        self.settings = {}              # 握手时实际协商到的传输参数 (压缩等)
+        self.token = None               # 握手时使用的 token 名称
+
+    def to_dict(self):
+        return {
+            "connection_id": self.connection_id,
+            "mark": self.mark,
+            "origin": self.origin,
+            "host": self.host,
+            "connected_at": self.connected_at,
+            "plugins": sorted(self.plugins),
+            "settings": self.settings,
+            "token": self.token,
+        }
+
+class ConnectionRegistry:
+    """
+    ws 连接注册表
+
+    - connection_id 由 mark 加递增后缀组成 (mark, mark_2, mark_3 ...)，每个 mark 维护一个计数器，分配为 O(1)
+    - 按 websocket / mark / origin / 订阅插件 建立二级索引，广播时无需遍历全部连接
+    """
+    def __init__(self):
+        self._connections = {}              # connection_id -> ConnectionInfo
+        self._by_socket = {}                # websocket -> ConnectionInfo
+        self._by_mark = defaultdict(set)    # mark -> {connection_id}
+        self._by_origin = defaultdict(set)  # origin -> {connection_id}
+        self._by_plugin = defaultdict(set)  # 插件名 -> {connection_id}
+        self._counters = {}                 # mark -> 已分配的最大后缀
+        self.version = 0                    # 每次增删连接时递增，用于判断连接列表是否发生变化
+
+    def __len__(self):
+        return len(self._connections)
+
+    def __contains__(self, connection_id):
+        return connection_id in self._connections
+
+    def __iter__(self):
+        """遍历所有连接的 ConnectionInfo"""
+        return iter(list(self._connections.values()))
+
+    def _allocate_id(self, mark):
+        """为 mark 分配一个唯一的 connection_id"""
+        while True:
+            counter = self._counters.get(mark, 0) + 1
+            self._counters[mark] = counter
+            connection_id = mark if counter == 1 else f"{mark}_{counter}"
+            # 只有当其他客户端的 mark 恰好形如 "xxx_2" 时才会冲突，继续递增即可
+            if connection_id not in self._connections:
+                return connection_id
+
+    def add(self, websocket, mark, origin=None, key=None, host=None, user_agent=None):
+        """注册一个新连接，返回其 ConnectionInfo"""
+        mark = mark or "anonymous"
+        connection_id = self._allocate_id(mark)
+        info = ConnectionInfo(connection_id, websocket, mark, origin, key, host, user_agent)
+
+        self._connections[connection_id] = info
+        self._by_socket[websocket] = info
+        self._by_mark[mark].add(connection_id)
+        self._by_origin[origin].add(connection_id)  # 未携带 Origin 的连接 (原生客户端) 归入 None
+        self.version += 1
+        return info
+
+    def remove(self, connection_id):
+        """移除连接并清理所有索引，连接不存在时返回 None"""
+        info = self._connections.pop(connection_id, None)
+        if info is None:
+            return None
+
+        self._by_socket.pop(info.websocket, None)
+        self._discard(self._by_mark, info.mark, connection_id)
+        if not self._by_mark.get(info.mark):
+            # 该 mark 已没有任何连接，计数器从头开始
+            self._counters.pop(info.mark, None)
+        self._discard(self._by_origin, info.origin, connection_id)
+        for plugin_name in info.plugins:
+            self._discard(self._by_plugin, plugin_name, connection_id)
+        self.version += 1
+        return info
+
+    @staticmethod
+    def _discard(index, key, connection_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(connection_id)
+            if not ids:
+                del index[key]
+
+    def get(self, connection_id):
+        return self._connections.get(connection_id)
+
+    def get_by_socket(self, websocket):
+        return self._by_socket.get(websocket)
+
+    def subscribe(self, websocket, plugin_name):
+        """记录连接与插件之间的订阅关系 (已订阅时只是一次集合查找)"""
+        info = self._by_socket.get(websocket)
+        if info is None or plugin_name in info.plugins:
+            return
+        info.plugins.add(plugin_name)
+        self._by_plugin[plugin_name].add(info.connection_id)
+
+    def select(self, mark=None, origin=None, plugin=None):
+        """
+        按条件筛选连接，多个条件取交集；不传任何条件时返回全部连接
+
+        先取最小的索引集合再做交集，结果为 ConnectionInfo 列表
+        """
+        candidates = []
+        if mark is not None:
+            candidates.append(self._by_mark.get(mark, ()))
+        if origin is not None:
+            candidates.append(self._by_origin.get(origin, ()))
+        if plugin is not None:
+            candidates.append(self._by_plugin.get(plugin, ()))
+
+        if not candidates:
+            return list(self._connections.values())
+
+        candidates.sort(key=len)
+        smallest, rest = candidates[0], candidates[1:]
+        return [
+            self._connections[connection_id]
+            for connection_id in smallest
+            if all(connection_id in ids for ids in rest)
+        ]
+
+    def summary(self):
+        """连接数量摘要 (按 mark 统计)，用于日志与状态查询"""
+        return {
+            "total": len(self._connections),
+            "marks": {mark: len(ids) for mark, ids in self._by_mark.items()},
+        }